@@ -0,0 +1,210 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import hashlib, os
+from detail_parser import parse_detail_page, to_entry
+from rescrape import content_hash, parse_accessed
+from report import rebuild_aggregates
+
+
+class PageArchive:
+    def __init__(self, root, writer=None, level=10):
+        """
+        Keeps the raw detail pages the workers fetch, zstd-compressed and
+        stored once per distinct content under root/ab/<sha256>.zst. Each
+        fetch is indexed in the pages collection by TDCJ number and fetch
+        time, so records can be parsed again without scraping them again.
+
+        Args:
+            root (str): directory holding the compressed pages
+            writer (BufferedWriter): buffer writing the index documents
+            level (int): zstd compression level
+        """
+        self.root = root
+        self.writer = writer
+        self.level = level
+        self.compressor = None
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, sha):
+        return os.path.join(self.root, sha[:2], f"{sha}.zst")
+
+    def put(self, html):
+        """
+        Stores a page unless the same content is stored already.
+
+        Returns:
+            str: sha256 hex digest of the page, its key in the archive
+        """
+        data = html.encode("utf-8")
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.path(sha)
+        if not os.path.exists(path):
+            if self.compressor is None:
+                self.compressor = _zstd().ZstdCompressor(level=self.level)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, so a crash never leaves a truncated page behind
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(self.compressor.compress(data))
+            os.replace(tmp, path)
+        return sha
+
+    async def store(self, tdcjnum, html, fetched):
+        """
+        Archives a detail page and queues its index document.
+
+        Args:
+            tdcjnum (int or str): TDCJ number the page belongs to
+            html (str): detail page
+            fetched (datetime): when the page was fetched
+        """
+        sha = self.put(html)
+        if self.writer is not None:
+            await self.writer.insert("pages", index_doc(tdcjnum, sha, fetched))
+
+
+def index_doc(tdcjnum, sha, fetched):
+    """
+    Index document of one fetch, with an _id unique per number and time.
+    """
+    tdcjnum = int(tdcjnum)
+    return {
+        "_id": f"{tdcjnum:08d}_{fetched.strftime('%Y%m%d_%H%M%S')}",
+        "tdcj_number": tdcjnum,
+        "fetched": fetched,
+        "sha256": sha,
+    }
+
+
+def read_page(root, sha):
+    """
+    Returns the archived page with the given key.
+    """
+    with open(os.path.join(root, sha[:2], f"{sha}.zst"), "rb") as f:
+        return _zstd().ZstdDecompressor().decompress(f.read()).decode("utf-8")
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("The page archive needs the zstandard package") from None
+    return zstandard
+
+
+def latest_pages(db, numbers=None):
+    """
+    Yields (tdcj number, sha256, fetched) of the latest archived page of
+    every number, or of the given numbers only.
+    """
+    pipeline = [
+        {"$sort": {"tdcj_number": 1, "fetched": 1}},
+        {"$group": {
+            "_id": "$tdcj_number",
+            "sha256": {"$last": "$sha256"},
+            "fetched": {"$last": "$fetched"},
+        }},
+    ]
+    if numbers is not None:
+        pipeline.insert(0, {"$match": {"tdcj_number": {"$in": list(numbers)}}})
+    for doc in db.pages.aggregate(pipeline, allowDiskUse=True):
+        yield doc["_id"], doc["sha256"], doc["fetched"]
+
+
+def _reparse_chunk(root, items):
+    """
+    Rebuilds the inmate documents of one chunk of archived pages. Run in the
+    worker processes.
+
+    Returns:
+        tuple: (list of documents, list of (tdcj number, error message))
+    """
+    docs, errors = [], []
+    for tdcjnum, sha, fetched in items:
+        try:
+            entry = to_entry(parse_detail_page(read_page(root, sha)), fetched)
+        except (OSError, ValueError) as e:
+            errors.append((tdcjnum, repr(e)))
+            continue
+        entry["hash"] = content_hash(entry)
+        docs.append(entry)
+    return docs, errors
+
+
+def reparse(db, root, processes=None, chunksize=500, everything=False, pmode=1):
+    """
+    Rebuilds inmates documents from their latest archived page on all cores.
+    By default only numbers still in inmates are rebuilt, so released
+    inmates stay released, and documents scraped after their latest archived
+    page are kept.
+
+    Args:
+        db (pymongo.database.Database): database holding pages and inmates
+        root (str): archive directory
+        processes (int): worker processes, defaults to the number of cores
+        chunksize (int): pages per task handed to a worker
+        everything (bool): rebuild every archived number, also those not in inmates
+        pmode (int): print mode. Higher the number, the more is printed
+
+    Returns:
+        int: number of documents rebuilt
+    """
+    from pymongo import ReplaceOne
+
+    accessed = {d["_id"]: d.get("accessed") for d in db.inmates.find({}, {"accessed": 1})}
+    numbers = None if everything else [int(n) for n in accessed]
+
+    # version 1 documents only know the minute they were accessed
+    def minute(t):
+        return t.replace(second=0, microsecond=0) if t else datetime.min
+
+    items = [
+        (n, sha, fetched)
+        for n, sha, fetched in latest_pages(db, numbers)
+        if minute(parse_accessed(accessed.get(str(n).zfill(8)))) <= minute(fetched)
+    ]
+    chunks = [items[i : i + chunksize] for i in range(0, len(items), chunksize)]
+    if pmode >= 1:
+        print(f"Re-parsing {len(items)} pages in {len(chunks)} chunks")
+
+    count = 0
+    with ProcessPoolExecutor(processes) as pool:
+        for docs, errors in pool.map(_reparse_chunk, [root] * len(chunks), chunks):
+            if docs:
+                written = datetime.now()
+                for d in docs:
+                    d["written"] = written
+                db.inmates.bulk_write(
+                    [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs],
+                    ordered=False,
+                )
+            count += len(docs)
+            for tdcjnum, message in errors:
+                print(f"Could not re-parse {tdcjnum}: {message}")
+            if pmode >= 2:
+                print(f"{count} of {len(items)} documents rebuilt")
+    # the replaced documents' old values are gone, so recount from scratch
+    if count:
+        rebuild_aggregates(db)
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(
+        description="Rebuilds inmates documents from the raw page archive."
+    )
+    parser.add_argument("root", help="archive directory")
+    parser.add_argument("-j", "--processes", type=int, default=None)
+    parser.add_argument("-c", "--chunksize", type=int, default=500)
+    parser.add_argument("--all", dest="everything", action="store_true",
+        help="also rebuild archived numbers no longer in inmates")
+    parser.add_argument("-p", "--pmode", type=int, default=1)
+    args = parser.parse_args()
+
+    db = MongoClient("localhost", 27017).tdcj
+    start = datetime.now()
+    n = reparse(db, args.root, args.processes, args.chunksize, args.everything, args.pmode)
+    print(f"{n} inmates rebuilt in {datetime.now() - start}")
@@ -0,0 +1,186 @@
+from itertools import groupby
+import numpy as np
+import pandas as pd
+from canonical import canonicalize
+from rescrape import ACCESSED_FORMAT
+from schema import MSD_CATEGORIES, OFFENSE_FIELDS, SENTENCE_COLUMN, is_current
+
+
+def prep_offender_batch(entries):
+    """
+    Cleans a chunk of mongo documents at once. Gives the same values as
+    running pgpipe.prep_offender_data on each document, but as two columnar
+    frames, and without modifying the documents. Documents of both schema
+    versions are accepted, in any mix, and keep their order.
+
+    Args:
+        entries: iterable of offenders' info and offense history
+
+    Returns:
+        tuple: (offenders DataFrame with one row per entry,
+            offenses DataFrame with one row per offense)
+
+    Raises:
+        ValueError for unhandled maximum sentence dates or sentence lengths
+    """
+    parts = [
+        (_prep_current if current else _prep_legacy)(list(group))
+        for current, group in groupby(entries, key=is_current)
+    ]
+    if len(parts) == 1:
+        offenders, offenses = parts[0]
+    else:
+        offenders, offenses = (
+            pd.concat(frames, ignore_index=True) for frames in zip(*parts))
+
+    msd_cat = offenders['MSD_cat'].abs()
+    for col, outranked in (
+        ('Projected Release Date', msd_cat > 1),
+        ('Parole Eligibility Date', msd_cat > 2),
+    ):
+        offenders[col] = offenders[col].astype(object)
+        offenders.loc[outranked | (offenders[col] == 'NOT AVAILABLE'), col] = None
+    offenders['Gender'] = offenders['Gender'] == 'F'
+
+    # canonicalize each distinct offense once rather than once per row
+    offenses['Canonical Offense'] = offenses['Offense'].map(
+        {o: canonicalize(o) for o in offenses['Offense'].dropna().unique()})
+    return offenders, offenses
+
+
+def _prep_legacy(entries):
+    """
+    Parses the strings of version 1 documents into offenders and offenses
+    frames.
+    """
+    offenders = pd.DataFrame.from_records(
+        [{k: v for k, v in e.items() if k != 'offensetable'} for e in entries])
+    offenders['Maximum Sentence Date'], offenders['MSD_cat'] = split_msd_cat(
+        offenders['Maximum Sentence Date'], offenders['_id'])
+    offenders['accessed'] = pd.to_datetime(offenders['accessed'], format=ACCESSED_FORMAT)
+
+    offenses = flatten_offenses(entries)
+    offenses['Sentence'] = sentence_str_to_days_int(
+        offenses.pop(SENTENCE_COLUMN), offenses['tdcj_num'])
+    return offenders, offenses
+
+
+def _prep_current(entries):
+    """
+    Frames the already typed fields of version 2 documents, checking for the
+    values the scraper kept because it couldn't read them.
+    """
+    offenders = pd.DataFrame.from_records(
+        [{k: v for k, v in e.items() if k != 'offenses'} for e in entries])
+    msd = offenders['Maximum Sentence Date']
+    bad = msd.map(lambda v: isinstance(v, str))
+    if bad.any():
+        first = bad.idxmax()
+        raise ValueError(
+            f'unhandled value: msd={msd[first]} tdcj_num={offenders["_id"][first]}')
+    offenders['Maximum Sentence Date'] = pd.to_datetime(msd)
+
+    offenses = pd.DataFrame.from_records(
+        [dict(record, tdcj_num=e['_id']) for e in entries for record in e['offenses']],
+        columns=[*OFFENSE_FIELDS, 'sentence_days', 'sentence', 'tdcj_num'])
+    bad = offenses['sentence_days'].isna()
+    if bad.any():
+        first = bad.idxmax()
+        raise ValueError(f'unhandled value: sentence={offenses["sentence"][first]} '
+            f'tdcj_num={offenses["tdcj_num"][first]}')
+    offenses = offenses.drop(columns='sentence')\
+        .rename(columns=dict(OFFENSE_FIELDS, sentence_days='Sentence'))
+    offenses['Sentence'] = offenses['Sentence'].astype(np.int64)
+    return offenders, offenses
+
+
+def flatten_offenses(entries):
+    """
+    Turns the column-oriented offense tables of many entries into one frame,
+    keeping each table's row order.
+
+    Args:
+        entries: list of mongo documents
+
+    Returns:
+        DataFrame with the offense table columns plus tdcj_num
+    """
+    columns = dict()
+    tdcj_nums = []
+    for entry in entries:
+        table = entry['offensetable']
+        rows = list(table['Offense'].keys())
+        for k in table:
+            if k not in columns:
+                columns[k] = [None] * len(tdcj_nums)
+        for k, col in columns.items():
+            values = table.get(k)
+            col.extend([values[i] for i in rows] if values is not None
+                else [None] * len(rows))
+        tdcj_nums.extend([entry['_id']] * len(rows))
+    # object columns keep each value as stored, ints don't turn into floats
+    # when another entry of the batch is missing one
+    offenses = pd.DataFrame(columns, dtype=object)
+    offenses['tdcj_num'] = tdcj_nums
+    return offenses
+
+
+def split_msd_cat(msd, ids):
+    """
+    Splits maximum sentence dates into the date portion and a code for the
+    occasional accompanying text, like pgpipe.split_msd_cat.
+
+    Args:
+        msd: Series of maximum sentence date strings
+        ids: Series of matching tdcj numbers, for error messages
+
+    Returns:
+        tuple: (datetime64 Series with NaT for codes, int Series of codes)
+
+    Raises:
+        ValueError for unhandled value cases
+    """
+    msd = msd.astype(str)
+    cumulative = msd.str.endswith('CUMULATIVE OFFENSES')
+    msd = msd.where(~cumulative, msd.str[:-19].str.strip())
+    category = msd.map(MSD_CATEGORIES)
+    is_date = category.isna()
+    dates = pd.to_datetime(msd.where(is_date), format='%Y-%m-%d', errors='coerce')
+
+    bad = is_date & dates.isna()
+    if bad.any():
+        first = bad.idxmax()
+        raise ValueError(f'unhandled value: msd={msd[first]} tdcj_num={ids[first]}')
+    mode = np.where(cumulative, -1, 1)
+    return dates, category.fillna(1).astype(int) * mode
+
+
+def sentence_str_to_days_int(sentences, ids):
+    """
+    Turns sentence lengths in either 'Y-M-D' or 'DDD Days' format into days,
+    like pgpipe.sentence_str_to_days_int.
+
+    Args:
+        sentences: Series of sentence length strings
+        ids: Series of matching tdcj numbers, for error messages
+
+    Returns:
+        int Series of days
+
+    Raises:
+        ValueError for strings in neither format
+    """
+    sentences = sentences.astype(str)
+    in_days = sentences.str.endswith('Days')
+    days = pd.to_numeric(
+        sentences.where(in_days).str[:-4].str.strip(), errors='coerce')
+    ymd = sentences.where(~in_days).str.extract(
+        r'^\s*(\d+)\s*-\s*(\d+)\s*-\s*(\d+)\s*$').astype(float)
+    days = days.where(in_days, ymd[0] * 365 + ymd[1] * 30 + ymd[2])
+
+    bad = days.isna()
+    if bad.any():
+        first = bad.idxmax()
+        raise ValueError(
+            f'unhandled value: sentence={sentences[first]} tdcj_num={ids[first]}')
+    return days.astype(np.int64)
@@ -0,0 +1,291 @@
+import glob, json, os, platform, random, statistics, subprocess, time
+from datetime import datetime
+from detail_parser import find_result_link, parse_detail_page, to_entry, to_legacy_entry
+import synthetic
+
+
+def timeit(fn, repeat=5):
+    """
+    Runs fn repeat times after one warm-up run.
+
+    Returns:
+        dict: best and median seconds per run
+    """
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times), "runs": repeat}
+
+
+def load_corpus(path):
+    """
+    Reads recorded pages from a directory of .html files and sorts them into
+    detail pages and search results pages with and without a result.
+
+    Returns:
+        tuple: (detail pages, result pages, no-result pages)
+    """
+    details, results, empty = [], [], []
+    for fname in sorted(glob.glob(os.path.join(path, "**", "*.html"), recursive=True)):
+        with open(fname, encoding="utf-8") as f:
+            html = f.read()
+        if find_result_link(html) is not None:
+            results.append(html)
+            continue
+        try:
+            parse_detail_page(html)
+            details.append(html)
+        except ValueError:
+            empty.append(html)
+    return details, results, empty
+
+
+def synthetic_corpus(n, seed=0):
+    """
+    Makes n detail pages, n result pages and n no-result pages.
+    """
+    rng = random.Random(seed)
+    inmates = [synthetic.random_inmate(rng, 1000000 + i) for i in range(n)]
+    details = [synthetic.detail_page(a, rows) for a, rows in inmates]
+    results = [
+        synthetic.results_page(a, f"offenderDetail.action?sid={a['SID Number']}")
+        for a, _ in inmates
+    ]
+    return details, results, [synthetic.no_result_page()] * n
+
+
+def bench_parsing(details, results, empty, repeat):
+    """
+    Times the extraction the workers run on every lookup.
+    """
+    accessed = datetime(2020, 1, 1)
+    out = {
+        "find_result_link": timeit(lambda: [find_result_link(h) for h in results], repeat),
+        "find_result_link_empty": timeit(lambda: [find_result_link(h) for h in empty], repeat),
+        "scrape_inmate_extract": timeit(
+            lambda: [to_entry(parse_detail_page(h), accessed) for h in details], repeat
+        ),
+    }
+    try:
+        from detail_parser import read_html_offense_table
+
+        out["read_html_offense_table"] = timeit(
+            lambda: [read_html_offense_table(h) for h in details], repeat
+        )
+    except ImportError:
+        pass
+    for name, n in (("find_result_link", len(results)),
+                    ("find_result_link_empty", len(empty)),
+                    ("scrape_inmate_extract", len(details)),
+                    ("read_html_offense_table", len(details))):
+        if name in out:
+            out[name]["items"] = n
+    return out
+
+
+def bench_cleaning(entries, legacy, repeat):
+    """
+    Times the per-record and batch cleaning of mongo documents, in the
+    current schema and in version 1, and the migration between them.
+    """
+    import pgpipe, batch_clean, schema
+    import pandas as pd
+
+    msds = [e["Maximum Sentence Date"] for e in legacy]
+    sentences = [
+        s for e in legacy for s in e["offensetable"]["Sentence (YY-MM-DD)"].values()
+    ]
+    ids = pd.Series([e["_id"] for e in legacy])
+    out = {
+        # prep_offender_data pops the offense table, so each run gets fresh copies
+        "prep_offender_data": timeit(
+            lambda: [pgpipe.prep_offender_data(dict(e)) for e in entries], repeat
+        ),
+        "prep_offender_batch": timeit(
+            lambda: batch_clean.prep_offender_batch([dict(e) for e in entries]), repeat
+        ),
+        "prep_offender_data_v1": timeit(
+            lambda: [pgpipe.prep_offender_data(dict(e)) for e in legacy], repeat
+        ),
+        "prep_offender_batch_v1": timeit(
+            lambda: batch_clean.prep_offender_batch([dict(e) for e in legacy]), repeat
+        ),
+        "schema_upgrade": timeit(lambda: [schema.upgrade(e) for e in legacy], repeat),
+        "split_msd_cat": timeit(lambda: [pgpipe.split_msd_cat(m) for m in msds], repeat),
+        "split_msd_cat_batch": timeit(
+            lambda: batch_clean.split_msd_cat(pd.Series(msds), ids), repeat
+        ),
+        "sentence_str_to_days_int": timeit(
+            lambda: [pgpipe.sentence_str_to_days_int(s) for s in sentences], repeat
+        ),
+        "sentence_str_to_days_int_batch": timeit(
+            lambda: batch_clean.sentence_str_to_days_int(
+                pd.Series(sentences), pd.Series(range(len(sentences)))
+            ),
+            repeat,
+        ),
+    }
+    for name in out:
+        out[name]["items"] = len(sentences) if name.startswith("sentence") else len(entries)
+    return out
+
+
+def bench_postgres(entries, repeat, dbname="tdcj_bench", batch_size=5000):
+    """
+    Times insert_offender and load_bulk against a scratch database on the
+    local postgres, recreated before every run.
+    """
+    import pgpipe
+    import psycopg2 as pg2
+
+    def run(load):
+        pgpipe._reset_tdcj_pgdb(dbname)
+        pgpipe._create_tables(dbname)
+        conn = pg2.connect(dbname=dbname, host="localhost", port=5432, user="postgres")
+        cur = conn.cursor()
+        docs = [dict(e) for e in entries]
+        start = time.perf_counter()
+        load(conn, cur, docs)
+        elapsed = time.perf_counter() - start
+        cur.close()
+        conn.close()
+        return elapsed
+
+    def timed(load):
+        times = [run(load) for _ in range(repeat)]
+        return {"best": min(times), "median": statistics.median(times), "runs": repeat,
+                "items": len(entries)}
+
+    def per_record(conn, cur, docs):
+        for doc in docs:
+            pgpipe.insert_offender(conn, cur, doc)
+        conn.commit()
+
+    out = {
+        "insert_offender": timed(per_record),
+        "load_bulk": timed(
+            lambda conn, cur, docs: pgpipe.load_bulk(
+                conn, cur, docs, print_count=len(docs) + 1, batch_size=batch_size
+            )
+        ),
+    }
+    pgpipe._reset_tdcj_pgdb(dbname)
+    return out
+
+
+def git_revision():
+    """
+    Returns the checked out commit, with '+dirty' if the tree has changes.
+    """
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return rev + ("+dirty" if dirty else "")
+
+
+def compare(old, new):
+    """
+    Prints the median of every benchmark in both results and the ratio.
+    """
+    print(f"{'benchmark':32} {old['revision']:>14} {new['revision']:>14}  ratio")
+    for name, result in new["benchmarks"].items():
+        before = old["benchmarks"].get(name)
+        if before is None:
+            continue
+        ratio = result["median"] / before["median"]
+        print(f"{name:32} {before['median']:14.4f} {result['median']:14.4f}  {ratio:.2f}x")
+
+
+def main(n=2000, repeat=5, seed=0, corpus=None, pg=False, outdir="bench_results",
+        against=None):
+    """
+    Runs the benchmarks and saves the results as JSON named after the commit.
+
+    Args:
+        n (int): synthetic pages and documents per benchmark
+        repeat (int): timed runs per benchmark
+        seed (int): seed of the synthetic corpus
+        corpus (str): directory of recorded .html pages to use instead
+        pg (bool): also time loading into a scratch database on the local postgres
+        outdir (str): directory to write the results to
+        against (str): earlier results file to compare with
+
+    Returns:
+        str: path of the results file
+    """
+    if corpus:
+        details, results, empty = load_corpus(corpus)
+    else:
+        details, results, empty = synthetic_corpus(n, seed)
+    print(f"{len(details)} detail, {len(results)} result, {len(empty)} no-result pages")
+    benchmarks = bench_parsing(details, results, empty, repeat)
+
+    pages = [parse_detail_page(h) for h in details]
+    entries = [to_entry(p, datetime(2020, 1, 1)) for p in pages]
+    legacy = [to_legacy_entry(p, datetime(2020, 1, 1)) for p in pages]
+    try:
+        benchmarks.update(bench_cleaning(entries, legacy, repeat))
+    except ImportError as e:
+        print(f"Skipping cleaning benchmarks: {e}")
+    if pg:
+        benchmarks.update(bench_postgres(entries, max(1, repeat // 2)))
+
+    for name, result in benchmarks.items():
+        rate = result["items"] / result["median"] if result["median"] else float("inf")
+        print(f"{name:32} {result['median']:10.4f}s median  {rate:12.0f}/s")
+
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": corpus or f"synthetic n={n} seed={seed}",
+        "benchmarks": benchmarks,
+    }
+    os.makedirs(outdir, exist_ok=True)
+    path = os.path.join(outdir, f"{time.strftime('%Y%m%d_%H%M%S')}_{revision}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {path}")
+
+    if against:
+        with open(against) as f:
+            compare(json.load(f), report)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Times page extraction, cleaning and loading offline."
+    )
+    parser.add_argument("-n", type=int, default=2000, help="synthetic pages")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="directory of recorded .html pages")
+    parser.add_argument("--pg", action="store_true",
+        help="also time insert_offender and load_bulk on the local postgres")
+    parser.add_argument("-o", "--outdir", default="bench_results")
+    parser.add_argument("--against", help="results file to compare with")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+        help="only compare two results files")
+    args = parser.parse_args()
+
+    if args.compare:
+        old, new = (json.load(open(p)) for p in args.compare)
+        compare(old, new)
+    else:
+        main(args.n, args.repeat, args.seed, args.corpus, args.pg, args.outdir,
+            args.against)
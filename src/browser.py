@@ -0,0 +1,166 @@
+from selenium.webdriver import Chrome
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+
+# the pages only need their html: skip everything that just draws them
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+    "*.css", "*.woff", "*.woff2", "*.ttf", "*.otf",
+]
+BLOCKED_CONTENT = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.managed_default_content_settings.stylesheets": 2,
+    "profile.managed_default_content_settings.fonts": 2,
+    "profile.managed_default_content_settings.plugins": 2,
+    "profile.managed_default_content_settings.popups": 2,
+    "profile.managed_default_content_settings.notifications": 2,
+}
+# failures worth retrying the lookup for
+BROWSER_ERRORS = (TimeoutException, WebDriverException)
+# webdriver messages meaning the browser is gone rather than the page misbehaving
+CRASH_MESSAGES = (
+    "chrome not reachable",
+    "invalid session id",
+    "session deleted",
+    "tab crashed",
+    "page crash",
+    "disconnected",
+    "target window already closed",
+    "connection refused",
+)
+
+
+class BrowserSession:
+    def __init__(self, wd_path, headless=True, maxpages=500, maxmemory=1024, pmode=1):
+        """
+        One Chrome instance that loads pages without images, stylesheets or
+        fonts and stops waiting once the html is parsed. It is replaced by a
+        fresh one after maxpages pages or when its processes grow past
+        maxmemory MB, and restarted when it crashed. Every method blocks, so
+        the worker calls them on its browser thread.
+
+        Args:
+            wd_path (str): path of the chromedriver executable
+            headless (bool): controlling if the webdriver runs
+            maxpages (int): pages loaded before the browser is recycled, 0 for no limit
+            maxmemory (float): MB of memory used by the browser's processes
+                before it is recycled, 0 for no limit. Needs psutil
+            pmode (int): print mode. Higher the number, the more is printed
+        """
+        self.wd_path = wd_path
+        self.headless = headless
+        self.maxpages = maxpages
+        self.maxmemory = maxmemory
+        self.pmode = pmode
+        self.driver = None
+        self.pages = 0
+        self.restarts = 0
+        self.start()
+
+    def options(self):
+        opt = Options()
+        opt.headless = self.headless
+        # 'eager' returns from get once the DOM is ready, without waiting on subresources
+        opt.set_capability("pageLoadStrategy", "eager")
+        opt.add_experimental_option("prefs", BLOCKED_CONTENT)
+        for arg in (
+            "--blink-settings=imagesEnabled=false",
+            "--disable-extensions",
+            "--disable-gpu",
+            "--disable-dev-shm-usage",
+            "--disable-background-networking",
+            "--mute-audio",
+        ):
+            opt.add_argument(arg)
+        return opt
+
+    def start(self):
+        """
+        Starts a new Chrome with the resource blocking set up.
+        """
+        self.driver = Chrome(executable_path=self.wd_path, options=self.options())
+        try:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+        except WebDriverException:
+            # older chromedrivers without CDP still get the content settings
+            pass
+        self.pages = 0
+
+    def quit(self):
+        """
+        Quits the browser, ignoring a browser that already died.
+        """
+        if self.driver is None:
+            return
+        try:
+            self.driver.quit()
+        except (WebDriverException, OSError):
+            pass
+        self.driver = None
+
+    def restart(self, reason="crashed"):
+        """
+        Replaces the browser with a fresh one.
+        """
+        self.quit()
+        self.restarts += 1
+        self.start()
+        if self.pmode >= 2:
+            print(f"Browser restarted ({reason}), {self.restarts} restarts so far")
+
+    def get(self, url):
+        """
+        Loads a page, recycling the browser first when it is due.
+        """
+        if self.driver is None:
+            self.start()
+        reason = self.due()
+        if reason is not None:
+            self.restart(reason)
+        self.pages += 1
+        self.driver.get(url)
+
+    def due(self):
+        """
+        Returns why the browser should be recycled, or None if it shouldn't.
+        """
+        if self.maxpages and self.pages >= self.maxpages:
+            return f"{self.pages} pages"
+        # measuring walks the process tree, so only every 25 pages
+        if self.maxmemory and self.pages and self.pages % 25 == 0:
+            used = self.memory()
+            if used is not None and used > self.maxmemory:
+                return f"{used:.0f} MB"
+        return None
+
+    def memory(self):
+        """
+        Returns the MB used by chromedriver and the browser processes it
+        started, or None if psutil isn't installed.
+        """
+        try:
+            import psutil
+        except ImportError:
+            return None
+        try:
+            root = psutil.Process(self.driver.service.process.pid)
+            procs = [root] + root.children(recursive=True)
+            total = 0
+            for p in procs:
+                try:
+                    total += p.memory_info().rss
+                except psutil.Error:
+                    pass
+            return total / 2**20
+        except (psutil.Error, AttributeError):
+            return None
+
+
+def is_crash(e):
+    """
+    Returns True if a webdriver exception means the browser itself is gone.
+    """
+    message = str(e).lower()
+    return any(m in message for m in CRASH_MESSAGES)
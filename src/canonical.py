@@ -0,0 +1,207 @@
+from difflib import get_close_matches
+from functools import lru_cache
+import json, re
+
+
+# canonical offense -> spellings of it seen on the site, beyond what the
+# token normalization already unifies
+SYNONYMS = {
+    'POSS CS PG 1 <1G': ['POSS CS PG1 <1G', 'POSS CONT SUB PG 1 <1G', 'POSS CS PG 1 LESS THAN 1G'],
+    'POSS CS PG 1 >=1G<4G': ['POSS CS PG1 >=1G<4G', 'POSS CS PG 1 1G-4G'],
+    'POSS CS PG 1 >=4G<200G': ['POSS CS PG1 >=4G<200G', 'POSS CS PG 1 4G-200G'],
+    'POSS MARIJ >4OZ<=5LBS': ['POSS MARIJUANA >4OZ<=5LBS', 'POSS MARIJ 4OZ-5LBS'],
+    'MAN DEL CS PG 1 >=4G<200G': ['MAN/DEL CS PG 1 >=4G<200G', 'MAN DEL CS PG1 >=4G<200G'],
+    'BURGLARY OF HABITATION': ['BURG OF HAB', 'BURG HAB', 'BURGLARY HABITATION'],
+    'BURGLARY OF BUILDING': ['BURG OF BLDG', 'BURG BLDG', 'BURGLARY BUILDING'],
+    'THEFT PROP >=$1500<$20K': ['THEFT PROP>=$1500<$20K', 'THEFT PROPERTY >=$1500<$20K'],
+    'DWI 3RD OR MORE': ['DWI 3RD OR MORE IAT', 'DRIVING WHILE INTOXICATED 3RD OR MORE'],
+    'AGG ASSAULT W/DEADLY WEAPON': ['AGG ASSLT W/DEADLY WEAPON', 'AGG ASLT W/DEADLY WEAP', 'AGG ASSAULT W/DW'],
+    'AGG ROBBERY': ['AGG ROB', 'AGGRAVATED ROBBERY'],
+    'ROBBERY': ['ROB'],
+    'MURDER': [],
+    'CAPITAL MURDER': ['CAP MURDER'],
+    'FORGERY': ['FORG', 'FORGERY GOVT/FIN INST'],
+    'EVADING ARREST DET W/VEH': ['EVADING ARREST DETENTION W/VEHICLE', 'EVADING ARREST W/VEH'],
+    'UNAUTH USE OF VEHICLE': ['UNAUTH USE OF VEH', 'UUMV'],
+    'UNL POSS FIREARM BY FELON': ['UNL POSS FIREARM BY FEL', 'FELON IN POSS OF FIREARM'],
+    'ASSAULT FAM/HOUSE MEM W/PREV CONV': ['ASSAULT FAM MEM W/PREV CONV', 'ASLT FAM/HOUSE MBR W/PREV CONV'],
+}
+# abbreviations spelled out before offenses are compared
+ABBREVIATIONS = {
+    'POSS': 'POSSESSION', 'CS': 'CONTROLLED SUBSTANCE', 'CONT': 'CONTROLLED',
+    'SUB': 'SUBSTANCE', 'SUBST': 'SUBSTANCE', 'PG': 'PENALTY GROUP',
+    'MARIJ': 'MARIJUANA', 'MAN': 'MANUFACTURE', 'MANUF': 'MANUFACTURE',
+    'DEL': 'DELIVERY', 'BURG': 'BURGLARY', 'HAB': 'HABITATION', 'BLDG': 'BUILDING',
+    'AGG': 'AGGRAVATED', 'ASLT': 'ASSAULT', 'ASSLT': 'ASSAULT', 'WEAP': 'WEAPON',
+    'DW': 'DEADLY WEAPON', 'ROB': 'ROBBERY', 'PROP': 'PROPERTY', 'CAP': 'CAPITAL',
+    'FORG': 'FORGERY', 'DWI': 'DRIVING WHILE INTOXICATED', 'INTOX': 'INTOXICATED',
+    'VEH': 'VEHICLE', 'DET': 'DETENTION', 'UNAUTH': 'UNAUTHORIZED',
+    'UNL': 'UNLAWFUL', 'FEL': 'FELON', 'FAM': 'FAMILY', 'MEM': 'MEMBER',
+    'MBR': 'MEMBER', 'PREV': 'PREVIOUS', 'CONV': 'CONVICTION', 'GOVT': 'GOVERNMENT',
+    'FIN': 'FINANCIAL', 'INST': 'INSTITUTION', 'IND': 'INDECENCY', 'SEX': 'SEXUAL',
+    'ATT': 'ATTEMPTED', 'CRIM': 'CRIMINAL', 'MISCH': 'MISCHIEF', 'W': 'WITH',
+}
+STOPWORDS = {'OF', 'THE', 'A', 'AN', 'BY', 'OR', 'AND', 'IAT'}
+
+_LETTER_DIGIT = re.compile(r'(?<=[A-Z])(?=\d)')
+_COMPARISON = re.compile(r'([<>]=?|=)\s+')
+_SEPARATORS = re.compile(r'[\s/,;:()-]+')
+
+
+class Canonicalizer:
+    def __init__(self, synonyms=SYNONYMS, abbreviations=ABBREVIATIONS,
+            stopwords=STOPWORDS, cutoff=0.88):
+        """
+        Maps the many spellings of an offense to one canonical offense. The
+        rules are compiled into an exact-match dictionary of known spellings
+        and an index of their normalized tokens; strings matching neither
+        fall back to the closest indexed spelling with the same numbers (so
+        penalty groups and amounts never merge), and are kept as they are,
+        upper-cased, if nothing is close enough. Results are memoized.
+
+        Args:
+            synonyms: dict of canonical offense -> list of other spellings
+            abbreviations: dict of token -> spelled out words
+            stopwords: tokens ignored when comparing
+            cutoff: lowest difflib similarity accepted by the fuzzy fallback
+        """
+        self.abbreviations = abbreviations
+        self.stopwords = stopwords
+        self.cutoff = cutoff
+        self.exact = dict()
+        self.index = dict()
+        for canonical, spellings in synonyms.items():
+            for spelling in [canonical] + list(spellings):
+                self.exact[_clean(spelling)] = canonical
+                self.index.setdefault(self.key(spelling), canonical)
+        self.by_numbers = dict()
+        for key in self.index:
+            self.by_numbers.setdefault(_numbers(key), []).append(key)
+        self.canonicalize = lru_cache(maxsize=None)(self._canonicalize)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Loads a rule set from JSON with 'synonyms' and optionally
+        'abbreviations' and 'stopwords', extending the built-in rules.
+        """
+        with open(path) as f:
+            rules = json.load(f)
+        synonyms = dict(SYNONYMS)
+        for canonical, spellings in rules.get('synonyms', {}).items():
+            synonyms[canonical] = synonyms.get(canonical, []) + spellings
+        return cls(synonyms, dict(ABBREVIATIONS, **rules.get('abbreviations', {})),
+            STOPWORDS | set(rules.get('stopwords', ())))
+
+    def key(self, offense):
+        """
+        Normalized form of an offense: abbreviations spelled out, stopwords
+        dropped, tokens sorted so word order doesn't matter.
+        """
+        text = _COMPARISON.sub(r'\1', _LETTER_DIGIT.sub(' ', _clean(offense)))
+        tokens = []
+        for token in _SEPARATORS.split(text):
+            for word in self.abbreviations.get(token, token).split():
+                if word and word not in self.stopwords:
+                    tokens.append(word)
+        return ' '.join(sorted(tokens))
+
+    def _canonicalize(self, offense):
+        if offense is None:
+            return None
+        offense = _clean(offense)
+        if offense in self.exact:
+            return self.exact[offense]
+        key = self.key(offense)
+        if key in self.index:
+            return self.index[key]
+        close = get_close_matches(key, self.by_numbers.get(_numbers(key), []),
+            n=1, cutoff=self.cutoff)
+        return self.index[close[0]] if close else offense
+
+    def mapping(self, offenses):
+        """
+        Returns dict of offense -> canonical offense for distinct offenses.
+        """
+        return {o: self.canonicalize(o) for o in set(offenses)}
+
+
+def _clean(offense):
+    return ' '.join(str(offense).upper().split())
+
+
+def _numbers(key):
+    return tuple(token for token in key.split() if any(c.isdigit() for c in token))
+
+
+_default = None
+
+
+def canonicalize(offense):
+    """
+    Canonical offense of a string under the built-in rules.
+    """
+    global _default
+    if _default is None:
+        _default = Canonicalizer()
+    return _default.canonicalize(offense)
+
+
+def recanonicalize(conn, canonicalizer=None):
+    """
+    Rewrites offenses.canonical_offense for every distinct offense in the
+    postgres DB with the current rules, without migrating again. Only rows
+    whose canonical offense changed are written.
+
+    Args:
+        conn: connection to the postgres DB
+        canonicalizer: rules to apply, the built-in ones by default
+
+    Returns:
+        number of offense rows changed
+    """
+    canonicalizer = canonicalizer or Canonicalizer()
+    cur = conn.cursor()
+    cur.execute('ALTER TABLE offenses ADD COLUMN IF NOT EXISTS canonical_offense TEXT')
+    cur.execute('SELECT DISTINCT offense FROM offenses')
+    mapping = canonicalizer.mapping(row[0] for row in cur.fetchall())
+    cur.execute(
+        """
+        CREATE TEMP TABLE offense_map (offense TEXT PRIMARY KEY, canonical TEXT)
+        ON COMMIT DROP
+        """)
+    cur.executemany('INSERT INTO offense_map VALUES (%s, %s)', list(mapping.items()))
+    cur.execute(
+        """
+        UPDATE offenses f SET canonical_offense = m.canonical
+        FROM offense_map m
+        WHERE f.offense = m.offense
+            AND f.canonical_offense IS DISTINCT FROM m.canonical
+        """)
+    changed = cur.rowcount
+    conn.commit()
+    cur.close()
+    return changed
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Canonicalizes offense strings.')
+    parser.add_argument('offenses', nargs='*', help='offenses to show the canonical form of')
+    parser.add_argument('--rules', help='JSON file of extra rules')
+    parser.add_argument('--recanonicalize', action='store_true',
+        help='rewrite canonical_offense in the postgres DB with the current rules')
+    args = parser.parse_args()
+
+    canonicalizer = Canonicalizer.from_file(args.rules) if args.rules else Canonicalizer()
+    for offense in args.offenses:
+        print(f'{offense} -> {canonicalizer.canonicalize(offense)}')
+    if args.recanonicalize:
+        import psycopg2 as pg2
+        from pgpipe import refresh_analysis_views
+
+        conn = pg2.connect(dbname='tdcj', host='localhost', port=5432, user='postgres')
+        print(f'{recanonicalize(conn, canonicalizer)} offenses re-canonicalized')
+        refresh_analysis_views(conn, conn.cursor())
+        conn.close()
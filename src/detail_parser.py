@@ -0,0 +1,329 @@
+from html.parser import HTMLParser
+from typing import NamedTuple, Optional, List, Dict
+from datetime import datetime
+import re
+from schema import build, offense_record
+
+
+VOID_TAGS = {"area", "base", "br", "col", "hr", "img", "input", "link", "meta", "wbr"}
+# the strings pandas reads as missing values by default
+NA_VALUES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+}
+INT_RE = re.compile(r"^[+-]?\d+$")
+FLOAT_RE = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+OFFENSE_HEADERS = (
+    "Offense Date",
+    "Offense",
+    "Sentence Date",
+    "County",
+    "Case No.",
+    "Sentence (YY-MM-DD)",
+)
+
+
+class ParseError(ValueError):
+    """
+    A fetched page that isn't a readable detail page, kept for inspection.
+    """
+
+    def __init__(self, message, html):
+        super().__init__(message)
+        self.html = html
+
+
+class Offense(NamedTuple):
+    """
+    One row of a detail page's offense table, as the page shows it.
+    """
+
+    offense_date: Optional[str]
+    offense: Optional[str]
+    sentence_date: Optional[str]
+    county: Optional[str]
+    case_no: Optional[str]
+    sentence: Optional[str]
+
+
+class DetailPage(NamedTuple):
+    """
+    Everything extracted from an inmate's detail page.
+    """
+
+    admin: Dict[str, str]
+    headers: List[str]
+    rows: List[List[str]]
+
+    @property
+    def tdcj_number(self):
+        return self.admin["TDCJ Number"]
+
+    @property
+    def offenses(self):
+        """
+        The offense rows as Offense tuples, with None for empty cells.
+        """
+        index = [self.headers.index(h) if h in self.headers else None
+            for h in OFFENSE_HEADERS]
+        return [
+            Offense(*(row[i] or None if i is not None and i < len(row) else None
+                for i in index))
+            for row in self.rows
+        ]
+
+
+class _PageParser(HTMLParser):
+    """
+    Single pass over a search results or detail page. Collects the first link,
+    header cells and body rows of the first tdcj_table, the text of the
+    paragraphs inside content_right (with <br> as newlines) and whether
+    content_right was present at all.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.link = None
+        self.has_content = False
+        self.paragraphs = []
+        self.headers = []
+        self.rows = []
+        self._table_depth = 0
+        self._tables_seen = 0
+        self._content_depth = 0
+        self._in_p = False
+        self._row = []
+        self._cell = None
+        self._cell_is_header = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag == "br":
+                self._newline()
+            return
+        attrs = dict(attrs)
+        if self._content_depth:
+            self._content_depth += 1
+        elif attrs.get("id") == "content_right":
+            self.has_content = True
+            self._content_depth = 1
+
+        if tag == "table":
+            if self._table_depth:
+                self._table_depth += 1
+            elif "tdcj_table" in (attrs.get("class") or "").split():
+                self._tables_seen += 1
+                if self._tables_seen == 1:
+                    self._table_depth = 1
+        elif not self._table_depth:
+            if tag == "p" and self._content_depth:
+                self._in_p = True
+                self.paragraphs.append("")
+        elif self._table_depth == 1:
+            if tag == "a" and self.link is None and attrs.get("href"):
+                self.link = attrs["href"]
+            elif tag == "tr":
+                self._row = []
+            elif tag in ("td", "th"):
+                self._cell = ""
+                self._cell_is_header = tag == "th"
+
+    def handle_startendtag(self, tag, attrs):
+        # self-closed tags open nothing worth tracking
+        if tag == "br":
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if self._content_depth:
+            self._content_depth -= 1
+        if tag == "table" and self._table_depth:
+            self._table_depth -= 1
+        elif tag == "p":
+            self._in_p = False
+        elif self._table_depth == 1:
+            if tag in ("td", "th") and self._cell is not None:
+                self._row.append((" ".join(self._cell.split()), self._cell_is_header))
+                self._cell = None
+            elif tag == "tr":
+                self._end_row()
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell += data
+        elif self._in_p:
+            self.paragraphs[-1] += re.sub(r"\s+", " ", data)
+
+    def close(self):
+        super().close()
+        if self._table_depth and self._row:
+            self._end_row()
+
+    def _end_row(self):
+        row, self._row = self._row, []
+        if not row:
+            return
+        if not self.headers and all(is_header for _, is_header in row):
+            self.headers = [text for text, _ in row]
+        else:
+            self.rows.append([text for text, _ in row])
+
+    def _newline(self):
+        if self._cell is not None:
+            self._cell += " "
+        elif self._in_p:
+            self.paragraphs[-1] += "\n"
+
+
+def find_result_link(html):
+    """
+    Returns the href of the first link in a results page's tdcj_table, or None
+    if the search found nobody.
+
+    Args:
+        html (str): search results page
+    """
+    parser = _PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser.link
+
+
+def parse_detail_page(html):
+    """
+    Extracts the admin fields and offense table of an inmate's detail page.
+
+    Args:
+        html (str): detail page
+
+    Returns:
+        DetailPage
+
+    Raises:
+        ValueError if the page has no content_right admin section
+    """
+    parser = _PageParser()
+    parser.feed(html)
+    parser.close()
+    if not parser.has_content or len(parser.paragraphs) < 2:
+        raise ValueError("Detail page has no content_right admin section")
+    return DetailPage(parse_admin(parser.paragraphs[1]), parser.headers, parser.rows)
+
+
+def parse_admin(text):
+    """
+    Turns the admin block's 'Key: value' lines into a dict. Only the first
+    colon separates key and value, so values may contain colons.
+
+    Args:
+        text (str): text of the admin paragraph, one field per line
+    """
+    admin = dict()
+    for line in text.split("\n"):
+        key, sep, value = line.partition(":")
+        if sep:
+            admin[key.strip()] = value.strip()
+    return admin
+
+
+def to_entry(page, accessed=None):
+    """
+    Builds the inmate document ScraperWorker stores, in the current schema:
+    the admin fields, an array of typed offense records and the access time.
+    See schema.build.
+
+    Args:
+        page (DetailPage): parsed detail page
+        accessed (datetime): when the page was fetched, defaults to now
+
+    Returns:
+        dict ready for the inmates collection
+    """
+    offenses = [offense_record(*offense) for offense in page.offenses]
+    return build(page.admin, offenses, accessed or datetime.now())
+
+
+def parse_entry(html, accessed=None):
+    """
+    Parses a fetched detail page into the inmate document, see to_entry.
+
+    Raises:
+        ParseError holding the page if it can't be parsed
+    """
+    try:
+        return to_entry(parse_detail_page(html), accessed)
+    except ValueError as e:
+        raise ParseError(str(e), html) from e
+
+
+def to_legacy_entry(page, accessed=None):
+    """
+    Builds the inmate document as schema version 1 stored it: the admin
+    fields, the offense table in the column-oriented form of pandas'
+    read_html -> to_json (including its number inference), and the access
+    timestamp as a string. Kept for benchmarking the cleaning of documents
+    not migrated yet.
+    """
+    entry = dict(page.admin)
+    entry["offensetable"] = offense_table(page.headers, page.rows)
+
+    # add the timestamp for when it was pulled
+    entry["accessed"] = (accessed or datetime.now()).strftime("%Y%m%d_%H%M")
+
+    # some data cleaning for Mongo
+    entry["offensetable"]["Case No"] = entry["offensetable"].pop("Case No.")
+    entry["_id"] = entry.pop("TDCJ Number")
+    return entry
+
+
+def read_html_offense_table(html):
+    """
+    The offense table as the scraper used to build it, through pandas'
+    read_html -> to_json -> json.loads, before the "Case No." rename. Kept to
+    check offense_table against; needs pandas with an html parser.
+
+    Args:
+        html (str): detail page or the outerHTML of its tdcj_table
+    """
+    import io, json
+    import pandas as pd
+
+    table = pd.read_html(io.StringIO(html), attrs={"class": "tdcj_table"})[0]
+    return json.loads(table.to_json())
+
+
+def offense_table(headers, rows):
+    """
+    Returns the offense table as {column: {row index string: value}}, typed
+    the way pandas infers the columns of an html table.
+
+    Args:
+        headers (list): column names
+        rows (list): lists of cell strings
+    """
+    table = dict()
+    for i, header in enumerate(headers):
+        column = [row[i] if i < len(row) else "" for row in rows]
+        table[header] = {str(j): v for j, v in enumerate(_infer_column(column))}
+    return table
+
+
+def _infer_column(values):
+    """
+    Converts a column of cell strings to ints, floats or strings like pandas'
+    parser: ints if every present value is an integer (floats if some are
+    missing), floats if every present value is a number, else strings.
+    Missing values become None.
+    """
+    present = [v.replace(",", "") for v in values if v not in NA_VALUES]
+    if not present:
+        return [None] * len(values)
+    if all(INT_RE.match(v) for v in present):
+        cast = int if len(present) == len(values) else float
+    elif all(FLOAT_RE.match(v) for v in present):
+        cast = float
+    else:
+        return [None if v in NA_VALUES else v for v in values]
+    return [None if v in NA_VALUES else cast(v.replace(",", "")) for v in values]
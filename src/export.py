@@ -0,0 +1,185 @@
+import os, shutil
+from datetime import datetime
+from pymongo import MongoClient
+import pandas as pd
+from batch_clean import prep_offender_batch
+from schema import parse_date
+from pgpipe import OFFENDER_COLUMNS, OFFENDER_KEYS, OFFENSE_COLUMNS, OFFENSE_KEYS
+
+
+def _types():
+    """
+    Arrow types of the exported columns, matching the postgres tables.
+    Built lazily so importing this module doesn't need pyarrow.
+    """
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    offenders = {
+        'sid_number': pa.int32(),
+        'tdcj_number': pa.int32(),
+        'name': pa.string(),
+        'race': category,
+        'gender': pa.bool_(),
+        'date_of_birth': pa.date32(),
+        'max_sentence_date': pa.date32(),
+        'msd_category': pa.int8(),
+        'current_facility': category,
+        'projected_release_date': pa.date32(),
+        'parole_eligibility_date': pa.date32(),
+        'visitation_eligible': category,
+        'last_accessed': pa.timestamp('s'),
+    }
+    offenses = {
+        'tdcj_number': pa.int32(),
+        'race': category,
+        'offense_date': pa.date32(),
+        'offense': category,
+        'sentence_date': pa.date32(),
+        'county': category,
+        'case_number': pa.string(),
+        'sentence': pa.int32(),
+        'canonical_offense': category,
+    }
+    return offenders, offenses
+
+
+def _array(values, type):
+    """
+    Converts a column of cleaned values into an arrow array of the given type.
+    """
+    import pyarrow as pa
+
+    if pa.types.is_date32(type):
+        # version 1 documents have date strings, version 2 documents datetimes
+        return pa.array([_date(v) for v in values], pa.timestamp('us')).cast(type)
+    if pa.types.is_timestamp(type):
+        return pa.array(pd.to_datetime(values)).cast(type)
+    if pa.types.is_dictionary(type):
+        return pa.array(values.astype(object).where(values.notna(), None),
+            pa.string()).dictionary_encode()
+    if pa.types.is_integer(type):
+        return pa.array(pd.to_numeric(values), type, from_pandas=True)
+    if pa.types.is_string(type):
+        return pa.array([None if pd.isna(v) else str(v) for v in values], type)
+    return pa.array(values, type, from_pandas=True)
+
+
+def _date(value):
+    value = parse_date(value) if isinstance(value, str) else value
+    return value if isinstance(value, datetime) and not pd.isna(value) else None
+
+
+def to_tables(batch):
+    """
+    Cleans a batch of mongo documents like the postgres migration does and
+    converts it into typed offenders and offenses tables, with the postgres
+    column names. The offenses carry the offender's race too, so sentences
+    can be compared by race without a join.
+
+    Args:
+        batch: list of mongo documents
+
+    Returns:
+        tuple of pyarrow.Table: (offenders, offenses)
+    """
+    import pyarrow as pa
+
+    offender_types, offense_types = _types()
+    offenders, offenses = prep_offender_batch(batch)
+    offenders = offenders.rename(columns=dict(zip(OFFENDER_KEYS, OFFENDER_COLUMNS)))
+    offenses = offenses.rename(columns=dict(zip(OFFENSE_KEYS, OFFENSE_COLUMNS)))
+    offenses['race'] = offenses['tdcj_number'].map(
+        offenders.set_index('tdcj_number')['race'])
+    return tuple(
+        pa.Table.from_arrays(
+            [_array(frame[col].reset_index(drop=True), t) for col, t in types.items()],
+            names=list(types))
+        for frame, types in ((offenders, offender_types), (offenses, offense_types))
+    )
+
+
+def _clean_batch(batch):
+    """
+    Converts a batch, leaving out documents the cleaning can't handle.
+    """
+    try:
+        return to_tables(batch)
+    except ValueError:
+        good = []
+        for entry in batch:
+            try:
+                to_tables([entry])
+                good.append(entry)
+            except ValueError as e:
+                print(f'Skipped {entry["_id"]}: {e}')
+        return to_tables(good) if good else None
+
+
+def export(outdir, batch_size=50000, partition_cols=('race',), print_count=50000):
+    """
+    Streams the inmates collection into two Parquet datasets, outdir/offenders
+    and outdir/offenses, replacing earlier exports. Dates are typed, and
+    repetitive text columns are dictionary-encoded, so they load as pandas
+    categoricals.
+
+    Args:
+        outdir: directory to write the datasets to
+        batch_size: documents cleaned and written at a time
+        partition_cols: columns to partition both datasets by, or () for none
+        print_count: prints progress after about this many documents
+
+    Returns:
+        number of offenders exported
+    """
+    inmates = MongoClient('localhost', 27017).tdcj.inmates
+    paths = {name: os.path.join(outdir, name) for name in ('offenders', 'offenses')}
+    for path in paths.values():
+        shutil.rmtree(path, ignore_errors=True)
+
+    count = 0
+    part = 0
+    batch = []
+    for entry in inmates.find({}, batch_size=min(batch_size, 10000)):
+        batch.append(entry)
+        if len(batch) < batch_size:
+            continue
+        count += _write_batch(batch, paths, partition_cols, part)
+        part += 1
+        batch = []
+        if count % print_count < batch_size:
+            print(f'{count} offenders exported')
+    if batch:
+        count += _write_batch(batch, paths, partition_cols, part)
+    print(f'{count} offenders exported to {outdir}')
+    return count
+
+
+def _write_batch(batch, paths, partition_cols, part):
+    """
+    Appends one batch to both datasets, as new files named after the batch.
+    """
+    import pyarrow.parquet as pq
+
+    tables = _clean_batch(batch)
+    if tables is None:
+        return 0
+    for table, path in zip(tables, paths.values()):
+        pq.write_to_dataset(table, path, partition_cols=list(partition_cols) or None,
+            basename_template=f'part-{part:05d}-{{i}}.parquet')
+    return tables[0].num_rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Exports inmates as Parquet datasets of offenders and offenses.')
+    parser.add_argument('outdir')
+    parser.add_argument('-b', '--batch_size', type=int, default=50000)
+    parser.add_argument('--partition', nargs='*', default=['race'],
+        help='columns to partition by, none for a flat dataset')
+    parser.add_argument('-p', '--print_count', type=int, default=50000)
+    args = parser.parse_args()
+
+    export(args.outdir, args.batch_size, args.partition, args.print_count)
@@ -0,0 +1,205 @@
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from datetime import datetime
+import asyncio
+import aiohttp
+from detail_parser import find_result_link, parse_entry
+from metrics import STAGE_SECONDS
+
+
+START_URL = "https://offender.tdcj.texas.gov/OffenderSearch/start"
+# failures worth retrying the lookup for
+FETCH_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class HttpFetcher:
+    def __init__(self, start_url=START_URL, concurrency=100, timeout=30.0, archive=None):
+        """
+        Fetches inmate pages over plain HTTP instead of driving a browser.
+        One fetcher is shared by all workers so lookups reuse the same
+        pooled keep-alive connections.
+
+        Args:
+            start_url (str): OffenderSearch start page holding the search form
+            concurrency (int): maximum number of open connections
+            timeout (float): total timeout per request in seconds
+            archive (PageArchive): archive to keep the detail pages in, if any
+        """
+        self.start_url = start_url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.archive = archive
+        self.session = None
+        self.form = None
+
+    async def open(self):
+        """
+        Opens the pooled session. Called lazily from inside the event loop.
+        """
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency, keepalive_timeout=60
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    async def close(self):
+        """
+        Closes the pooled session if it was opened.
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_form(self):
+        """
+        Loads the start page once and remembers the search form's action,
+        method and default fields.
+
+        Returns:
+            SearchForm of the start page
+        """
+        if self.form is None:
+            session = await self.open()
+            async with session.get(self.start_url) as resp:
+                resp.raise_for_status()
+                html = await resp.text()
+                base = str(resp.url)
+            self.form = SearchForm.from_html(html, base)
+        return self.form
+
+    async def search_by_number(self, tdcjnum):
+        """
+        Submits the search form for a possible inmate number.
+
+        Args:
+            tdcjnum (int): possible tdcj number
+
+        Returns:
+            tuple: (html of the results page, url of the results page)
+        """
+        form = await self.get_form()
+        session = await self.open()
+        data = form.fields_for(tdcjnum)
+        if form.method == "post":
+            request = session.post(form.action, data=data)
+        else:
+            request = session.get(form.action, params=data)
+        async with request as resp:
+            resp.raise_for_status()
+            return await resp.text(), str(resp.url)
+
+    async def scrape_inmate(self, tdcjnum):
+        """
+        Scrapes information related to the input number.
+
+        Args:
+            tdcjnum (int): TDCJ number to be scraped
+
+        Returns:
+            a dictionary of inmate information if the number is valid
+            else the input number
+        """
+        with STAGE_SECONDS.time("search"):
+            html, url = await self.search_by_number(tdcjnum)
+        with STAGE_SECONDS.time("parse"):
+            link = find_result_link(html)
+
+        # this happens for unassigned tdcj numbers...
+        if link is None:
+            return tdcjnum
+
+        session = await self.open()
+        with STAGE_SECONDS.time("detail"):
+            async with session.get(urljoin(url, link)) as resp:
+                resp.raise_for_status()
+                html = await resp.text()
+        fetched = datetime.now()
+        # archived before parsing, so pages the parser chokes on are kept too
+        if self.archive is not None:
+            await self.archive.store(tdcjnum, html, fetched)
+        with STAGE_SECONDS.time("parse"):
+            return parse_entry(html, fetched)
+
+
+class SearchForm:
+    def __init__(self, action, method, fields):
+        """
+        Minimal description of the OffenderSearch form.
+
+        Args:
+            action (str): absolute url the form submits to
+            method (str): 'get' or 'post'
+            fields (dict): default field values, including the search button
+        """
+        self.action = action
+        self.method = method
+        self.fields = fields
+
+    @classmethod
+    def from_html(cls, html, base):
+        """
+        Finds the form holding the 'tdcj' field in the start page.
+
+        Args:
+            html (str): start page
+            base (str): url the start page was served from
+
+        Raises:
+            ValueError if the page has no such form
+        """
+        parser = _FormParser()
+        parser.feed(html)
+        for action, method, fields in parser.forms:
+            if "tdcj" in fields:
+                return cls(urljoin(base, action or base), method, fields)
+        raise ValueError(f"No search form with a tdcj field found at {base}")
+
+    def fields_for(self, tdcjnum):
+        """
+        Returns the form fields for a search by TDCJ number.
+
+        Args:
+            tdcjnum (int): possible tdcj number
+        """
+        fields = dict(self.fields)
+        # the form wants an 8-digit number padded on the left with 0s
+        fields["tdcj"] = str(tdcjnum).zfill(8)
+        return fields
+
+
+class _FormParser(HTMLParser):
+    """
+    Collects (action, method, fields) for every form in a page. Only the
+    btnSearch submit button is kept, as the browser would send it when clicked.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+        self.current = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form":
+            self.current = (
+                attrs.get("action", ""),
+                attrs.get("method", "get").lower(),
+                dict(),
+            )
+        elif tag == "input" and self.current is not None:
+            name = attrs.get("name")
+            kind = attrs.get("type", "text").lower()
+            if name is None or (kind == "submit" and name != "btnSearch"):
+                return
+            if kind in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            self.current[2][name] = attrs.get("value") or ""
+
+    def handle_endtag(self, tag):
+        if tag == "form" and self.current is not None:
+            self.forms.append(self.current)
+            self.current = None
@@ -0,0 +1,179 @@
+from pymongo import ReturnDocument, UpdateOne
+from datetime import datetime, timedelta
+import os, socket, time, uuid
+from numberset import NumberSets
+
+
+class LeaseManager:
+    def __init__(self, db, owner=None, ttl=300.0, pmode=1):
+        """
+        Hands out ranges of TDCJ numbers to scraper processes through claims
+        in the claims collection, so several processes or hosts can share the
+        number space. A claim is leased to one owner until it expires; the
+        owner keeps extending it with heartbeats while it works. A range whose
+        owner died is claimed again once its lease expires. A range is marked
+        done only after every number in it was written.
+
+        Args:
+            db (pymongo.database.Database): scraper database
+            owner (str): name of this process, unique across hosts
+            ttl (float): seconds a lease lasts without a heartbeat
+            pmode (int): print mode. Higher the number, the more is printed
+        """
+        self.db = db
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.ttl = ttl
+        self.pmode = pmode
+        self.beaten = time.monotonic()
+        self.db.claims.create_index([("state", 1), ("lo", 1)])
+
+    def seed(self, lo, hi, size=1000):
+        """
+        Creates the open claims covering [lo, hi) in ranges of size numbers.
+        Existing claims are left alone, so every process may seed at startup.
+
+        Returns:
+            int: number of claims created
+        """
+        ops = [
+            UpdateOne(
+                {"_id": f"{start:08d}"},
+                {"$setOnInsert": {
+                    "lo": start, "hi": min(start + size, hi), "state": "open", "claims": 0
+                }},
+                upsert=True,
+            )
+            for start in range(lo, hi, size)
+        ]
+        if not ops:
+            return 0
+        return self.db.claims.bulk_write(ops, ordered=False).upserted_count
+
+    def claim(self):
+        """
+        Leases the highest open range, or the highest range whose lease expired.
+
+        Returns:
+            dict: the claim with lo and hi, or None if no range is available
+        """
+        now = datetime.utcnow()
+        claim = self.db.claims.find_one_and_update(
+            {"$or": [
+                {"state": "open"},
+                {"state": "leased", "expires": {"$lt": now}},
+            ]},
+            {
+                "$set": {
+                    "state": "leased",
+                    "owner": self.owner,
+                    "heartbeat": now,
+                    "expires": now + timedelta(seconds=self.ttl),
+                },
+                "$inc": {"claims": 1},
+            },
+            sort=[("state", -1), ("lo", -1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if claim is not None and self.pmode >= 2 and claim["claims"] > 1:
+            print(f"Reclaimed expired range {claim['lo']}..{claim['hi']}")
+        return claim
+
+    def heartbeat(self, claims):
+        """
+        Extends the leases of the given claims.
+
+        Args:
+            claims (list): claims held by this process
+
+        Returns:
+            list: the claims still held, without those another process took
+                over after their lease expired
+        """
+        now = datetime.utcnow()
+        self.db.claims.update_many(
+            {"_id": {"$in": [c["_id"] for c in claims]}, "owner": self.owner, "state": "leased"},
+            {"$set": {"heartbeat": now, "expires": now + timedelta(seconds=self.ttl)}},
+        )
+        held = {
+            d["_id"]
+            for d in self.db.claims.find(
+                {"_id": {"$in": [c["_id"] for c in claims]}, "owner": self.owner}, {"_id": 1}
+            )
+        }
+        self.beaten = time.monotonic()
+        lost = [c for c in claims if c["_id"] not in held]
+        if lost and self.pmode >= 1:
+            print(f"Lost the leases of {[c['_id'] for c in lost]}")
+        return [c for c in claims if c["_id"] in held]
+
+    def due(self):
+        """
+        Returns True once a third of the lease time passed since the last heartbeat.
+        """
+        return time.monotonic() - self.beaten >= self.ttl / 3
+
+    def complete(self, claim):
+        """
+        Marks a claimed range done, if this process still holds it.
+
+        Returns:
+            bool: True if the range was marked done
+        """
+        result = self.db.claims.update_one(
+            {"_id": claim["_id"], "owner": self.owner},
+            {"$set": {"state": "done", "done": datetime.utcnow()}},
+        )
+        return result.modified_count == 1
+
+    def release(self, claims):
+        """
+        Gives unfinished claims back so other processes can take them at once.
+        """
+        self.db.claims.update_many(
+            {"_id": {"$in": [c["_id"] for c in claims]}, "owner": self.owner, "state": "leased"},
+            {"$set": {"state": "open"}, "$unset": {"owner": "", "expires": ""}},
+        )
+
+    def progress(self):
+        """
+        Returns the number of claims per state.
+        """
+        return {
+            d["_id"]: d["n"]
+            for d in self.db.claims.aggregate([{"$group": {"_id": "$state", "n": {"$sum": 1}}}])
+        }
+
+
+def stored_numbers(db, lo, hi):
+    """
+    Yields (tdcj number, found an inmate) for every number in [lo, hi) already
+    stored by any process. The unassigned ones are only in the saved number
+    sets, so those stored since another process' last save are looked up again.
+    """
+    for d in db.inmates.find({"_id": {"$gte": f"{lo:08d}", "$lt": f"{hi:08d}"}}, {"_id": 1}):
+        yield int(d["_id"]), True
+    numbers = NumberSets.load(db)
+    if numbers is not None:
+        for n in numbers.unassigned.between(lo, hi):
+            yield n, False
+
+
+if __name__ == "__main__":
+    import argparse
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(
+        description="Creates the range claims shared by scraper processes, or shows their progress."
+    )
+    parser.add_argument("--lo", type=int, default=100000)
+    parser.add_argument("--hi", type=int, help="defaults to the stored tail")
+    parser.add_argument("-s", "--size", type=int, default=1000)
+    parser.add_argument("--status", action="store_true", help="only show progress")
+    args = parser.parse_args()
+
+    db = MongoClient("localhost", 27017).tdcj
+    leases = LeaseManager(db)
+    if not args.status:
+        hi = args.hi or int(db.admin.find_one({"_id": "tail"})["value"]) + 1
+        print(f"{leases.seed(args.lo, hi, args.size)} claims created")
+    print(leases.progress())
@@ -0,0 +1,226 @@
+from contextlib import contextmanager
+from bisect import bisect_left
+import asyncio, time
+
+
+# upper bounds in seconds, from a parse to a stalled page load
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Counter:
+    def __init__(self, name, doc, label):
+        """
+        Monotonic count per label value.
+
+        Args:
+            name (str): metric name
+            doc (str): help text
+            label (str): name of the label distinguishing series
+        """
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.values = dict()
+
+    def inc(self, labelvalue, n=1):
+        self.values[labelvalue] = self.values.get(labelvalue, 0) + n
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for v, n in sorted(self.values.items()):
+            lines.append(f'{self.name}{{{self.label}="{v}"}} {n}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, doc, label):
+        """
+        Current value per label value, set directly or read from a function
+        at render time.
+
+        Args:
+            name (str): metric name
+            doc (str): help text
+            label (str): name of the label distinguishing series
+        """
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.values = dict()
+
+    def set(self, labelvalue, value):
+        self.values[labelvalue] = value
+
+    def set_function(self, labelvalue, fn):
+        self.values[labelvalue] = fn
+
+    def get(self, labelvalue):
+        value = self.values.get(labelvalue)
+        return value() if callable(value) else value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        for v in sorted(self.values):
+            lines.append(f'{self.name}{{{self.label}="{v}"}} {self.get(v)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, doc, label, buckets=BUCKETS):
+        """
+        Latency distribution per label value in fixed buckets.
+
+        Args:
+            name (str): metric name
+            doc (str): help text
+            label (str): name of the label distinguishing series
+            buckets (tuple): sorted upper bounds in seconds
+        """
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.buckets = buckets
+        self.series = dict()
+
+    def observe(self, labelvalue, value):
+        counts, total = self.series.get(labelvalue, (None, 0.0))
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[labelvalue] = (counts, total + value)
+
+    @contextmanager
+    def time(self, labelvalue):
+        """
+        Observes the time spent in the with block, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(labelvalue, time.perf_counter() - start)
+
+    def count(self, labelvalue):
+        counts, _ = self.series.get(labelvalue, ((), 0.0))
+        return sum(counts)
+
+    def quantile(self, labelvalue, q):
+        """
+        Returns the upper bound of the bucket holding quantile q, or None
+        without observations. Values past the last bucket report as inf.
+        """
+        counts, _ = self.series.get(labelvalue, (None, 0.0))
+        if not counts:
+            return None
+        rank = q * sum(counts)
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for v, (counts, total) in sorted(self.series.items()):
+            seen = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                seen += n
+                lines.append(f'{self.name}_bucket{{{self.label}="{v}",le="{bound}"}} {seen}')
+            lines.append(f'{self.name}_sum{{{self.label}="{v}"}} {total}')
+            lines.append(f'{self.name}_count{{{self.label}="{v}"}} {seen}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        """
+        Holds the metrics of one process and renders them in the Prometheus
+        text format.
+        """
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(line for m in self.metrics for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.add(
+    Histogram("tdcj_stage_seconds", "Seconds spent per scraping stage.", "stage")
+)
+LOOKUPS = REGISTRY.add(
+    Counter("tdcj_lookups_total", "TDCJ number lookups by result.", "result")
+)
+QUEUE_DEPTH = REGISTRY.add(
+    Gauge("tdcj_queue_depth", "Numbers waiting in the scraper queues.", "queue")
+)
+PACING = REGISTRY.add(
+    Gauge("tdcj_pacing", "Current limits of the shared pacer.", "limit")
+)
+STAGES = ("search", "wait", "detail", "parse", "store", "flush")
+
+
+def summary():
+    """
+    One line with the lookup counts, p50/p99 per stage, queue depths and
+    pacer limits.
+    """
+    counts = " ".join(f"{r}={n}" for r, n in sorted(LOOKUPS.values.items()))
+    stages = " ".join(
+        f"{s}={_fmt(STAGE_SECONDS.quantile(s, 0.5))}/{_fmt(STAGE_SECONDS.quantile(s, 0.99))}"
+        for s in STAGES
+        if STAGE_SECONDS.count(s)
+    )
+    queues = " ".join(f"{q}={QUEUE_DEPTH.get(q)}" for q in sorted(QUEUE_DEPTH.values))
+    pacing = " ".join(f"{l}={PACING.get(l):g}" for l in sorted(PACING.values))
+    return (
+        f"lookups: {counts or 'none'} | p50/p99 s: {stages or 'n/a'} "
+        f"| queues: {queues} | pacing: {pacing}"
+    )
+
+
+def _fmt(seconds):
+    return "inf" if seconds == float("inf") else f"{seconds:g}"
+
+
+async def summaryloop(interval):
+    """
+    Prints the summary line every interval seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        print(time.strftime("%Y%m%d_%H%M%S"), summary())
+
+
+async def serve(port, host="127.0.0.1"):
+    """
+    Serves the registry on http://host:port/metrics (any path works).
+
+    Args:
+        port (int): port to listen on
+        host (str): address to bind, local only by default
+    """
+
+    async def handle(reader, writer):
+        try:
+            # read and ignore the request up to the blank line ending its head
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = REGISTRY.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
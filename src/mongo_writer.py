@@ -0,0 +1,282 @@
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import asyncio, time
+from metrics import STAGE_SECONDS
+from report import update_aggregates
+
+
+DUPLICATE_KEY = 11000
+
+
+class BufferedWriter:
+    def __init__(
+        self,
+        db,
+        maxdocs=500,
+        maxwait=5.0,
+        pmode=1,
+        numbers=None,
+        savewait=60.0,
+        aggregates=True,
+    ):
+        """
+        Write-behind buffer shared by all workers. Documents are collected per
+        collection and written with one unordered insert_many when a
+        collection's buffer is full or the oldest buffered document has waited
+        long enough. Documents already stored are reconciled in bulk: inmates
+        are only replaced if their content hash changed, and inmates whose
+        number came back unassigned are moved to the released collection.
+        Unassigned numbers are not stored as documents: the "unassigned"
+        buffer only marks them in the number sets, their only record.
+
+        Args:
+            db (pymongo.database.Database): database to write to
+            maxdocs (int): buffered documents per collection that trigger a flush
+            maxwait (float): seconds a document may wait before a flush
+            pmode (int): print mode. Higher the number, the more is printed
+            numbers (NumberSets): number sets to mark written numbers in, and
+                to keep the unassigned ones in
+            savewait (float): seconds between saves of the number sets
+            aggregates (bool): keep the running aggregates of report.py up to
+                date with the inmates written, replaced and released
+        """
+        self.db = db
+        self.maxdocs = maxdocs
+        self.maxwait = maxwait
+        self.pmode = pmode
+        self.numbers = numbers
+        self.savewait = savewait
+        self.aggregates = aggregates
+        self.buffers = dict()
+        self.oldest = None
+        self.lock = asyncio.Lock()
+        # pymongo blocks, so its calls go to one thread that keeps their order
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="writer")
+
+    async def insert(self, collection, doc):
+        """
+        Buffers a document for insertion, flushing if a threshold is reached.
+
+        Args:
+            collection (str): name of the collection
+            doc (dict): document to insert
+        """
+        self.buffers.setdefault(collection, []).append(doc)
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        if len(self.buffers[collection]) >= self.maxdocs:
+            await self.flush()
+
+    async def run(self):
+        """
+        Flusher co-routine: flushes buffers whose documents waited too long.
+        """
+        while True:
+            await asyncio.sleep(self.maxwait / 2)
+            if self.oldest is not None and time.monotonic() - self.oldest >= self.maxwait:
+                await self.flush()
+
+    async def flush(self, save=False):
+        """
+        Writes out every buffered document, marks the written numbers in the
+        number sets, and saves those when due. The database calls run on the
+        writer's own thread so the workers keep going meanwhile.
+
+        Args:
+            save (bool): if True, saves the number sets regardless of savewait
+
+        Returns:
+            dict: collection name -> list of _ids rejected as duplicates
+
+        Raises:
+            the error saving the number sets, only if save is True. Otherwise
+            the save is retried with the next flush
+        """
+        async with self.lock:
+            with STAGE_SECONDS.time("flush"):
+                loop = asyncio.get_running_loop()
+                buffers, self.buffers, self.oldest = self.buffers, dict(), None
+                # the number sets are only touched on the event loop's thread
+                moves = {
+                    collection: self._moving(collection, docs)
+                    for collection, docs in buffers.items()
+                }
+                duplicates = await loop.run_in_executor(
+                    self.executor, self._write, buffers, moves
+                )
+                if self.numbers is not None:
+                    for collection in ("inmates", "unassigned"):
+                        for doc in buffers.get(collection, ()):
+                            self.numbers.record(
+                                int(doc["_id"]), collection == "inmates", doc.get("accessed")
+                            )
+                    if save or time.monotonic() - self.numbers.saved >= self.savewait:
+                        snapshot = self.numbers.snapshot()
+                        try:
+                            await loop.run_in_executor(self.executor, snapshot.save, self.db)
+                        except Exception as e:
+                            # applied with the next save instead
+                            self.numbers.pending[:0] = snapshot.pending
+                            # the last flush has no next one to retry with
+                            if save:
+                                raise
+                            print(f"Saving the number sets failed, retrying with the next flush: {e!r}")
+                        else:
+                            self.numbers.saved = snapshot.saved
+                self.report(duplicates)
+                return duplicates
+
+    def _moving(self, collection, docs):
+        """
+        Returns the _ids of the inmates whose number came back unassigned
+        (released or paroled).
+        """
+        if self.numbers is None:
+            return []
+        if collection == "unassigned":
+            return [
+                str(d["_id"]).zfill(8)
+                for d in docs
+                if d["_id"] in self.numbers.checked and d["_id"] not in self.numbers.unassigned
+            ]
+        return []
+
+    def _write(self, buffers, moves):
+        """
+        Database part of flush, run on the writer's thread.
+
+        Args:
+            buffers (dict): collection name -> documents to write
+            moves (dict): collection name -> _ids of the inmates it releases, from _moving
+        """
+        duplicates = dict()
+        added, removed = [], []
+        # what pgpipe.sync_pipe picks up the changed inmates by
+        written = datetime.now()
+        for collection, docs in buffers.items():
+            if not docs:
+                continue
+            if collection == "unassigned":
+                # kept in the number sets only
+                removed += self._release(moves[collection])
+                continue
+            if collection == "inmates":
+                for d in docs:
+                    d["written"] = written
+            dups = self._insert_many(collection, docs)
+            if collection == "inmates":
+                dupset = set(dups)
+                added += [d for d in docs if d["_id"] not in dupset]
+            if dups:
+                duplicates[collection] = dups
+                old, new = self._reconcile(collection, docs, dups)
+                removed += old
+                added += new
+        if self.aggregates and (added or removed):
+            update_aggregates(self.db, added, removed)
+        return duplicates
+
+    def _insert_many(self, collection, docs):
+        """
+        Inserts documents unordered so one duplicate doesn't stop the rest.
+
+        Returns:
+            list of _ids that were already in the collection
+
+        Raises:
+            BulkWriteError if any write failed for a reason other than a duplicate key
+        """
+        try:
+            self.db[collection].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err["code"] != DUPLICATE_KEY for err in errors):
+                raise
+            return [err["op"]["_id"] for err in errors]
+        if self.pmode >= 3:
+            print(f"{len(docs)} documents added to {collection}")
+        return []
+
+    def _release(self, ids):
+        """
+        Moves the inmates of numbers that are now unassigned into the released
+        collection (released or paroled).
+
+        Returns:
+            list of the inmate documents moved
+        """
+        if not ids:
+            return []
+        released = list(self.db.inmates.find({"_id": {"$in": ids}}))
+        now = datetime.now()
+        for doc in released:
+            doc["tdcj_number"] = doc.pop("_id")
+            doc["released"] = now
+        if released:
+            self.db.released.insert_many(released, ordered=False)
+        self.db.inmates.delete_many({"_id": {"$in": ids}})
+        if self.pmode >= 2:
+            print(f"Moved from inmates to released: {ids}")
+        return released
+
+    def _reconcile(self, collection, docs, dups):
+        """
+        Updates documents rejected as duplicates. An inmate is replaced if its
+        content hash changed, otherwise only its accessed time is updated.
+
+        Args:
+            collection (str): name of the collection
+            docs (list): documents of the flush
+            dups (list): _ids rejected as duplicates
+
+        Returns:
+            tuple: (stored inmates that were replaced, the inmates replacing them)
+        """
+        dups = set(dups)
+        docs = [d for d in docs if d["_id"] in dups]
+        old, new = [], []
+        if collection == "inmates":
+            stored = {
+                d["_id"]: d
+                for d in self.db.inmates.find(
+                    {"_id": {"$in": list(dups)}},
+                    {"hash": 1, "Race": 1, "schema_version": 1, "offenses": 1, "offensetable": 1},
+                )
+            }
+            ops = []
+            for d in docs:
+                if d.get("hash") is not None and stored.get(d["_id"], {}).get("hash") == d["hash"]:
+                    ops.append(UpdateOne(
+                        {"_id": d["_id"]},
+                        {"$set": {"accessed": d["accessed"], "written": d["written"]}},
+                    ))
+                    continue
+                ops.append(ReplaceOne({"_id": d["_id"]}, d))
+                if d["_id"] in stored:
+                    old.append(stored[d["_id"]])
+                new.append(d)
+        else:
+            ops = [
+                UpdateOne({"_id": d["_id"]}, {"$set": {k: v for k, v in d.items() if k != "_id"}})
+                for d in docs
+            ]
+        if ops:
+            self.db[collection].bulk_write(ops, ordered=False)
+            if self.pmode >= 2 and collection == "inmates":
+                print(f"{len(new)} of {len(docs)} rescraped inmates changed")
+        return old, new
+
+    def report(self, duplicates):
+        """
+        Prints the duplicates of a flush per key.
+
+        Args:
+            duplicates (dict): collection name -> list of duplicate _ids
+        """
+        if self.pmode < 3:
+            return
+        for collection, ids in duplicates.items():
+            for _id in ids:
+                print(f"Duplicate tdcj number reconciled: {_id} ({collection})")
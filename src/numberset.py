@@ -0,0 +1,396 @@
+from bisect import bisect_left, bisect_right
+from array import array
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+import time, zlib
+
+
+SETS_ID = "sets"
+# numbers per block the last check of its unassigned numbers is kept for
+BLOCK = 1000
+
+
+class RangeSet:
+    def __init__(self, numbers=()):
+        """
+        Set of integers kept as sorted, merged half-open intervals, which is
+        compact for the long runs of consecutive checked TDCJ numbers.
+
+        Args:
+            numbers: iterable of integers to start with
+        """
+        self.starts = []
+        self.ends = []
+        run = None
+        for n in sorted(set(numbers)):
+            if run is not None and n == run[1]:
+                run[1] += 1
+            else:
+                if run is not None:
+                    self.starts.append(run[0])
+                    self.ends.append(run[1])
+                run = [n, n + 1]
+        if run is not None:
+            self.starts.append(run[0])
+            self.ends.append(run[1])
+
+    def __contains__(self, n):
+        i = bisect_right(self.starts, n) - 1
+        return i >= 0 and n < self.ends[i]
+
+    def __len__(self):
+        return sum(e - s for s, e in zip(self.starts, self.ends))
+
+    def __iter__(self):
+        for s, e in zip(self.starts, self.ends):
+            yield from range(s, e)
+
+    def copy(self):
+        other = RangeSet()
+        other.starts = list(self.starts)
+        other.ends = list(self.ends)
+        return other
+
+    def add(self, n):
+        """
+        Adds one number, merging it into neighbouring intervals.
+        """
+        self.add_range(n, n + 1)
+
+    def add_range(self, lo, hi):
+        """
+        Adds every number in [lo, hi).
+        """
+        if lo >= hi:
+            return
+        # intervals touching [lo, hi) are merged into one
+        i = bisect_left(self.ends, lo)
+        j = bisect_right(self.starts, hi)
+        if i < j:
+            lo = min(lo, self.starts[i])
+            hi = max(hi, self.ends[j - 1])
+        self.starts[i:j] = [lo]
+        self.ends[i:j] = [hi]
+
+    def discard(self, n):
+        """
+        Removes one number if present, splitting its interval.
+        """
+        i = bisect_right(self.starts, n) - 1
+        if i < 0 or n >= self.ends[i]:
+            return
+        start, end = self.starts[i], self.ends[i]
+        pieces = [(s, e) for s, e in ((start, n), (n + 1, end)) if s < e]
+        self.starts[i : i + 1] = [s for s, _ in pieces]
+        self.ends[i : i + 1] = [e for _, e in pieces]
+
+    def count(self, lo, hi):
+        """
+        Returns how many numbers in [lo, hi) are in the set.
+        """
+        total = 0
+        i = max(bisect_right(self.starts, lo) - 1, 0)
+        while i < len(self.starts) and self.starts[i] < hi:
+            total += max(0, min(hi, self.ends[i]) - max(lo, self.starts[i]))
+            i += 1
+        return total
+
+    def between(self, lo, hi):
+        """
+        Yields the numbers in [lo, hi) that are in the set, in order.
+        """
+        i = max(bisect_right(self.starts, lo) - 1, 0)
+        while i < len(self.starts) and self.starts[i] < hi:
+            yield from range(max(lo, self.starts[i]), min(hi, self.ends[i]))
+            i += 1
+
+    def gaps(self, lo, hi):
+        """
+        Yields the (start, end) ranges within [lo, hi) missing from the set.
+        """
+        i = max(bisect_right(self.starts, lo) - 1, 0)
+        pos = lo
+        while pos < hi:
+            if i < len(self.starts) and self.starts[i] <= pos:
+                pos = max(pos, self.ends[i])
+                i += 1
+            elif i < len(self.starts) and self.starts[i] < hi:
+                yield pos, self.starts[i]
+                pos = self.ends[i]
+                i += 1
+            else:
+                yield pos, hi
+                return
+
+    def next_absent(self, n, step=1):
+        """
+        Returns the first number from n onwards, in the direction of step,
+        that is not in the set.
+
+        Args:
+            n (int): number to start from
+            step (int): 1 to search upwards, -1 to search downwards
+        """
+        i = bisect_right(self.starts, n) - 1
+        if i < 0 or n >= self.ends[i]:
+            return n
+        return self.ends[i] if step > 0 else self.starts[i] - 1
+
+    def to_bytes(self):
+        """
+        Serializes the intervals as zlib-compressed deltas.
+        """
+        deltas = array("q")
+        prev = 0
+        for s, e in zip(self.starts, self.ends):
+            deltas.append(s - prev)
+            deltas.append(e - s)
+            prev = e
+        return zlib.compress(deltas.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        deltas = array("q")
+        deltas.frombytes(zlib.decompress(data))
+        rs = cls()
+        prev = 0
+        for i in range(0, len(deltas), 2):
+            start = prev + deltas[i]
+            prev = start + deltas[i + 1]
+            rs.starts.append(start)
+            rs.ends.append(prev)
+        return rs
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+class NumberSets:
+    def __init__(self, checked=None, unassigned=None, lastchecked=None):
+        """
+        The TDCJ numbers checked so far and the subset found unassigned.
+        Numbers that are checked but not unassigned belong to inmates. The
+        unassigned numbers have no documents of their own, so these sets are
+        their only record; when they were looked up is kept per BLOCK numbers.
+
+        Args:
+            checked (RangeSet): every number looked up
+            unassigned (RangeSet): numbers without an inmate
+            lastchecked (dict): block (number // BLOCK) -> datetime of the
+                latest lookup of an unassigned number in it
+        """
+        self.checked = checked or RangeSet()
+        self.unassigned = unassigned or RangeSet()
+        self.lastchecked = lastchecked or dict()
+        self.saved = time.monotonic()
+        # (number, hit, when) recorded since the last save, applied to the stored sets
+        self.pending = []
+
+    def record(self, tdcjnum, hit, when=None):
+        """
+        Marks a number checked, and unassigned unless it belongs to an inmate.
+
+        Args:
+            tdcjnum (int): number looked up
+            hit (bool): True if it belongs to an inmate
+            when (datetime): time of the lookup, defaults to now
+        """
+        when = when or datetime.now()
+        self.checked.add(tdcjnum)
+        if hit:
+            self.unassigned.discard(tdcjnum)
+        else:
+            self.unassigned.add(tdcjnum)
+            self.mark_checked(tdcjnum // BLOCK, when)
+        self.pending.append((tdcjnum, hit, when))
+
+    def mark_checked(self, block, when):
+        if block not in self.lastchecked or self.lastchecked[block] < when:
+            self.lastchecked[block] = when
+
+    def last_checked(self, tdcjnum):
+        """
+        Returns when unassigned numbers near this one were last looked up,
+        or None if that was never recorded.
+        """
+        return self.lastchecked.get(tdcjnum // BLOCK)
+
+    def snapshot(self):
+        """
+        Copy of the sets to save from another thread. It takes over the
+        numbers recorded since the last save.
+        """
+        other = NumberSets(self.checked.copy(), self.unassigned.copy(), dict(self.lastchecked))
+        other.pending, self.pending = self.pending, []
+        return other
+
+    def merge(self, other):
+        """
+        Adds the numbers of other sets that these don't know about yet, e.g.
+        the saved unassigned numbers to sets built from the collections.
+        """
+        for s, e in zip(other.unassigned.starts, other.unassigned.ends):
+            for lo, hi in self.checked.gaps(s, e):
+                self.unassigned.add_range(lo, hi)
+        for s, e in zip(other.checked.starts, other.checked.ends):
+            self.checked.add_range(s, e)
+        for block, when in other.lastchecked.items():
+            self.mark_checked(block, when)
+
+    def num_inmates(self):
+        return len(self.checked) - len(self.unassigned)
+
+    @classmethod
+    def build(cls, db):
+        """
+        Builds the sets by scanning the inmates collection and the unassigned
+        collection the scraper kept one document per unassigned number in
+        before these sets replaced it.
+
+        Args:
+            db (pymongo.database.Database): scraper database
+        """
+        from rescrape import parse_accessed
+
+        sets = cls()
+        misses = []
+        for d in db.unassigned.find({}, {"accessed": 1}):
+            misses.append(int(d["_id"]))
+            accessed = parse_accessed(d.get("accessed"))
+            if accessed is not None:
+                sets.mark_checked(misses[-1] // BLOCK, accessed)
+        hits = [int(d["_id"]) for d in db.inmates.find({}, {"_id": 1})]
+        sets.checked = RangeSet(hits + misses)
+        sets.unassigned = RangeSet(misses)
+        # the old collection wasn't cleaned up for numbers assigned again since
+        for n in hits:
+            sets.unassigned.discard(n)
+        return sets
+
+    @classmethod
+    def load(cls, db):
+        """
+        Loads the sets saved in the numbersets collection.
+
+        Returns:
+            NumberSets, or None if they were never saved
+        """
+        doc = db.numbersets.find_one({"_id": SETS_ID})
+        if doc is not None:
+            return cls.from_document(doc)
+        # saved before both sets shared one versioned document
+        docs = {
+            d["_id"]: d
+            for d in db.numbersets.find({"_id": {"$in": ["checked", "unassigned"]}})
+        }
+        if "checked" not in docs or "unassigned" not in docs:
+            return None
+        return cls(
+            RangeSet.from_bytes(docs["checked"]["data"]),
+            RangeSet.from_bytes(docs["unassigned"]["data"]),
+        )
+
+    @classmethod
+    def from_document(cls, doc):
+        return cls(
+            RangeSet.from_bytes(doc["checked"]),
+            RangeSet.from_bytes(doc["unassigned"]),
+            {int(block): when for block, when in doc.get("lastchecked", {}).items()},
+        )
+
+    def document(self, version):
+        return {
+            "_id": SETS_ID,
+            "checked": self.checked.to_bytes(),
+            "unassigned": self.unassigned.to_bytes(),
+            "checked_count": len(self.checked),
+            "unassigned_count": len(self.unassigned),
+            # mongo only takes string keys
+            "lastchecked": {str(block): when for block, when in self.lastchecked.items()},
+            "version": version,
+        }
+
+    @classmethod
+    def load_or_build(cls, db):
+        """
+        Loads the saved sets, building and saving them first if needed.
+        """
+        sets = cls.load(db)
+        if sets is None:
+            sets = cls.build(db)
+            sets.save(db)
+        return sets
+
+    def save(self, db, replace=False, retries=10):
+        """
+        Saves both sets into the numbersets collection. Scraper processes
+        sharing the database save into the same document, so only the numbers
+        recorded since the last save are applied to the stored sets, and the
+        write only goes through if nobody saved in between; otherwise it is
+        read and applied again. The first save stores the sets as they are.
+
+        Args:
+            db (pymongo.database.Database): scraper database
+            replace (bool): overwrite the stored sets with these, e.g. after
+                building them from the collections
+            retries (int): saves by other processes to read again before giving up
+
+        Raises:
+            RuntimeError if other processes kept saving in between
+        """
+        for _ in range(retries + 1):
+            doc = db.numbersets.find_one({"_id": SETS_ID})
+            version = doc["version"] if doc is not None else 0
+            sets = self
+            if doc is not None and not replace:
+                sets = NumberSets.from_document(doc)
+                for tdcjnum, hit, when in self.pending:
+                    sets.record(tdcjnum, hit, when)
+            if doc is None:
+                try:
+                    db.numbersets.insert_one(sets.document(1))
+                except DuplicateKeyError:
+                    continue
+            elif not db.numbersets.replace_one(
+                {"_id": SETS_ID, "version": version}, sets.document(version + 1)
+            ).matched_count:
+                continue
+            self.pending = []
+            self.saved = time.monotonic()
+            return
+        raise RuntimeError(f"Number sets changed {retries + 1} times while saving")
+
+if __name__ == "__main__":
+    import argparse
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(
+        description="Builds the checked/unassigned number sets from the collections, "
+        "keeping the unassigned numbers saved already."
+    )
+    parser.add_argument("-o", "--out", help="also save the sets in this directory")
+    parser.add_argument("--drop", action="store_true",
+        help="drop the old unassigned collection once its numbers are saved")
+    args = parser.parse_args()
+
+    db = MongoClient("localhost", 27017).tdcj
+    sets = NumberSets.build(db)
+    saved = NumberSets.load(db)
+    if saved is not None:
+        sets.merge(saved)
+    sets.save(db, replace=True)
+    if args.drop:
+        db.unassigned.drop()
+    if args.out:
+        sets.checked.save(f"{args.out}/checked.bin")
+        sets.unassigned.save(f"{args.out}/unassigned.bin")
+    print(
+        f"{len(sets.checked)} checked numbers in {len(sets.checked.starts)} ranges, "
+        f"{len(sets.unassigned)} unassigned in {len(sets.unassigned.starts)} ranges"
+    )
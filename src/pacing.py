@@ -0,0 +1,145 @@
+from contextlib import asynccontextmanager
+import asyncio, time
+
+
+class AIMDController:
+    def __init__(
+        self,
+        maxconcurrency,
+        minconcurrency=1,
+        rate=1.0,
+        minrate=0.05,
+        maxrate=100.0,
+        ratestep=0.25,
+        backoff=0.5,
+        targetlatency=5.0,
+        maxerrorrate=0.05,
+        window=20,
+        pmode=1,
+    ):
+        """
+        Paces all workers together. Every lookup holds a concurrency slot and
+        waits its turn at the request rate. Latency and errors of the last
+        window of lookups decide the next limits: additive increase while the
+        site keeps up, multiplicative decrease as soon as it slows or fails.
+
+        Args:
+            maxconcurrency (int): most lookups in flight, usually the worker count
+            minconcurrency (int): fewest lookups allowed in flight
+            rate (float): starting lookups per second
+            minrate (float): lowest lookups per second
+            maxrate (float): highest lookups per second
+            ratestep (float): lookups per second added after a good window
+            backoff (float): factor applied to both limits after a bad window
+            targetlatency (float): 90th percentile latency in seconds above
+                which a window counts as bad
+            maxerrorrate (float): error rate above which a window counts as bad
+            window (int): lookups per adjustment
+            pmode (int): print mode. Higher the number, the more is printed
+        """
+        self.maxconcurrency = maxconcurrency
+        self.minconcurrency = minconcurrency
+        self.concurrency = max(minconcurrency, min(maxconcurrency, 2))
+        self.rate = rate
+        self.minrate = minrate
+        self.maxrate = maxrate
+        self.ratestep = ratestep
+        self.backoff = backoff
+        self.targetlatency = targetlatency
+        self.maxerrorrate = maxerrorrate
+        self.window = window
+        self.pmode = pmode
+        self.inflight = 0
+        self.nextstart = time.monotonic()
+        self.latencies = []
+        self.errors = 0
+        self.p90 = None
+        self.cond = asyncio.Condition()
+
+    def limits(self):
+        """
+        Returns the current limits and the measurements behind them.
+        """
+        return {
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "inflight": self.inflight,
+            "p90latency": self.p90,
+        }
+
+    def timeout(self, base):
+        """
+        Returns how long to wait for a page: the base wait, stretched to twice
+        the recent 90th percentile latency when the site is slow.
+
+        Args:
+            base (float): shortest wait in seconds
+        """
+        if self.p90 is None:
+            return base * 3
+        return max(base, 2 * self.p90)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds a concurrency slot for one lookup and records its latency, or an
+        error if the lookup raised. A lookup cancelled before its turn came
+        records nothing.
+        """
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.inflight < self.concurrency)
+            self.inflight += 1
+        start = None
+        ok = False
+        # the slot is given back even if the lookup is cancelled while waiting
+        try:
+            # space out starts at the current rate
+            now = time.monotonic()
+            turn = max(now, self.nextstart)
+            self.nextstart = turn + 1 / self.rate
+            await asyncio.sleep(turn - now)
+
+            start = time.monotonic()
+            yield
+            ok = True
+        finally:
+            async with self.cond:
+                self.inflight -= 1
+                if start is not None:
+                    self.record(time.monotonic() - start, ok)
+                self.cond.notify_all()
+
+    def record(self, latency, ok):
+        """
+        Adds one lookup to the window and adjusts the limits once it is full.
+
+        Args:
+            latency (float): seconds the lookup took
+            ok (bool): False if the lookup failed
+        """
+        self.latencies.append(latency)
+        self.errors += not ok
+        if len(self.latencies) < self.window:
+            return
+        self.latencies.sort()
+        # nearest rank, so small windows don't report a lower latency
+        n = len(self.latencies)
+        self.p90 = self.latencies[min(n - 1, max(0, round(0.9 * n) - 1))]
+        errorrate = self.errors / len(self.latencies)
+        self.latencies, self.errors = [], 0
+
+        if errorrate > self.maxerrorrate or self.p90 > self.targetlatency:
+            self.concurrency = max(
+                self.minconcurrency, int(self.concurrency * self.backoff)
+            )
+            self.rate = max(self.minrate, self.rate * self.backoff)
+            if self.pmode >= 1:
+                print(
+                    f"Backing off to {self.concurrency} workers at {self.rate:.2f}/s "
+                    f"(p90 {self.p90:.1f}s, {errorrate:.0%} errors)"
+                )
+        else:
+            self.concurrency = min(self.maxconcurrency, self.concurrency + 1)
+            self.rate = min(self.maxrate, self.rate + self.ratestep)
+            if self.pmode >= 2:
+                print(f"Speeding up to {self.concurrency} workers at {self.rate:.2f}/s")
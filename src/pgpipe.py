@@ -1,20 +1,79 @@
-import sys
+import sys, io, os, traceback
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from queue import Empty
 from pymongo import MongoClient
 from datetime import datetime, timedelta
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import psycopg2 as pg2
-from psycopg2.errors import UniqueViolation
+from psycopg2.errors import UniqueViolation, DeadlockDetected
+from canonical import canonicalize
+from rescrape import ACCESSED_FORMAT, parse_accessed
+from schema import OFFENSE_FIELDS, is_current, offense_count
+from report import CAP_DAYS
 
 
-def run_pipe(print_count=1000):
+OFFENDER_COLUMNS = (
+    'sid_number',
+    'tdcj_number',
+    'name',
+    'race',
+    'gender',
+    'date_of_birth',
+    'max_sentence_date',
+    'msd_category',
+    'current_facility',
+    'projected_release_date',
+    'parole_eligibility_date',
+    'visitation_eligible',
+    'last_accessed',
+)
+OFFENDER_KEYS = (
+    'SID Number',
+    '_id',
+    'Name',
+    'Race',
+    'Gender',
+    'DOB',
+    'Maximum Sentence Date',
+    'MSD_cat',
+    'Current Facility',
+    'Projected Release Date',
+    'Parole Eligibility Date',
+    'Offender Visitation Eligible',
+    'accessed',
+)
+OFFENSE_COLUMNS = (
+    'tdcj_number',
+    'offense_date',
+    'offense',
+    'sentence_date',
+    'county',
+    'case_number',
+    'sentence',
+    'canonical_offense',
+)
+OFFENSE_KEYS = (
+    'tdcj_num',
+    'Offense Date',
+    'Offense',
+    'Sentence Date',
+    'County',
+    'Case No',
+    'Sentence',
+    'Canonical Offense',
+)
+
+
+def run_pipe(print_count=1000, bulk=False, batch_size=5000):
     """
     Converts a mongoDB open on localhost:27017 to a postgreSQL 
     DB open on localhost:5432.
 
     Args:
         print_count: prints progress after every number of this inserts
+        bulk: if True, loads batches with COPY and a set-based merge 
+            instead of one INSERT and commit per offender
+        batch_size: number of offenders per COPY batch in bulk mode
 
     Raises:
         any exception during insertion with extra information to identify the troublesome record
@@ -31,6 +90,12 @@ def run_pipe(print_count=1000):
     conn = pg2.connect(dbname='tdcj', host='localhost', port=5432, user='postgres')
     cur = conn.cursor()
     
+    if bulk:
+        load_bulk(conn, cur, results, print_count, batch_size)
+        cur.close()
+        conn.close()
+        return
+
     #insert every inmate into the postgres DB
     try:
         count = 0
@@ -46,26 +111,269 @@ def run_pipe(print_count=1000):
     conn.close()
 
 
-def _reset_tdcj_pgdb():
+def run_pipe_parallel(processes=None, num_ranges=None, print_count=10000, 
+        batch_size=5000):
+    """
+    Converts the mongoDB to the postgreSQL DB like run_pipe in bulk mode, but 
+    splits the inmates' _id space into ranges and migrates each range in a 
+    separate process with its own mongo cursor and postgres connection.
+
+    Args:
+        processes: number of worker processes, defaults to the number of cores
+        num_ranges: number of _id ranges, defaults to 4 per process so that 
+            uneven ranges still keep every core busy
+        print_count: prints aggregated progress after every number of this inserts
+        batch_size: number of offenders per COPY batch
+
+    Raises:
+        RuntimeError listing every failed range in range order, after all 
+        other ranges have finished
+    """
+    processes = processes or os.cpu_count()
+    client = MongoClient('localhost', 27017)
+    ranges = _id_ranges(client.tdcj.inmates, num_ranges or processes * 4)
+    client.close()
+    print(f'Migrating {len(ranges)} ranges with {processes} processes')
+
+    manager = mp.Manager()
+    progress = manager.Queue()
+    count = 0
+    failures = []
+    with ProcessPoolExecutor(processes) as pool:
+        pending = {
+            pool.submit(_migrate_range, i, lo, hi, last, progress, batch_size)
+            for i, (lo, hi, last) in enumerate(ranges)
+        }
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            count = _drain_progress(progress, count, print_count)
+            for future in done:
+                i, migrated, error = future.result()
+                if error is not None:
+                    failures.append((i, migrated, error))
+    count = _drain_progress(progress, count, print_count)
+    manager.shutdown()
+    print(f'{count} documents cleared pipe')
+
+    if failures:
+        report = '\n'.join(
+            f'range {i} [{ranges[i][0]}, {ranges[i][1]}{"]" if ranges[i][2] else ")"} '
+            f'failed after {migrated} documents:\n{error}'
+            for i, migrated, error in sorted(failures))
+        raise RuntimeError(f'{len(failures)} of {len(ranges)} ranges failed\n{report}')
+
+
+def _id_ranges(collection, num_ranges):
+    """
+    Splits a collection's _id space into ranges holding about the same number 
+    of documents.
+
+    Args:
+        collection: mongo collection
+        num_ranges: number of ranges wanted
+
+    Returns:
+        list of (lower bound, upper bound, upper bound inclusive) tuples
+    """
+    buckets = list(collection.aggregate([
+        {'$bucketAuto': {'groupBy': '$_id', 'buckets': num_ranges}},
+        {'$sort': {'_id.min': 1}},
+    ]))
+    return [
+        (b['_id']['min'], b['_id']['max'], i == len(buckets) - 1)
+        for i, b in enumerate(buckets)
+    ]
+
+
+def _migrate_range(i, lo, hi, last, progress, batch_size):
+    """
+    Process pool worker: migrates the inmates with _id in one range.
+
+    Args:
+        i: index of the range
+        lo: inclusive lower bound of the range
+        hi: upper bound of the range
+        last: True if the upper bound is inclusive
+        progress: queue receiving the number of documents of each loaded batch
+        batch_size: number of offenders per COPY batch
+
+    Returns:
+        tuple: (range index, documents migrated, formatted traceback or None)
+    """
+    migrated = 0
+
+    def report(n):
+        nonlocal migrated
+        migrated += n
+        progress.put(n)
+
+    try:
+        client = MongoClient('localhost', 27017)
+        results = client.tdcj.inmates.find(
+            {'_id': {'$gte': lo, '$lte' if last else '$lt': hi}}).sort('_id', 1)
+        conn = pg2.connect(dbname='tdcj', host='localhost', port=5432, user='postgres')
+        cur = conn.cursor()
+        try:
+            load_bulk(conn, cur, results, batch_size=batch_size, progress=report)
+        finally:
+            cur.close()
+            conn.close()
+            client.close()
+    except Exception:
+        return i, migrated, traceback.format_exc()
+    return i, migrated, None
+
+
+def _drain_progress(progress, count, print_count):
+    """
+    Adds up the batch sizes reported by the workers so far and prints the 
+    total whenever it passes a multiple of print_count.
+
+    Returns:
+        the new total
+    """
+    while True:
+        try:
+            n = progress.get_nowait()
+        except Empty:
+            return count
+        if (count + n) // print_count > count // print_count:
+            print(f'{count + n} documents cleared pipe')
+        count += n
+
+
+# how far before a sync started the next one picks up, see sync_pipe
+SYNC_OVERLAP = timedelta(minutes=5)
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def sync_pipe(print_count=1000, batch_size=5000):
+    """
+    Incrementally refreshes the postgreSQL DB: migrates only the inmates 
+    written to mongo at or after the stored watermark, upserting each 
+    offender and replacing its offenses, then advances the watermark to when 
+    this sync started.
+
+    The watermark is the time documents were written, not when their page 
+    was accessed, so late writes like archive re-parses and delayed flushes 
+    are synced too. It is set SYNC_OVERLAP before the sync started, as 
+    documents stamped just before may still be on their way in; re-syncing 
+    those is harmless.
+
+    Args:
+        print_count: prints progress after about every number of this inserts
+        batch_size: number of offenders per COPY batch
+    """
+    client = MongoClient('localhost', 27017)
+    inmates = client.tdcj.inmates
+    inmates.create_index('written')
+
+    conn = pg2.connect(dbname='tdcj', host='localhost', port=5432, user='postgres')
+    cur = conn.cursor()
+    _create_state_table(cur)
+    conn.commit()
+
+    watermark = _get_watermark(cur)
+    started = datetime.now() - SYNC_OVERLAP
+    count = load_bulk(conn, cur, inmates.find(_written_since(watermark)), 
+        print_count, batch_size, upsert=True)
+    _set_watermark(conn, cur, started)
+    if count:
+        refresh_analysis_views(conn, cur)
+    print(f'{count} documents synced since {watermark}, watermark now {started}')
+
+    cur.close()
+    conn.close()
+    client.close()
+
+
+def _written_since(watermark):
+    """
+    Query for the inmates written at or after a watermark. Documents written 
+    before the writers stamped 'written' are matched on 'accessed' instead, 
+    both the strings of version 1 documents and the datetimes of version 2.
+    """
+    if watermark is None:
+        return {}
+    return {'$or': [
+        {'written': {'$gte': watermark}},
+        {'written': {'$exists': False}, '$or': [
+            {'accessed': {'$gte': watermark.strftime(ACCESSED_FORMAT)}},
+            {'accessed': {'$gte': watermark}},
+        ]},
+    ]}
+
+
+def _create_state_table(cur):
+    """
+    Creates the table holding the pipe's watermark, if missing.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pipe_state (
+            name VARCHAR(32) PRIMARY KEY,
+            value VARCHAR(32)
+        )
+        """)
+
+
+def _get_watermark(cur):
+    """
+    Returns the stored watermark as a datetime, or None if nothing was 
+    synced. An 'accessed' watermark stored before the 'written' one is read 
+    the same way.
+    """
+    cur.execute("SELECT name, value FROM pipe_state WHERE name IN ('written', 'accessed')")
+    rows = dict(cur.fetchall())
+    if 'written' in rows:
+        return datetime.strptime(rows['written'], WATERMARK_FORMAT)
+    return parse_accessed(rows.get('accessed'))
+
+
+def _set_watermark(conn, cur, value):
+    """
+    Stores the 'written' watermark.
+
+    Args:
+        value (datetime): documents written from then on are synced next time
+    """
+    _create_state_table(cur)
+    cur.execute(
+        """
+        INSERT INTO pipe_state (name, value) VALUES ('written', %s)
+        ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+        """, (value.strftime(WATERMARK_FORMAT),))
+    conn.commit()
+
+
+def _reset_tdcj_pgdb(dbname='tdcj'):
     """
     Deletes and recreates the tdcj SQL database.
+
+    Args:
+        dbname: name of the database, other than tdcj for scratch copies
     """
     conn = pg2.connect(host='localhost', port=5432, user='postgres')
     conn.set_session(autocommit=True)
     cur = conn.cursor()
 
-    cur.execute('DROP DATABASE IF EXISTS tdcj')
-    cur.execute('CREATE DATABASE tdcj')
+    cur.execute(f'DROP DATABASE IF EXISTS {dbname}')
+    cur.execute(f'CREATE DATABASE {dbname}')
 
     cur.close()
     conn.close()
 
 
-def _create_tables():
+def _create_tables(dbname='tdcj', partitioned=False):
     """
-    Creates the 3 tables for the postgres DB.
+    Creates the 4 tables for the postgres DB.
+
+    Args:
+        dbname: name of the database
+        partitioned: if True, offenses is partitioned by the year of
+            sentence_date, so queries over a span of years skip the rest
     """
-    conn = pg2.connect(dbname='tdcj', host='localhost', port=5432, user='postgres')
+    conn = pg2.connect(dbname=dbname, host='localhost', port=5432, user='postgres')
     cur = conn.cursor()
 
     commands = (
@@ -96,11 +404,15 @@ def _create_tables():
             county VARCHAR(13) NOT NULL,
             case_number VARCHAR(18),
             sentence INTEGER NOT NULL,
-            PRIMARY KEY (tdcj_number, offense_number),
+            canonical_offense TEXT,
+            PRIMARY KEY ({offense_key}),
             FOREIGN KEY (tdcj_number)
                 REFERENCES offenders (tdcj_number)
-        )
-        ''',
+        ) {partitioning}
+        '''.format(
+            offense_key='tdcj_number, offense_number' + 
+                (', sentence_date' if partitioned else ''),
+            partitioning='PARTITION BY RANGE (sentence_date)' if partitioned else ''),
         '''
         CREATE TABLE offender_pipe_err (
             sid_number INTEGER UNIQUE,
@@ -117,26 +429,129 @@ def _create_tables():
             visitation_eligible VARCHAR(4),
             last_accessed TIMESTAMP NOT NULL
         )
+        ''',
+        '''
+        CREATE TABLE pipe_state (
+            name VARCHAR(32) PRIMARY KEY,
+            value VARCHAR(32)
+        )
         '''
     )
 
     for c in commands:
         cur.execute(c)
+    if partitioned:
+        _create_offense_partitions(cur)
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def _create_offense_partitions(cur, first=1950, last=None):
+    """
+    Creates one offenses partition per sentence year from first to last, and
+    a default partition for dates outside of them.
+    """
+    last = last or datetime.now().year + 1
+    for year in range(first, last + 1):
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS offenses_{year} PARTITION OF offenses
+            FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')
+            """)
+    cur.execute('CREATE TABLE IF NOT EXISTS offenses_other PARTITION OF offenses DEFAULT')
 
+
+ANALYSIS_VIEWS = ('offense_sentence_stats', 'offense_sentence_histogram')
+
+
+def create_analysis_layer(dbname='tdcj'):
+    """
+    Adds the indexes used by the per-crime comparisons and the materialized 
+    views of the sentence distributions per canonical offense and race. Run 
+    after loading, as building indexes at the end is faster than maintaining 
+    them during the load. Views from before they grouped by the canonical 
+    offense are rebuilt.
+    """
+    conn = pg2.connect(dbname=dbname, host='localhost', port=5432, user='postgres')
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_class c
+        WHERE c.relname = ANY(%s) AND c.relkind = 'm' AND NOT EXISTS (
+            SELECT 1 FROM pg_attribute a
+            WHERE a.attrelid = c.oid AND a.attname = 'canonical_offense')
+        """, (list(ANALYSIS_VIEWS),))
+    for (view,) in cur.fetchall():
+        cur.execute(f'DROP MATERIALIZED VIEW {view}')
+    commands = (
+        'CREATE INDEX IF NOT EXISTS offenders_race_idx ON offenders (race)',
+        'CREATE INDEX IF NOT EXISTS offenses_offense_idx ON offenses (offense)',
+        'CREATE INDEX IF NOT EXISTS offenses_canonical_offense_idx ON offenses (canonical_offense)',
+        'CREATE INDEX IF NOT EXISTS offenses_county_idx ON offenses (county)',
+        'CREATE INDEX IF NOT EXISTS offenses_sentence_date_idx ON offenses (sentence_date)',
+        f'''
+        CREATE MATERIALIZED VIEW IF NOT EXISTS offense_sentence_stats AS
+        SELECT f.canonical_offense, o.race, count(*) AS n,
+            avg(f.sentence) AS mean_days,
+            stddev_samp(f.sentence) AS std_days,
+            avg(LEAST(f.sentence, {CAP_DAYS})) AS capped_mean_days,
+            stddev_samp(LEAST(f.sentence, {CAP_DAYS})) AS capped_std_days,
+            percentile_cont(ARRAY[0.1, 0.25, 0.5, 0.75, 0.9]) WITHIN GROUP 
+                (ORDER BY LEAST(f.sentence, {CAP_DAYS})) AS capped_deciles
+        FROM offenses f JOIN offenders o USING (tdcj_number)
+        GROUP BY f.canonical_offense, o.race
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS offense_sentence_stats_key
+        ON offense_sentence_stats (canonical_offense, race)
+        ''',
+        f'''
+        CREATE MATERIALIZED VIEW IF NOT EXISTS offense_sentence_histogram AS
+        SELECT f.canonical_offense, o.race, LEAST(f.sentence, {CAP_DAYS}) / 365 AS years, 
+            count(*) AS n
+        FROM offenses f JOIN offenders o USING (tdcj_number)
+        GROUP BY 1, 2, 3
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS offense_sentence_histogram_key
+        ON offense_sentence_histogram (canonical_offense, race, years)
+        ''',
+    )
+    for c in commands:
+        cur.execute(c)
     conn.commit()
     cur.close()
     conn.close()
 
+
+def refresh_analysis_views(conn, cur):
+    """
+    Recomputes the analysis views that exist, without blocking their readers.
+    """
+    cur.execute('SELECT matviewname FROM pg_matviews WHERE matviewname = ANY(%s)',
+        (list(ANALYSIS_VIEWS),))
+    for (view,) in cur.fetchall():
+        cur.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {view}')
+    conn.commit()
+
 def prep_offender_data(entry):
     """
-    Cleans data to insert into SQL database.
+    Cleans data to insert into SQL database. Takes documents of both schema 
+    versions.
 
     Args:
         entry: 1 offender's info and offense history
 
     Returns: 
         tuple: (cleaned offender info dict, cleaned offense history array)
+
+    Raises:
+        ValueError for unhandled maximum sentence dates or sentence lengths
     """
+    if is_current(entry):
+        return _prep_current(entry)
     offense_dict = entry.pop('offensetable')
     tdcj_num = entry['_id']
     entry['Maximum Sentence Date'], entry['MSD_cat'] = split_msd_cat(\
@@ -150,6 +565,7 @@ def prep_offender_data(entry):
     if entry['Projected Release Date'] == 'NOT AVAILABLE':
         entry['Projected Release Date'] = None
     entry['Gender'] = entry['Gender'] == 'F'
+    entry['accessed'] = parse_accessed(entry.get('accessed'))
 
     offenses = [\
         {k:offense_dict[k][i] for k in offense_dict.keys()}\
@@ -159,7 +575,36 @@ def prep_offender_data(entry):
         offense['tdcj_num'] = tdcj_num
         offense['Sentence'] = sentence_str_to_days_int(\
             offense.pop('Sentence (YY-MM-DD)'))
+        offense['Canonical Offense'] = canonicalize(offense['Offense'])
+
+    return entry, offenses
 
+def _prep_current(entry):
+    """
+    prep_offender_data for version 2 documents, whose dates and sentences 
+    are typed already.
+    """
+    records = entry.pop('offenses')
+    tdcj_num = entry['_id']
+    if isinstance(entry['Maximum Sentence Date'], str):
+        raise ValueError(f'unhandled value: msd={entry["Maximum Sentence Date"]} '
+            f'tdcj_num={tdcj_num}')
+    if abs(entry['MSD_cat']) > 1:
+        entry['Projected Release Date'] = None
+        if abs(entry['MSD_cat']) > 2:
+            entry['Parole Eligibility Date'] = None
+    entry['Gender'] = entry['Gender'] == 'F'
+
+    offenses = []
+    for record in records:
+        if record['sentence_days'] is None:
+            raise ValueError(f'unhandled value: sentence={record.get("sentence")} '
+                f'tdcj_num={tdcj_num}')
+        offense = {key: record[field] for field, key in OFFENSE_FIELDS.items()}
+        offense['tdcj_num'] = tdcj_num
+        offense['Sentence'] = record['sentence_days']
+        offense['Canonical Offense'] = canonicalize(offense['Offense'])
+        offenses.append(offense)
     return entry, offenses
 
 def insert_offender(conn, cur, entry):
@@ -251,7 +696,8 @@ def insert_offenses(cur, offenses):
                 sentence_date,
                 county,
                 case_number,
-                sentence      
+                sentence,
+                canonical_offense
             )
             VALUES (
                 %(tdcj_num)s, 
@@ -260,11 +706,246 @@ def insert_offenses(cur, offenses):
                 %(Sentence Date)s,
                 %(County)s,
                 %(Case No)s,
-                %(Sentence)s
+                %(Sentence)s,
+                %(Canonical Offense)s
             );
             """, offense)
 
 
+def load_bulk(conn, cur, entries, print_count=1000, batch_size=5000, progress=None,
+        upsert=False):
+    """
+    Cleans and loads offenders in batches: each batch is streamed into
+    temporary staging tables with COPY and merged with a few set-based
+    statements in a single transaction.
+
+    Args:
+        conn: connection to the postgres DB
+        cur: cursor for the postgres DB
+        entries: iterable of mongo documents
+        print_count: prints progress after about every number of this inserts
+        batch_size: number of offenders per batch
+        progress: if given, called with the size of every loaded batch 
+            instead of printing progress
+        upsert: if True, replaces offenders already in the DB (see _merge_stage)
+
+    Returns:
+        number of offenders loaded
+
+    Raises:
+        any exception during cleaning or loading with extra information 
+        to identify the troublesome batch
+    """
+    _create_staging_tables(cur)
+    conn.commit()
+
+    if progress is None:
+        def progress(n):
+            if (count + n) // print_count > count // print_count:
+                print(f'{count + n} documents cleared pipe')
+
+    count = 0
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            n = _load_batch(conn, cur, batch, upsert=upsert)
+            progress(n)
+            count += n
+            batch = []
+    if batch:
+        n = _load_batch(conn, cur, batch, upsert=upsert)
+        progress(n)
+        count += n
+    return count
+
+
+def _create_staging_tables(cur):
+    """
+    Creates session-local staging tables that empty themselves at every commit.
+    """
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS offenders_stage (
+            LIKE offenders,
+            seq INTEGER NOT NULL,
+            accepted BOOLEAN NOT NULL DEFAULT FALSE
+        ) ON COMMIT DELETE ROWS
+        """)
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS offenses_stage (
+            seq INTEGER NOT NULL,
+            tdcj_number INTEGER,
+            offense_date DATE,
+            offense VARCHAR(32),
+            sentence_date DATE,
+            county VARCHAR(13),
+            case_number VARCHAR(18),
+            sentence INTEGER,
+            canonical_offense TEXT
+        ) ON COMMIT DELETE ROWS
+        """)
+
+
+def _load_batch(conn, cur, batch, retries=3, upsert=False):
+    """
+    Cleans, stages and merges one batch of offenders. A merge that collides 
+    with a batch committed concurrently by another connection is retried, 
+    so the conflicting rows then go to offender_pipe_err.
+
+    Args:
+        conn: connection to the postgres DB
+        cur: cursor for the postgres DB
+        batch: list of mongo documents
+        retries: number of times to retry a merge after a concurrent conflict
+        upsert: if True, replaces offenders already in the DB (see _merge_stage)
+
+    Returns:
+        number of offenders in the batch
+    """
+    # pandas is only loaded by the bulk paths that need it
+    from batch_clean import prep_offender_batch
+
+    try:
+        offenders, offenses = prep_offender_batch(batch)
+    except Exception:
+        # find the troublesome record the slow way for a useful message
+        for entry in batch:
+            try:
+                prep_offender_data(dict(entry))
+            except Exception as e:
+                raise type(e)(f'{str(e)} problematic entry: {entry}')\
+                    .with_traceback(sys.exc_info()[2])
+        raise
+    offenders['seq'] = range(len(offenders))
+    offenses['seq'] = [
+        seq for seq, entry in enumerate(batch) for _ in range(offense_count(entry))]
+    offender_rows = _frame_rows(offenders, OFFENDER_KEYS + ('seq',))
+    offense_rows = _frame_rows(offenses, ('seq',) + OFFENSE_KEYS)
+
+    for attempt in range(retries + 1):
+        try:
+            _copy_rows(cur, 'offenders_stage', OFFENDER_COLUMNS + ('seq',), offender_rows)
+            _copy_rows(cur, 'offenses_stage', ('seq',) + OFFENSE_COLUMNS, offense_rows)
+            _merge_stage(cur, upsert)
+            conn.commit()
+            return len(batch)
+        except (UniqueViolation, DeadlockDetected) as e:
+            conn.rollback()
+            if attempt < retries:
+                continue
+            raise type(e)(f'{str(e)} tdcj_nums={batch[0]["_id"]}..{batch[-1]["_id"]}')\
+                .with_traceback(sys.exc_info()[2])
+        except Exception as e:
+            conn.rollback()
+            raise type(e)(f'{str(e)} tdcj_nums={batch[0]["_id"]}..{batch[-1]["_id"]}')\
+                .with_traceback(sys.exc_info()[2])
+
+
+def _frame_rows(frame, columns):
+    """
+    Returns the given columns of a frame as lists of plain python values, 
+    with None for missing values.
+    """
+    frame = frame[list(columns)].astype(object)
+    return frame.where(frame.notna(), None).values.tolist()
+
+
+def _merge_stage(cur, upsert=False):
+    """
+    Moves staged offenders into offenders, or into offender_pipe_err when their 
+    SID or TDCJ number is already taken (by the DB or an earlier row in the 
+    batch), and then moves the offenses of accepted offenders.
+
+    Args:
+        cur: cursor for the postgres DB
+        upsert: if True, a staged offender replaces the row with its TDCJ 
+            number along with that offender's offenses, and only a SID taken 
+            by a different TDCJ number counts as a conflict
+    """
+    offender_cols = ', '.join(OFFENDER_COLUMNS)
+    taken = 'o.sid_number = r.sid_number AND o.tdcj_number <> r.tdcj_number' \
+        if upsert else 'o.tdcj_number = r.tdcj_number OR o.sid_number = r.sid_number'
+    cur.execute(
+        f"""
+        WITH ranked AS (
+            SELECT seq, tdcj_number, sid_number,
+                row_number() OVER (PARTITION BY tdcj_number ORDER BY seq) AS tdcj_rank,
+                row_number() OVER (PARTITION BY sid_number ORDER BY seq) AS sid_rank
+            FROM offenders_stage
+        )
+        UPDATE offenders_stage s SET accepted = TRUE
+        FROM ranked r
+        WHERE s.seq = r.seq
+            AND r.tdcj_rank = 1
+            AND (r.sid_number IS NULL OR r.sid_rank = 1)
+            AND NOT EXISTS (SELECT 1 FROM offenders o WHERE {taken})
+        """)
+    on_conflict = ''
+    if upsert:
+        on_conflict = 'ON CONFLICT (tdcj_number) DO UPDATE SET ' + ', '.join(
+            f'{c} = EXCLUDED.{c}' for c in OFFENDER_COLUMNS if c != 'tdcj_number')
+        for table in ('offenses', 'offender_pipe_err'):
+            cur.execute(
+                f"""
+                DELETE FROM {table} t USING offenders_stage s
+                WHERE s.accepted AND t.tdcj_number = s.tdcj_number
+                """)
+    cur.execute(
+        f"""
+        INSERT INTO offenders ({offender_cols})
+        SELECT {offender_cols} FROM offenders_stage WHERE accepted ORDER BY seq
+        {on_conflict}
+        """)
+    cur.execute(
+        f"""
+        INSERT INTO offender_pipe_err ({offender_cols})
+        SELECT {offender_cols} FROM offenders_stage WHERE NOT accepted ORDER BY seq
+        ON CONFLICT DO NOTHING
+        """)
+    offense_cols = ', '.join(OFFENSE_COLUMNS)
+    cur.execute(
+        f"""
+        INSERT INTO offenses ({offense_cols})
+        SELECT {', '.join('os.' + c for c in OFFENSE_COLUMNS)}
+        FROM offenses_stage os JOIN offenders_stage s ON os.seq = s.seq
+        WHERE s.accepted
+        """)
+
+
+def _copy_rows(cur, table, columns, rows):
+    """
+    Streams rows into a table with COPY ... FROM STDIN in text format.
+
+    Args:
+        cur: cursor for the postgres DB
+        table: name of the table
+        columns: column names in row order
+        rows: iterable of row sequences
+    """
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(map(_copy_value, row)))
+        buf.write('\n')
+    buf.seek(0)
+    cur.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', buf)
+
+
+def _copy_value(value):
+    """
+    Formats one value for COPY's text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t')\
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
 def split_msd_cat(msd):
     """
     Splits the date portion and codifies occasional accompanying text
@@ -316,6 +997,35 @@ def sentence_str_to_days_int(string):
 
         
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--print_count', type=int, default=1000)
+    parser.add_argument('--bulk', action='store_true')
+    parser.add_argument('--sync', action='store_true',
+        help='only migrate inmates written since the last run, keeping the DB')
+    parser.add_argument('-b', '--batch_size', type=int, default=5000)
+    parser.add_argument('-j', '--processes', type=int, default=0,
+        help='migrate in parallel with this many processes (bulk mode)')
+    parser.add_argument('--analysis', action='store_true',
+        help='partition offenses by sentence year and add the analysis indexes and views')
+    args = parser.parse_args()
+
+    if args.sync:
+        sync_pipe(args.print_count, args.batch_size)
+        sys.exit()
+
+    # everything written from here on is picked up by the next sync
+    watermark = datetime.now() - SYNC_OVERLAP
     _reset_tdcj_pgdb()
-    _create_tables()
-    run_pipe()
+    _create_tables(partitioned=args.analysis)
+    if args.processes:
+        run_pipe_parallel(args.processes, print_count=args.print_count, 
+            batch_size=args.batch_size)
+    else:
+        run_pipe(args.print_count, args.bulk, args.batch_size)
+    if args.analysis:
+        create_analysis_layer()
+    conn = pg2.connect(dbname='tdcj', host='localhost', port=5432, user='postgres')
+    _set_watermark(conn, conn.cursor(), watermark)
+    conn.close()
@@ -0,0 +1,167 @@
+from itertools import combinations
+import psycopg2 as pg2
+from psycopg2.extras import RealDictCursor
+from canonical import canonicalize
+from report import welch
+
+
+def connect(dbname='tdcj'):
+    """
+    Opens a connection to the migrated postgres DB.
+    """
+    return pg2.connect(dbname=dbname, host='localhost', port=5432, user='postgres')
+
+
+def _fetch(conn, query, params=()):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(query, params)
+        return [dict(row) for row in cur.fetchall()]
+
+
+def _where(**filters):
+    """
+    Builds a WHERE clause matching every filter that is not None. A list or
+    tuple matches any of its values.
+    """
+    clauses, params = [], []
+    for column, value in filters.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            clauses.append(f'{column} = ANY(%s)')
+            params.append(list(value))
+        else:
+            clauses.append(f'{column} = %s')
+            params.append(value)
+    return ('WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def _canonical(offense):
+    """
+    The canonical form of an offense or list of offenses, so any spelling
+    matches the views.
+    """
+    if offense is None:
+        return None
+    if isinstance(offense, (list, tuple)):
+        return [canonicalize(o) for o in offense]
+    return canonicalize(offense)
+
+
+def sentence_stats(conn, offense=None, race=None, min_n=1):
+    """
+    Sentence statistics per canonical offense and race from the
+    offense_sentence_stats view, largest groups first.
+
+    Args:
+        conn: connection to the postgres DB
+        offense: an offense or list of offenses to keep, in any spelling, or
+            None for all
+        race: a race or list of races to keep, or None for all
+        min_n: smallest group size returned
+
+    Returns:
+        list of dicts with canonical_offense, race, n, mean_days, std_days,
+        capped_mean_days, capped_std_days and capped_deciles
+    """
+    where, params = _where(canonical_offense=_canonical(offense), race=race)
+    where = f'{where} AND n >= %s' if where else 'WHERE n >= %s'
+    return _fetch(conn,
+        f'SELECT * FROM offense_sentence_stats {where} ORDER BY n DESC',
+        params + [min_n])
+
+
+def sentence_histogram(conn, offense, race=None):
+    """
+    Number of capped sentences per whole year for an offense, in any
+    spelling, from the offense_sentence_histogram view.
+
+    Returns:
+        list of dicts with race, years and n
+    """
+    where, params = _where(canonical_offense=_canonical(offense), race=race)
+    return _fetch(conn,
+        f'SELECT race, years, n FROM offense_sentence_histogram {where} '
+        'ORDER BY race, years', params)
+
+
+def top_offenses(conn, n=5, race=None):
+    """
+    The n most common canonical offenses, with their number of sentences.
+
+    Returns:
+        list of dicts with canonical_offense and n
+    """
+    where, params = _where(race=race)
+    return _fetch(conn,
+        f'SELECT canonical_offense, sum(n)::INTEGER AS n FROM offense_sentence_stats '
+        f'{where} GROUP BY canonical_offense ORDER BY n DESC LIMIT %s', params + [n])
+
+
+def offense_rows(conn, offense=None, race=None, county=None, start=None, end=None,
+        canonical_offense=None):
+    """
+    Offense rows joined with the offender's race, filtered on the indexed
+    columns. With a sentence date range only the matching yearly partitions
+    are read.
+
+    Args:
+        start, end (datetime.date): sentence dates to keep, end exclusive
+        canonical_offense: canonical offense or list of them, matching every
+            spelling of the offense
+
+    Returns:
+        list of dicts with tdcj_number, race, offense, canonical_offense,
+        county, sentence_date and sentence
+    """
+    where, params = _where(**{'f.offense': offense, 'o.race': race, 'f.county': county,
+        'f.canonical_offense': canonical_offense})
+    for op, value in (('>=', start), ('<', end)):
+        if value is not None:
+            where += (' AND ' if where else 'WHERE ') + f'f.sentence_date {op} %s'
+            params.append(value)
+    return _fetch(conn,
+        'SELECT f.tdcj_number, o.race, f.offense, f.canonical_offense, f.county, '
+        'f.sentence_date, f.sentence '
+        f'FROM offenses f JOIN offenders o USING (tdcj_number) {where}',
+        params)
+
+
+def compare_races(conn, offenses=None, races=('B', 'H', 'W'), top=5, alpha=0.05,
+        capped=True):
+    """
+    The README's pairwise race comparisons per canonical offense, from the
+    stats view: Welch's t-test per pair with a Bonferroni correction over the
+    offenses. Offenses may be given in any spelling.
+
+    Returns:
+        list of dicts with offense (canonical), races, means, n, t, df, p and
+        significant
+    """
+    if offenses is None:
+        offenses = [row['canonical_offense'] for row in top_offenses(conn, top)]
+    else:
+        offenses = list(dict.fromkeys(_canonical(list(offenses))))
+    prefix = 'capped_' if capped else ''
+    stats = {
+        (row['canonical_offense'], row['race']): {
+            'n': row['n'],
+            'mean': float(row[f'{prefix}mean_days']),
+            'std': float(row[f'{prefix}std_days'] or 0),
+        }
+        for row in sentence_stats(conn, offenses, list(races), min_n=2)
+    }
+    level = alpha / max(len(offenses), 1)
+    results = []
+    for offense in offenses:
+        for r1, r2 in combinations(races, 2):
+            a, b = stats.get((offense, r1)), stats.get((offense, r2))
+            if a is None or b is None:
+                continue
+            t, df, p = welch(a, b)
+            results.append({
+                'offense': offense, 'races': (r1, r2), 'means': (a['mean'], b['mean']),
+                'n': (a['n'], b['n']), 't': t, 'df': df, 'p': p,
+                'significant': p < level,
+            })
+    return results
@@ -1,10 +1,257 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from collections import defaultdict
+from itertools import combinations
+import math
+from canonical import canonicalize
+from numberset import NumberSets
+from schema import SENTENCE_COLUMN, is_current, sentence_days
+
+
+# sentences above 100 years (life sentences recorded as 9999 years) count as 100
+CAP_DAYS = 100 * 365
+STATS = ('n', 'sum', 'sumsq', 'capsum', 'capsumsq')
+
 
-    
 def num_scraped():
     db = MongoClient().tdcj
-    print(f'{db.inmates.estimated_document_count()} valid TDCJ numbers scraped')
-    print(f'{db.unassigned.estimated_document_count()} unassigned TDCJ numbers scraped')
-    
+    numbers = NumberSets.load(db)
+    if numbers is None:
+        print(f'{db.inmates.estimated_document_count()} valid TDCJ numbers scraped (estimated)')
+        print(f'{db.unassigned.estimated_document_count()} unassigned TDCJ numbers scraped (estimated)')
+        return
+    print(f'{numbers.num_inmates()} valid TDCJ numbers scraped')
+    print(f'{len(numbers.unassigned)} unassigned TDCJ numbers scraped')
+
+
+def offense_stats(entry, canonicalizer=None):
+    """
+    Yields (race, canonical offense, county, sentence days) for every offense
+    of an inmate document of either schema version. Offenses with unreadable 
+    sentences are left out.
+
+    Args:
+        entry: inmate document as stored in mongo
+        canonicalizer: Canonicalizer to apply, the built-in rules by default
+    """
+    canonical = canonicalizer.canonicalize if canonicalizer else canonicalize
+    race = entry.get('Race') or '?'
+    if is_current(entry):
+        for record in entry.get('offenses') or ():
+            if record.get('sentence_days') is not None:
+                yield (race, str(canonical(record['offense'])), str(record['county']),
+                    record['sentence_days'])
+        return
+
+    table = entry.get('offensetable') or {}
+    sentences = table.get(SENTENCE_COLUMN, {})
+    for i in table.get('Offense', {}):
+        days = sentence_days(sentences.get(i))
+        if days is None:
+            continue
+        yield (race, str(canonical(table['Offense'][i])),
+            str(table.get('County', {}).get(i)), days)
+
+
+def aggregate_deltas(added=(), removed=(), canonicalizer=None):
+    """
+    Sums what adding and removing inmate documents changes in the aggregates.
+
+    Returns:
+        dict: aggregate _id -> (key fields, dict of increments)
+    """
+    deltas = dict()
+    for sign, entries in ((1, added), (-1, removed)):
+        for entry in entries:
+            race = entry.get('Race') or '?'
+            _, inc = deltas.setdefault(f'inmates|{race}',
+                ({'kind': 'inmates', 'race': race}, defaultdict(float)))
+            inc['n'] += sign
+            for _, offense, county, days in offense_stats(entry, canonicalizer):
+                capped = min(days, CAP_DAYS)
+                _, inc = deltas.setdefault(f'offenses|{race}|{offense}|{county}', (
+                    {'kind': 'offenses', 'race': race, 'offense': offense,
+                        'county': county},
+                    defaultdict(float)))
+                inc['n'] += sign
+                inc['sum'] += sign * days
+                inc['sumsq'] += sign * days * days
+                inc['capsum'] += sign * capped
+                inc['capsumsq'] += sign * capped * capped
+    return deltas
+
+
+def update_aggregates(db, added=(), removed=(), canonicalizer=None):
+    """
+    Applies the changes of written, replaced and removed inmates to the
+    running aggregates in the aggregates collection: inmate counts per race,
+    and count, sum and sum of squares of sentence days (raw and capped at
+    CAP_DAYS) per race, canonical offense and county.
+
+    Args:
+        db: scraper database
+        added: inmate documents written, including the new side of replacements
+        removed: inmate documents removed, including the old side of replacements
+        canonicalizer: Canonicalizer to apply, the built-in rules by default
+    """
+    ops = [
+        UpdateOne({'_id': _id}, {'$setOnInsert': fields, '$inc': dict(inc)}, upsert=True)
+        for _id, (fields, inc) in aggregate_deltas(added, removed, canonicalizer).items()
+    ]
+    if ops:
+        db.aggregates.bulk_write(ops, ordered=False)
+
+
+def rebuild_aggregates(db, batch_size=5000, canonicalizer=None):
+    """
+    Recomputes the aggregates from every inmate document. Run it again after
+    the canonicalization rules changed, as canonical.recanonicalize for the
+    postgres DB.
+
+    Returns:
+        number of inmates aggregated
+    """
+    db.aggregates.drop()
+    count = 0
+    batch = []
+    fields = {'Race': 1, 'schema_version': 1, 'offenses': 1, 'offensetable': 1}
+    for entry in db.inmates.find({}, fields):
+        batch.append(entry)
+        if len(batch) == batch_size:
+            update_aggregates(db, batch, canonicalizer=canonicalizer)
+            count += len(batch)
+            batch = []
+    update_aggregates(db, batch, canonicalizer=canonicalizer)
+    db.aggregates.create_index([('kind', 1), ('offense', 1)])
+    return count + len(batch)
+
+
+def _moments(n, total, sumsq):
+    mean = total / n
+    var = (sumsq - total * total / n) / (n - 1) if n > 1 else float('nan')
+    return mean, max(var, 0.0)
+
+
+def summary(db, by=('race',), kind='offenses', capped=True, query=None):
+    """
+    Combines the aggregates into groups without touching the inmates.
+
+    Args:
+        db: scraper database
+        by: key fields to group by, any of race, offense (canonical) and county
+        kind: 'offenses' for sentence statistics, 'inmates' for counts per race
+        capped: use sentences capped at CAP_DAYS
+        query: extra filter on the aggregates, e.g. {'offense': 'FORGERY'}
+
+    Returns:
+        dict: group tuple -> dict of n, and for offenses mean and std in days
+    """
+    prefix = 'cap' if capped else ''
+    groups = defaultdict(lambda: dict.fromkeys(STATS, 0.0))
+    for doc in db.aggregates.find(dict(query or {}, kind=kind)):
+        group = groups[tuple(doc.get(k) for k in by)]
+        for stat in STATS:
+            group[stat] += doc.get(stat, 0)
+    out = dict()
+    for key, g in sorted(groups.items(), key=lambda kv: -kv[1]['n']):
+        n = int(g['n'])
+        if n <= 0:
+            continue
+        out[key] = {'n': n}
+        if kind == 'offenses':
+            mean, var = _moments(n, g[f'{prefix}sum'], g[f'{prefix}sumsq'])
+            out[key].update(mean=mean, std=math.sqrt(var))
+    return out
+
+
+def welch(a, b):
+    """
+    Welch's t-test between two groups given as dicts of n, mean and std.
+
+    Returns:
+        tuple: (t, degrees of freedom, two-sided p-value). The p-value comes
+        from scipy if it is installed, else from the normal approximation,
+        which is close at the group sizes here.
+    """
+    va, vb = a['std'] ** 2 / a['n'], b['std'] ** 2 / b['n']
+    if va + vb == 0:
+        return float('nan'), float('nan'), float('nan')
+    t = (a['mean'] - b['mean']) / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / (va ** 2 / (a['n'] - 1) + vb ** 2 / (b['n'] - 1))
+    try:
+        from scipy import stats
+        p = 2 * stats.t.sf(abs(t), df)
+    except ImportError:
+        p = math.erfc(abs(t) / math.sqrt(2))
+    return t, df, p
+
+
+def compare_races(db, offenses=None, races=('B', 'H', 'W'), top=5, alpha=0.05,
+        capped=True):
+    """
+    Tests every pair of races for a difference in mean sentence per canonical
+    offense, as in the README, with a Bonferroni correction over the offenses.
+
+    Args:
+        db: scraper database
+        offenses: offenses to test in any spelling, defaults to the top most
+            common
+        races: races to compare pairwise
+        top: number of most common offenses tested by default
+        alpha: overall significance level
+        capped: use sentences capped at CAP_DAYS
+
+    Returns:
+        list of dicts with offense (canonical), the two races, their means,
+        t, df and p
+    """
+    if offenses is None:
+        offenses = [k[0] for k in summary(db, ('offense',))][:top]
+    else:
+        offenses = list(dict.fromkeys(str(canonicalize(o)) for o in offenses))
+    level = alpha / max(len(offenses), 1)
+    results = []
+    for offense in offenses:
+        groups = summary(db, ('race',), capped=capped, query={'offense': offense})
+        for r1, r2 in combinations(races, 2):
+            a, b = groups.get((r1,)), groups.get((r2,))
+            if a is None or b is None or a['n'] < 2 or b['n'] < 2:
+                continue
+            t, df, p = welch(a, b)
+            results.append({
+                'offense': offense, 'races': (r1, r2), 'means': (a['mean'], b['mean']),
+                'n': (a['n'], b['n']), 't': t, 'df': df, 'p': p,
+                'significant': p < level,
+            })
+    return results
+
+
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Reports on the scraped data.')
+    parser.add_argument('--rebuild', action='store_true',
+        help='recompute the aggregates from the inmates collection')
+    parser.add_argument('--summary', nargs='*', metavar='FIELD',
+        help='sentence statistics grouped by race, offense and/or county')
+    parser.add_argument('--compare', nargs='*', metavar='OFFENSE',
+        help='compare races per offense, the 5 most common by default')
+    parser.add_argument('--raw', action='store_true',
+        help='use sentences without the 100 year cap')
+    args = parser.parse_args()
+
+    db = MongoClient().tdcj
+    if args.rebuild:
+        print(f'{rebuild_aggregates(db)} inmates aggregated')
     num_scraped()
+    if args.summary is not None:
+        for race, stats in summary(db, kind='inmates').items():
+            print(f'{race[0]}: {stats["n"]} inmates')
+        for key, stats in summary(db, tuple(args.summary or ('race',)),
+                capped=not args.raw).items():
+            print(f'{" / ".join(map(str, key))}: n={stats["n"]} '
+                f'mean={stats["mean"] / 365:.2f}y std={stats["std"] / 365:.2f}y')
+    if args.compare is not None:
+        for r in compare_races(db, args.compare or None, capped=not args.raw):
+            print(f'{r["offense"]} {r["races"][0]}-{r["races"][1]}: '
+                f'{r["means"][0] / 365:.2f}y vs {r["means"][1] / 365:.2f}y '
+                f't={r["t"]:.2f} p={r["p"]:.3g}{" *" if r["significant"] else ""}')
@@ -0,0 +1,128 @@
+from datetime import datetime
+import hashlib, heapq, json
+from numberset import NumberSets
+
+
+ACCESSED_FORMAT = "%Y%m%d_%H%M"
+# fields that change on every scrape or write without the record changing
+VOLATILE_FIELDS = ("_id", "accessed", "hash", "written")
+
+
+def content_hash(entry):
+    """
+    Hashes everything scraped about an inmate except when it was scraped.
+
+    Args:
+        entry (dict): inmate document
+
+    Returns:
+        str: hex digest
+    """
+    content = {k: v for k, v in entry.items() if k not in VOLATILE_FIELDS}
+    data = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def parse_accessed(value):
+    """
+    Returns the datetime of an 'accessed' value, or None if it is missing.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, ACCESSED_FORMAT)
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def inmate_priority(doc, now, horizon=30, weight=60):
+    """
+    Re-scrape priority of an inmate: days since it was scraped, plus up to
+    weight days' worth for a projected release or parole eligibility date
+    within horizon days of now, when the record is most likely to change.
+
+    Args:
+        doc (dict): inmate document with accessed and the two dates
+        now (datetime): current time
+        horizon (int): days around a date that raise the priority
+        weight (float): priority added for a date falling exactly on now
+    """
+    accessed = parse_accessed(doc.get("accessed"))
+    score = (now - accessed).total_seconds() / 86400 if accessed else horizon * 12
+    for field in ("Projected Release Date", "Parole Eligibility Date"):
+        date = _parse_date(doc.get(field))
+        if date is not None:
+            days = abs((date - now).total_seconds()) / 86400
+            score += weight * max(0, 1 - days / horizon)
+    return score
+
+
+def unassigned_priority(accessed, now, weight=0.25, unknown_age=365):
+    """
+    Re-scrape priority of an unassigned number: its age in days, scaled down
+    as unassigned numbers rarely become assigned again.
+
+    Args:
+        accessed (datetime): when the number was last checked, or None
+        now (datetime): current time
+        weight (float): scale of the age
+        unknown_age (float): age in days assumed for numbers stored without one
+    """
+    age = (now - accessed).total_seconds() / 86400 if accessed else unknown_age
+    return weight * age
+
+
+class RescrapeQueue:
+    def __init__(self, priorities):
+        """
+        Max-priority queue of TDCJ numbers to look up again.
+
+        Args:
+            priorities: iterable of (priority, tdcj number) pairs
+        """
+        self.heap = [(-p, n) for p, n in priorities]
+        heapq.heapify(self.heap)
+        self.built = datetime.now()
+
+    def __len__(self):
+        return len(self.heap)
+
+    @classmethod
+    def inmates(cls, db, now=None):
+        """
+        Queue of known inmates, for catching updates and releases.
+        """
+        now = now or datetime.now()
+        fields = {"accessed": 1, "Projected Release Date": 1, "Parole Eligibility Date": 1}
+        return cls(
+            (inmate_priority(d, now), int(d["_id"]))
+            for d in db.inmates.find({}, fields)
+        )
+
+    @classmethod
+    def unassigned(cls, db, now=None):
+        """
+        Queue of unassigned numbers, for catching reincarcerations. Their
+        age is that of the last check of their block in the number sets, so
+        a block is looked up again together.
+        """
+        now = now or datetime.now()
+        numbers = NumberSets.load(db) or NumberSets()
+        return cls(
+            (unassigned_priority(numbers.last_checked(n), now), n)
+            for n in numbers.unassigned
+        )
+
+    def pop(self, n):
+        """
+        Returns up to n numbers, highest priority first.
+        """
+        return [heapq.heappop(self.heap)[1] for _ in range(min(n, len(self.heap)))]
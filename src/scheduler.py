@@ -0,0 +1,182 @@
+from numberset import NumberSets
+import heapq, math
+
+
+class _Bucket:
+    """
+    Hit statistics and probing position for one fixed-width range of numbers.
+    """
+
+    def __init__(self, lo, hi, stride):
+        self.lo = lo
+        self.hi = hi
+        self.hits = 0
+        self.checked = 0
+        self.stride = stride
+        self.pos = lo
+
+
+class DensityScheduler:
+    def __init__(
+        self,
+        numbers,
+        lo,
+        hi,
+        bucketsize=10000,
+        coarse_stride=64,
+        min_samples=64,
+        prior_weight=20,
+        explore=1.0,
+    ):
+        """
+        Chooses which TDCJ numbers to look up next so that lookups go where
+        valid numbers are expected. The range [lo, hi) is split into buckets
+        with a hit-density estimate each. Buckets are worked in order of
+        expected hits per lookup plus an exploration bonus for uncertain ones.
+        Within a bucket numbers are probed at a coarse stride first, and the
+        stride is halved every pass, so sparse regions are sampled cheaply
+        before being filled in. Buckets dense enough go straight to stride 1.
+
+        Args:
+            numbers (NumberSets): numbers already checked and found unassigned
+            lo (int): lowest number to schedule
+            hi (int): one past the highest number to schedule
+            bucketsize (int): width of a density bucket
+            coarse_stride (int): stride of the first probing pass in a bucket
+            min_samples (int): lookups in a bucket before its estimate is trusted
+            prior_weight (float): pseudo-lookups given to the prior density
+            explore (float): weight of the exploration bonus
+        """
+        # a private copy, as numbers handed out count as scanned right away
+        self.scanned = numbers.checked.copy()
+        self.pending = set()
+        self.min_samples = min_samples
+        self.prior_weight = prior_weight
+        self.explore = explore
+        self.buckets = [
+            _Bucket(b, min(b + bucketsize, hi), coarse_stride)
+            for b in range(lo, hi, bucketsize)
+        ]
+        self.lo = lo
+        self.bucketsize = bucketsize
+
+        for b in self.buckets:
+            b.checked = numbers.checked.count(b.lo, b.hi)
+            b.hits = b.checked - numbers.unassigned.count(b.lo, b.hi)
+        checked = sum(b.checked for b in self.buckets)
+        self.prior = (sum(b.hits for b in self.buckets) + 1) / (checked + 2)
+
+        self.heap = []
+        for i, b in enumerate(self.buckets):
+            if b.checked < b.hi - b.lo:
+                heapq.heappush(self.heap, (-self.score(i), i))
+
+    @classmethod
+    def from_db(cls, db, numbers=None, lo=100000, hi=None, **kwargs):
+        """
+        Builds the scheduler from the saved number sets.
+
+        Args:
+            db (pymongo.database.Database): scraper database
+            numbers (NumberSets): checked numbers, loaded from db if not given
+            lo (int): lowest number to schedule
+            hi (int): one past the highest number to schedule, defaults to one
+                past the highest known inmate
+            kwargs: passed on to the constructor
+        """
+        if numbers is None:
+            numbers = NumberSets.load_or_build(db)
+        if hi is None:
+            top = db.inmates.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            hi = int(top["_id"]) + 1 if top else lo + 1
+        return cls(numbers, lo, hi, **kwargs)
+
+    def density(self, i):
+        """
+        Expected hits per lookup in bucket i: its hit rate shrunk towards the
+        average of its neighbours (or the global rate if they are unscanned).
+        """
+        b = self.buckets[i]
+        near = [
+            self.buckets[j]
+            for j in (i - 2, i - 1, i + 1, i + 2)
+            if 0 <= j < len(self.buckets) and self.buckets[j].checked
+        ]
+        prior = self.prior
+        if near:
+            prior = (sum(n.hits for n in near) + self.prior) / (
+                sum(n.checked for n in near) + 1
+            )
+        return (b.hits + prior * self.prior_weight) / (b.checked + self.prior_weight)
+
+    def score(self, i):
+        """
+        Priority of bucket i: expected density plus an exploration bonus that
+        shrinks as the bucket is sampled.
+        """
+        p = self.density(i)
+        n = self.buckets[i].checked + 1
+        return p + self.explore * math.sqrt(p * (1 - p) / n)
+
+    def next_batch(self, size, chunk=25):
+        """
+        Returns up to size unscanned numbers from the best buckets and marks
+        them scanned so they are not handed out twice.
+
+        Args:
+            size (int): numbers wanted
+            chunk (int): most numbers taken from one bucket before re-ranking
+        """
+        batch = []
+        while len(batch) < size and self.heap:
+            _, i = heapq.heappop(self.heap)
+            taken = self._take(i, min(chunk, size - len(batch)))
+            batch.extend(taken)
+            if taken:
+                heapq.heappush(self.heap, (-self.score(i), i))
+        return batch
+
+    def record(self, tdcjnum, hit):
+        """
+        Updates the density estimate with the result of a lookup it handed
+        out; other lookups, like re-scrapes, are already counted.
+
+        Args:
+            tdcjnum (int): number looked up
+            hit (bool): True if the number belongs to an inmate
+        """
+        if tdcjnum not in self.pending:
+            return
+        self.pending.discard(tdcjnum)
+        b = self._bucket(tdcjnum)
+        if b is not None:
+            b.checked += 1
+            b.hits += bool(hit)
+
+    def _take(self, i, n):
+        """
+        Takes up to n unscanned numbers from bucket i, probing coarse to fine.
+        """
+        b = self.buckets[i]
+        taken = []
+        if b.stride > 1 and b.checked >= self.min_samples:
+            if self.density(i) * b.stride >= 1:
+                b.stride, b.pos = 1, b.lo
+        while len(taken) < n:
+            if b.pos >= b.hi:
+                if b.stride == 1:
+                    break
+                b.stride //= 2
+                b.pos = b.lo
+            if b.pos not in self.scanned:
+                taken.append(b.pos)
+                self.scanned.add(b.pos)
+                self.pending.add(b.pos)
+            b.pos += b.stride
+        return taken
+
+    def _bucket(self, n):
+        i = (n - self.lo) // self.bucketsize
+        if n >= self.lo and i < len(self.buckets):
+            return self.buckets[i]
+        return None
@@ -0,0 +1,232 @@
+from datetime import datetime
+import math, re
+from rescrape import content_hash, parse_accessed
+
+
+# documents without a schema_version are version 1: the offense table in
+# pandas' column-oriented JSON, dates as strings, accessed as "%Y%m%d_%H%M"
+SCHEMA_VERSION = 2
+DATE_FORMAT = "%Y-%m-%d"
+DATE_FIELDS = ("DOB", "Projected Release Date", "Parole Eligibility Date")
+MSD_CATEGORIES = {
+    "LIFE SENTENCE": 2,
+    "LIFE WITHOUT PAROLE": 3,
+    "NOT AVAILABLE": 4,
+    "DEATH ROW": 5,
+}
+# version 2 offense field -> version 1 offense table column
+OFFENSE_FIELDS = {
+    "offense_date": "Offense Date",
+    "offense": "Offense",
+    "sentence_date": "Sentence Date",
+    "county": "County",
+    "case_no": "Case No",
+}
+SENTENCE_COLUMN = "Sentence (YY-MM-DD)"
+SENTENCE_RE = re.compile(r"^\s*(\d+)\s*-\s*(\d+)\s*-\s*(\d+)\s*$")
+LEGACY = {"schema_version": {"$exists": False}}
+
+
+def is_current(entry):
+    """
+    Whether an inmate document is in the current schema.
+    """
+    return entry.get("schema_version", 1) >= SCHEMA_VERSION
+
+
+def offense_count(entry):
+    """
+    Number of offenses of an inmate document of either version.
+    """
+    if is_current(entry):
+        return len(entry["offenses"])
+    return len(entry["offensetable"]["Offense"])
+
+
+def parse_date(value):
+    """
+    Returns the datetime of a date as the site shows it, None if it is
+    missing or 'NOT AVAILABLE', and the value itself if it is unreadable, so
+    nothing scraped is lost.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    if value in ("", "NOT AVAILABLE"):
+        return None
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        return value
+
+
+def split_msd(value):
+    """
+    Splits a maximum sentence date into its date and the code of the text
+    that can replace or follow it, like pgpipe.split_msd_cat, but keeps
+    unreadable values instead of raising.
+
+    Returns:
+        tuple: (datetime, None for codes or the unreadable string, code)
+    """
+    text = str(value).strip()
+    mode = 1
+    if text.endswith("CUMULATIVE OFFENSES"):
+        mode = -1
+        text = text[:-19].strip()
+    if text in MSD_CATEGORIES:
+        return None, MSD_CATEGORIES[text] * mode
+    date = parse_date(text)
+    return (text if date is None else date), mode
+
+
+def sentence_days(sentence):
+    """
+    Days of a sentence length in 'Y-M-D' or 'DDD Days' format, counted like
+    pgpipe.sentence_str_to_days_int, or None if it is in neither.
+    """
+    if sentence is None:
+        return None
+    sentence = str(sentence).strip()
+    if sentence.endswith("Days"):
+        try:
+            return int(sentence[:-4])
+        except ValueError:
+            return None
+    match = SENTENCE_RE.match(sentence)
+    if match is None:
+        return None
+    return int(match[1]) * 365 + int(match[2]) * 30 + int(match[3])
+
+
+def _text(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    # version 1 made floats of number columns with missing cells
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def offense_record(offense_date, offense, sentence_date, county, case_no, sentence):
+    """
+    One offense of a version 2 document. A sentence that can't be read into
+    days is kept as text next to a sentence_days of None.
+    """
+    record = {
+        "offense_date": parse_date(offense_date),
+        "offense": _text(offense),
+        "sentence_date": parse_date(sentence_date),
+        "county": _text(county),
+        "case_no": _text(case_no),
+        "sentence_days": sentence_days(sentence),
+    }
+    if record["sentence_days"] is None and sentence is not None:
+        record["sentence"] = str(sentence)
+    return record
+
+
+def build(admin, offenses, accessed):
+    """
+    Builds a version 2 inmate document: the admin fields with native dates
+    and the maximum sentence date split into Maximum Sentence Date and
+    MSD_cat, the offenses as an array of records, and accessed as a datetime.
+
+    Args:
+        admin (dict): admin fields of the detail page, with TDCJ Number
+        offenses (list): offense records, see offense_record
+        accessed (datetime): when the page was fetched
+
+    Returns:
+        dict ready for the inmates collection
+    """
+    entry = {k: v for k, v in admin.items() if k != "TDCJ Number"}
+    entry["_id"] = admin["TDCJ Number"]
+    entry["schema_version"] = SCHEMA_VERSION
+    for field in DATE_FIELDS:
+        if field in entry:
+            entry[field] = parse_date(entry[field])
+    if "Maximum Sentence Date" in entry:
+        entry["Maximum Sentence Date"], entry["MSD_cat"] = split_msd(
+            entry["Maximum Sentence Date"])
+    entry["offenses"] = offenses
+    # mongo keeps milliseconds, drop them so stored and built documents agree
+    entry["accessed"] = accessed.replace(microsecond=0) if accessed else None
+    return entry
+
+
+def upgrade(entry):
+    """
+    Converts a version 1 inmate document into the current schema. Current
+    documents are returned as they are.
+    """
+    if is_current(entry):
+        return entry
+    table = entry.get("offensetable") or {}
+    columns = [table.get(c) or {} for c in (*OFFENSE_FIELDS.values(), SENTENCE_COLUMN)]
+    offenses = [
+        offense_record(*(column.get(i) for column in columns))
+        for i in table.get("Offense", {})
+    ]
+    admin = {
+        k: v for k, v in entry.items()
+        if k not in ("_id", "offensetable", "accessed", "hash", "written")
+    }
+    admin["TDCJ Number"] = entry["_id"]
+    current = build(admin, offenses, parse_accessed(entry.get("accessed")))
+    if "hash" in entry:
+        current["hash"] = content_hash(current)
+    # the postgres rows don't change, so neither does the write time
+    if "written" in entry:
+        current["written"] = entry["written"]
+    return current
+
+
+def migrate(db, batch_size=1000, pmode=1):
+    """
+    Rewrites the version 1 documents of the inmates collection in the
+    current schema, streaming them in batches. Documents the scraper
+    replaces meanwhile are left alone, so it can keep running. The sentence
+    statistics don't change, so the aggregates stay valid.
+
+    Args:
+        db (pymongo.database.Database): scraper database
+        batch_size (int): documents replaced per bulk write
+        pmode (int): print mode. Higher the number, the more is printed
+
+    Returns:
+        int: number of documents migrated
+    """
+    from pymongo import ReplaceOne
+
+    count = 0
+    ops = []
+    for entry in db.inmates.find(LEGACY, batch_size=batch_size):
+        ops.append(ReplaceOne(dict(LEGACY, _id=entry["_id"]), upgrade(entry)))
+        if len(ops) == batch_size:
+            count += db.inmates.bulk_write(ops, ordered=False).modified_count
+            ops = []
+            if pmode >= 2:
+                print(f"{count} documents migrated")
+    if ops:
+        count += db.inmates.bulk_write(ops, ordered=False).modified_count
+    # pgpipe.sync_pipe range-queries the inmates written since its last run
+    db.inmates.create_index("written")
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(
+        description="Migrates inmates documents to the current schema."
+    )
+    parser.add_argument("-b", "--batch_size", type=int, default=1000)
+    parser.add_argument("-p", "--pmode", type=int, default=1)
+    args = parser.parse_args()
+
+    db = MongoClient("localhost", 27017).tdcj
+    start = datetime.now()
+    n = migrate(db, args.batch_size, args.pmode)
+    print(f"{n} inmates migrated to schema version {SCHEMA_VERSION} in {datetime.now() - start}")
@@ -0,0 +1,212 @@
+from urllib.parse import parse_qs, urlsplit
+import asyncio, math, random
+import synthetic
+
+
+REASONS = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}
+ROUTES = ("start", "search", "detail")
+
+
+def parse_latency(spec):
+    """
+    Turns a latency distribution spec into a function drawing seconds from
+    it with a random.Random:
+
+        fixed:S            always S seconds
+        uniform:A,B        uniform between A and B
+        exp:M              exponential with mean M
+        lognormal:M,SIGMA  lognormal with median M and shape SIGMA
+
+    Raises:
+        ValueError for unknown distributions or parameters
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v.strip()]
+    draws = {
+        "fixed": (1, lambda rng, s: s),
+        "uniform": (2, lambda rng, a, b: rng.uniform(a, b)),
+        "exp": (1, lambda rng, m: rng.expovariate(1 / m) if m > 0 else 0.0),
+        "lognormal": (2, lambda rng, m, sigma: rng.lognormvariate(math.log(m), sigma)),
+    }
+    if kind not in draws or len(values) != draws[kind][0]:
+        raise ValueError(f"Bad latency spec {spec!r}")
+    draw = draws[kind][1]
+    return lambda rng: draw(rng, *values)
+
+
+class SiteSimulator:
+    def __init__(self, density=0.3, seed=0, latency="fixed:0", searchlatency=None,
+            detaillatency=None, errorrate=0.0, timeoutrate=0.0, hangtime=30.0):
+        """
+        Local stand-in for the OffenderSearch site, serving the start page,
+        search results, no-result and detail pages of synthetic.py over
+        plain HTTP/1.1 with keep-alive. Whether a number is assigned, and
+        the inmate behind it, depend only on the seed and the number, so
+        every run sees the same site.
+
+        Args:
+            density (float): share of numbers that are assigned
+            seed (int): seed of the numbers and inmates
+            latency (str): latency spec of every page, see parse_latency
+            searchlatency (str): latency spec of search results, if different
+            detaillatency (str): latency spec of detail pages, if different
+            errorrate (float): share of requests answered with a 503
+            timeoutrate (float): share of requests left hanging for hangtime
+                seconds and then dropped without an answer
+            hangtime (float): seconds a hanging request is held
+        """
+        self.density = density
+        self.seed = seed
+        self.latency = {route: parse_latency(latency) for route in ROUTES}
+        if searchlatency:
+            self.latency["search"] = parse_latency(searchlatency)
+        if detaillatency:
+            self.latency["detail"] = parse_latency(detaillatency)
+        self.errorrate = errorrate
+        self.timeoutrate = timeoutrate
+        self.hangtime = hangtime
+        self.rng = random.Random(seed)
+        self.served = dict()
+
+    def inmate(self, tdcjnum):
+        """
+        Returns (admin fields, offense rows) of the inmate with a number, or
+        None if the number is unassigned.
+        """
+        rng = random.Random(f"{self.seed}:{tdcjnum}")
+        if rng.random() >= self.density:
+            return None
+        return synthetic.random_inmate(rng, tdcjnum)
+
+    def count(self, what):
+        self.served[what] = self.served.get(what, 0) + 1
+
+    async def respond(self, method, target, body):
+        """
+        Builds the answer to one request, after its injected latency.
+
+        Returns:
+            tuple: (status, html), or (None, None) to drop the connection
+        """
+        url = urlsplit(target)
+        fields = parse_qs(url.query)
+        if method == "POST":
+            fields.update(parse_qs(body.decode("utf-8", "replace")))
+        route = {
+            "start": "start", "search.action": "search", "offenderDetail.action": "detail"
+        }.get(url.path.rstrip("/").rsplit("/", 1)[-1])
+        await asyncio.sleep(self.latency[route or "start"](self.rng))
+
+        roll = self.rng.random()
+        if roll < self.timeoutrate:
+            self.count("timeout")
+            await asyncio.sleep(self.hangtime)
+            return None, None
+        if roll < self.timeoutrate + self.errorrate:
+            self.count("error")
+            return 503, "<html><body>Service Unavailable</body></html>"
+        self.count(route or "missing")
+        if route == "start":
+            return 200, synthetic.start_page("search.action")
+        number = (fields.get("tdcj") or fields.get("sid") or [""])[0]
+        inmate = self.inmate(int(number)) if number.isdigit() else None
+        if route == "search":
+            if inmate is None:
+                return 200, synthetic.no_result_page()
+            return 200, synthetic.results_page(
+                inmate[0], f"offenderDetail.action?sid={int(number)}")
+        if route == "detail" and inmate is not None:
+            return 200, synthetic.detail_page(*inmate)
+        return 404, "<html><body>Not Found</body></html>"
+
+    async def handle(self, reader, writer):
+        """
+        Serves the requests of one connection until the client closes it.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers = dict()
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = header.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+                status, html = await self.respond(method, target, body)
+                if status is None:
+                    break
+                data = html.encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    "Content-Type: text/html; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Starts serving in the running event loop.
+
+        Args:
+            host (str): address to bind, local only by default
+            port (int): port to listen on, 0 for any free one
+
+        Returns:
+            tuple: (asyncio server, start page url)
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        port = server.sockets[0].getsockname()[1]
+        return server, f"http://{host}:{port}/OffenderSearch/start"
+
+
+def add_arguments(parser):
+    """
+    Adds the simulator's options to an argument parser.
+    """
+    parser.add_argument("--density", type=float, default=0.3,
+        help="share of numbers that are assigned")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", default="fixed:0",
+        help="latency of every page: fixed:S, uniform:A,B, exp:M or lognormal:M,SIGMA")
+    parser.add_argument("--searchlatency", help="latency of search results")
+    parser.add_argument("--detaillatency", help="latency of detail pages")
+    parser.add_argument("--errorrate", type=float, default=0.0)
+    parser.add_argument("--timeoutrate", type=float, default=0.0)
+    parser.add_argument("--hangtime", type=float, default=30.0)
+
+
+def from_arguments(args):
+    return SiteSimulator(args.density, args.seed, args.latency, args.searchlatency,
+        args.detaillatency, args.errorrate, args.timeoutrate, args.hangtime)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serves a local stand-in of the TDCJ site.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    async def serve():
+        server, url = await from_arguments(args).start(args.host, args.port)
+        print(f"Serving {url}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,163 @@
+from html import escape
+from datetime import date, timedelta
+import random
+
+
+RACES = ("B", "H", "W", "A", "I", "O")
+RACE_WEIGHTS = (34, 34, 30, 1, 0.5, 0.5)
+OFFENSES = (
+    "POSS CS PG 1 <1G",
+    "POSS CS PG 1 >=1G<4G",
+    "BURGLARY OF HABITATION",
+    "BURG OF HAB",
+    "DWI 3RD OR MORE",
+    "FORGERY",
+    "THEFT PROP>=$1500<$20K",
+    "AGG ASSLT W/DEADLY WEAPON",
+    "MURDER",
+    "AGG ROBBERY",
+)
+COUNTIES = ("HARRIS", "DALLAS", "TARRANT", "BEXAR", "TRAVIS", "EL PASO", "LUBBOCK")
+FACILITIES = ("HUNTSVILLE", "COFFIELD", "ESTELLE", "ELLIS", "POLUNSKY", "BETO")
+MSD_TEXTS = ("LIFE SENTENCE", "LIFE WITHOUT PAROLE", "NOT AVAILABLE", "DEATH ROW")
+OFFENSE_HEADERS = (
+    "Offense Date",
+    "Offense",
+    "Sentence Date",
+    "County",
+    "Case No.",
+    "Sentence (YY-MM-DD)",
+)
+
+
+def _day(rng, start_year, end_year):
+    start = date(start_year, 1, 1)
+    return start + timedelta(days=rng.randrange((date(end_year, 1, 1) - start).days))
+
+
+def random_inmate(rng, tdcjnum):
+    """
+    Makes up an inmate as the detail page shows one.
+
+    Args:
+        rng (random.Random): source of randomness, seeded for repeatable corpora
+        tdcjnum (int): TDCJ number of the inmate
+
+    Returns:
+        tuple: (admin field dict, list of offense rows of cell strings)
+    """
+    msd = str(_day(rng, 2020, 2060))
+    if rng.random() < 0.1:
+        msd = rng.choice(MSD_TEXTS)
+    if rng.random() < 0.05:
+        msd += " CUMULATIVE OFFENSES"
+    admin = {
+        "Name": f"DOE{rng.randrange(10**5)}, JOHN",
+        "TDCJ Number": str(tdcjnum).zfill(8),
+        "SID Number": str(rng.randrange(10**7, 10**8)),
+        "Race": rng.choices(RACES, RACE_WEIGHTS)[0],
+        "Gender": rng.choice("MMMMMMMMMF"),
+        "DOB": str(_day(rng, 1940, 2002)),
+        "Maximum Sentence Date": msd,
+        "Current Facility": rng.choice(FACILITIES),
+        "Projected Release Date": rng.choice(
+            ("NOT AVAILABLE", str(_day(rng, 2020, 2040)))
+        ),
+        "Parole Eligibility Date": rng.choice(
+            ("NOT AVAILABLE", str(_day(rng, 2019, 2035)))
+        ),
+        "Offender Visitation Eligible": rng.choice(("YES", "NO")),
+    }
+    rows = []
+    for _ in range(rng.choice((1, 1, 1, 2, 2, 3, 5))):
+        offense_date = _day(rng, 1980, 2019)
+        if rng.random() < 0.2:
+            sentence = f"{rng.randrange(30, 730)} Days"
+        else:
+            sentence = f"{rng.randrange(1, 99):02d}-{rng.randrange(12):02d}-00"
+        rows.append([
+            str(offense_date),
+            rng.choice(OFFENSES),
+            str(offense_date + timedelta(days=rng.randrange(30, 700))),
+            rng.choice(COUNTIES),
+            str(rng.randrange(10**5, 10**7)),
+            sentence,
+        ])
+    return admin, rows
+
+
+def _page(body):
+    return (
+        "<!DOCTYPE html><html><head><title>Offender Information</title></head>"
+        f"<body><div id=\"content_left\"></div><div id=\"content_right\">{body}</div>"
+        "</body></html>"
+    )
+
+
+def start_page(action="search.action"):
+    """
+    The OffenderSearch start page with its search form.
+    """
+    return _page(
+        "<h1>Offender Search</h1>"
+        f'<form name="search" action="{escape(action)}" method="post">'
+        '<input type="text" name="lastName" value="">'
+        '<input type="text" name="tdcj" value="">'
+        '<input type="hidden" name="page" value="index">'
+        '<input type="submit" name="btnSearch" value="Search">'
+        '<input type="submit" name="btnReset" value="Reset">'
+        "</form>"
+    )
+
+
+def results_page(admin, href):
+    """
+    The search results page listing one inmate with a link to the details.
+    """
+    return _page(
+        "<h1>Search Results</h1>"
+        '<table class="tdcj_table"><thead><tr><th>Name</th><th>TDCJ Number</th>'
+        "<th>Race</th><th>Gender</th><th>Current Facility</th></tr></thead><tbody>"
+        f'<tr><td><a href="{escape(href)}">{escape(admin["Name"])}</a></td>'
+        f'<td>{admin["TDCJ Number"]}</td><td>{admin["Race"]}</td>'
+        f'<td>{admin["Gender"]}</td><td>{escape(admin["Current Facility"])}</td></tr>'
+        "</tbody></table>"
+    )
+
+
+def no_result_page():
+    """
+    The search results page for a number without an inmate.
+    """
+    return _page("<h1>Search Results</h1><p>No offenders found.</p>")
+
+
+def detail_page(admin, rows):
+    """
+    An inmate's detail page: the admin block in the second paragraph of
+    content_right and the offense table.
+    """
+    fields = "<br/><br/>".join(
+        f"<span>{escape(k)}:</span> {escape(v)}" for k, v in admin.items()
+    )
+    header = "".join(f"<th>{escape(h)}</th>" for h in OFFENSE_HEADERS)
+    body = "".join(
+        "<tr>" + "".join(f"<td>{escape(c)}</td>" for c in row) + "</tr>" for row in rows
+    )
+    return _page(
+        "<h1>Offender Information Details</h1><p>Return to Search list</p>"
+        f"<p>{fields}</p><h2>Offense History:</h2>"
+        f'<table class="tdcj_table"><thead><tr>{header}</tr></thead>'
+        f"<tbody>{body}</tbody></table>"
+    )
+
+
+def corpus(n, seed=0, start=1000000):
+    """
+    Makes n detail pages of consecutive TDCJ numbers, repeatably.
+
+    Returns:
+        list of html strings
+    """
+    rng = random.Random(seed)
+    return [detail_page(*random_inmate(rng, start + i)) for i in range(n)]
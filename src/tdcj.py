@@ -0,0 +1,157 @@
+import os, sys
+
+
+# subcommand -> (module whose command line it runs, help)
+COMMANDS = {
+    "scrape": ("tdcj_scraper", "run the scraper"),
+    "migrate": ("pgpipe", "migrate the scraped inmates into postgres"),
+    "report": ("report", "print counts and sentence statistics from the aggregates"),
+    "status": (None, "print the scraper's progress"),
+    "importcheck": (None, "time the imports of every subcommand"),
+}
+# dependencies that take long to import or need a lot of memory
+HEAVY = ("numpy", "pandas", "matplotlib", "scipy", "pyarrow", "selenium", "psycopg2")
+# subcommand -> (module imported, heavy packages it must not load)
+IMPORT_CHECKS = {
+    "status": ("tdcj", HEAVY),
+    "report": ("report", HEAVY),
+    # with the http engine; browser workers load selenium themselves
+    "scrape": ("tdcj_scraper", HEAVY),
+    "migrate": ("pgpipe", tuple(p for p in HEAVY if p != "psycopg2")),
+}
+
+
+def run_module(module, args):
+    """
+    Runs a module's command line with the given arguments, importing it only
+    now, so every subcommand loads just what it needs.
+    """
+    import runpy
+
+    sys.argv = [f"{module}.py"] + list(args)
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+def status(dbname="tdcj"):
+    """
+    Prints what the scraper stored so far from estimated counts and a few
+    small documents, so it returns at once even on a large database.
+    """
+    from pymongo import MongoClient
+
+    client = MongoClient("localhost", 27017, serverSelectionTimeoutMS=2000)
+    db = client[dbname]
+    counts = " ".join(
+        f"{name}={db[name].estimated_document_count()}"
+        for name in ("inmates", "released", "pages")
+    )
+    print(f"documents (estimated): {counts}")
+    admin = {d["_id"]: d.get("value") for d in db.admin.find({"_id": {"$in": ["tail", "head"]}})}
+    print(f"tail: {admin.get('tail')} head: {admin.get('head')}")
+    sets = db.numbersets.find_one({"_id": "sets"}, {"checked_count": 1, "unassigned_count": 1})
+    if sets:
+        print(f"numbers checked: {sets['checked_count']} unassigned: {sets['unassigned_count']}")
+    newest = db.inmates.find_one({}, {"accessed": 1}, sort=[("accessed", -1)])
+    if newest is not None:
+        print(f"last scraped: {newest.get('accessed')}")
+    if db.claims.estimated_document_count():
+        claims = " ".join(
+            f"{d['_id']}={d['n']}"
+            for d in db.claims.aggregate([{"$group": {"_id": "$state", "n": {"$sum": 1}}}])
+        )
+        print(f"claimed ranges: {claims}")
+    client.close()
+
+
+def import_time(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        tuple: (seconds, dict of top level package -> seconds, set of every
+            module imported)
+
+    Raises:
+        ImportError if the module can't be imported
+    """
+    import subprocess
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+    )
+    if proc.returncode:
+        raise ImportError(proc.stderr.strip().splitlines()[-1])
+    packages = dict()
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # nested imports are indented by two spaces per level
+        if len(name) - len(name.lstrip()) == 1:
+            root = name.strip().split(".")[0]
+            packages[root] = packages.get(root, 0) + int(cumulative) / 1e6
+    return sum(packages.values()), packages, modules
+
+
+def importcheck(budget=0.5):
+    """
+    Times the imports behind every subcommand, and checks that none loads a
+    heavy dependency at import or takes longer than budget seconds.
+
+    Returns:
+        bool: whether every subcommand passed
+    """
+    passed = True
+    for command, (module, forbidden) in IMPORT_CHECKS.items():
+        try:
+            seconds, packages, modules = import_time(module)
+        except ImportError as e:
+            print(f"{command:8} {module:14} could not be imported: {e}")
+            passed = False
+            continue
+        heavy = sorted({m.split(".")[0] for m in modules} & set(forbidden))
+        problems = [f"loads {', '.join(heavy)}"] if heavy else []
+        if seconds > budget:
+            problems.append(f"over the {budget:g}s budget")
+        top = sorted(packages.items(), key=lambda kv: -kv[1])[:3]
+        print(f"{command:8} {module:14} {seconds:6.3f}s  "
+            f"{'; '.join(problems) or 'ok':24} slowest: "
+            + ", ".join(f"{name} {s:.3f}s" for name, s in top))
+        passed = passed and not problems
+    return passed
+
+
+def main(argv=None):
+    import argparse
+
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(
+        prog="tdcj",
+        description="Scrapes, migrates and reports on TDCJ inmates. "
+            "Run 'tdcj COMMAND -h' for the options of a command.",
+        epilog="\n".join(f"{c:12} {h}" for c, (_, h) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=COMMANDS)
+    args = parser.parse_args(argv[:1])
+    rest = argv[1:]
+
+    module = COMMANDS[args.command][0]
+    if module is not None:
+        run_module(module, rest)
+        return
+    sub = argparse.ArgumentParser(prog=f"tdcj {args.command}")
+    if args.command == "status":
+        sub.add_argument("--dbname", default="tdcj")
+        status(sub.parse_args(rest).dbname)
+    else:
+        sub.add_argument("--budget", type=float, default=0.5,
+            help="most seconds a subcommand's imports may take")
+        sys.exit(0 if importcheck(sub.parse_args(rest).budget) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,54 @@
-from selenium.webdriver import Chrome
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import (
-    NoSuchElementException,
-    WebDriverException,
-    TimeoutException,
-)
 from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
-import time, json, os, asyncio, signal
-import numpy as np
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from functools import partial
+import time, os, asyncio, signal
 from datetime import datetime
+from detail_parser import ParseError, parse_entry
+from http_fetch import HttpFetcher, FETCH_ERRORS, START_URL
+from pacing import AIMDController
+from metrics import STAGE_SECONDS, LOOKUPS, QUEUE_DEPTH, PACING
+import metrics
+from mongo_writer import BufferedWriter
+from scheduler import DensityScheduler
+from numberset import NumberSets
+from rescrape import RescrapeQueue, content_hash
+from archive import PageArchive
+from leases import LeaseManager, stored_numbers
+
+
+# queued once per worker after the managers ended, to end the workers
+STOP = None
+# lookups of a number whose detail page can't be parsed before it is skipped
+PARSE_ATTEMPTS = 3
 
 
 class Scraper:
     def __init__(
-        self, headless, workersleeptime, mgrsleeptime, pmode, numworkers, batchsize
+        self,
+        headless,
+        workersleeptime,
+        mgrsleeptime,
+        pmode,
+        numworkers,
+        batchsize,
+        engine="selenium",
+        flushsize=500,
+        flushwait=5.0,
+        scheduler="tail",
+        headsleeptime=3600,
+        headwindow=3,
+        rescrapebudget=2000,
+        recidivismshare=0.2,
+        rate=1.0,
+        targetlatency=5.0,
+        archive=None,
+        leasesize=1000,
+        leasettl=300.0,
+        maxpages=500,
+        maxmemory=1024,
+        starturl=START_URL,
+        dbname="tdcj",
     ):
         """
         Constructs the scraper: starts a webdriver instance 
@@ -26,38 +56,220 @@ class Scraper:
 
         Args:
             headless (bool): controlling if the webdriver runs
-            workersleeptime (float): worker sleep time in seconds
+            workersleeptime (float): shortest wait for a page element in seconds
             mgrsleeptime (float): manager sleep time in seconds
             pmode (int): print mode. Higher the number, the more is printed
             numworkers (int): number of workers to initiate
             batchsize (int): number of tdcj numbers for manager to load at a time
+            engine (str): 'selenium' to drive one Chrome per worker, or 'http'
+                to share one pooled HTTP session between all workers
+            flushsize (int): buffered documents per collection that trigger a write
+            flushwait (float): seconds a buffered document may wait to be written
+            scheduler (str): 'tail' to sweep down from the stored tail,
+                'density' to look up numbers where valid ones are expected, or
+                'leases' to sweep ranges claimed in Mongo, shared with other
+                scraper processes
+            headsleeptime (float): seconds between head manager polls
+            headwindow (int): consecutive numbers checked by each head probe
+            rescrapebudget (int): lookups per day for re-scraping known numbers
+            recidivismshare (float): part of that budget spent on unassigned numbers
+            rate (float): starting lookups per second across all workers
+            targetlatency (float): lookup latency in seconds above which all
+                workers back off together
+            archive (str): directory to keep compressed raw detail pages in,
+                or None to keep none
+            leasesize (int): numbers per claimed range with the leases scheduler
+            leasettl (float): seconds a claim lasts without a heartbeat
+            maxpages (int): pages a worker's browser loads before it is recycled
+            maxmemory (float): MB a worker's browser may use before it is recycled
+            starturl (str): OffenderSearch start page, e.g. of a local simulator
+            dbname (str): mongo database to store into
         """
-        self.db = MongoClient("localhost", 27017).tdcj
+        self.db = MongoClient("localhost", 27017)[dbname]
         self.mgrsleeptime = mgrsleeptime
         self.pmode = pmode
         self.batchsize = batchsize
+        self.headsleeptime = headsleeptime
+        self.headwindow = headwindow
+        self.rescrapebudget = rescrapebudget
+        self.recidivismshare = recidivismshare
+        self.leasesize = leasesize
         self.q = asyncio.Queue()
+        self.probes = asyncio.Queue()
+        QUEUE_DEPTH.set_function("tasks", self.q.qsize)
+        QUEUE_DEPTH.set_function("probes", self.probes.qsize)
+        self.numbers = NumberSets.load_or_build(self.db)
+        self.writer = BufferedWriter(
+            self.db, flushsize, flushwait, pmode, self.numbers
+        )
+        self.archive = None
+        if archive is not None:
+            self.archive = PageArchive(archive, self.writer)
+            self.db.pages.create_index([("tdcj_number", 1), ("fetched", 1)])
+        self.fetcher = None
+        if engine == "http":
+            self.fetcher = HttpFetcher(starturl, numworkers, archive=self.archive)
+        self.pacer = AIMDController(
+            numworkers, rate=rate, targetlatency=targetlatency, pmode=pmode
+        )
+        for limit in ("concurrency", "rate", "inflight"):
+            PACING.set_function(limit, lambda limit=limit: self.pacer.limits()[limit])
+        self.scheduler = None
+        if scheduler == "density":
+            self.scheduler = DensityScheduler.from_db(self.db, self.numbers)
+        self.leases = None
+        self.claims = []
+        self.parsefailures = Counter()
+        if scheduler == "leases":
+            self.leases = LeaseManager(self.db, ttl=leasettl, pmode=pmode)
         self.workers = [
-            ScraperWorker(self.q, self.db, headless, workersleeptime, pmode)
+            ScraperWorker(
+                self.q,
+                self.probes,
+                self.writer,
+                headless,
+                workersleeptime,
+                pmode,
+                self.pacer,
+                self.fetcher,
+                self.scheduler,
+                self.archive,
+                maxpages,
+                maxmemory,
+                starturl,
+                self.parsefailures,
+            )
             for i in range(numworkers)
         ]
 
+    async def close(self):
+        """
+        Writes out everything still buffered and releases resources shared by
+        the workers.
+        """
+        await self.writer.flush(save=True)
+        await asyncio.gather(*(w.close() for w in self.workers))
+        if self.leases is not None:
+            self.complete_claims()
+            self.leases.release(self.claims)
+        if self.fetcher is not None:
+            await self.fetcher.close()
+
+    async def offload(self, fn, *args, **kwargs):
+        """
+        Runs a blocking database call on the default thread pool, so the 
+        managers don't stall the workers.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, partial(fn, *args, **kwargs)
+        )
+
+    async def supervise(self, managers):
+        """
+        Runs the managers, and once every one of them ended and every number
+        they queued was looked up, stops the workers. The workers wait on the
+        queues until then, however long the managers take to fill them.
+
+        Args:
+            managers (list): manager co-routines
+        """
+        await asyncio.gather(*managers)
+        # failed lookups are requeued before they are marked done
+        await self.probes.join()
+        await self.q.join()
+        for _ in self.workers:
+            self.q.put_nowait(STOP)
+        if self.pmode >= 1:
+            print("Managers done, stopping the workers")
+
     async def tailmanager(self):
         """
         Populates the queue to scrape with unchecked potential TDCJ numbers in 
-        descending order. 
+        descending order. Numbers already checked are skipped. The stored tail 
+        only moves past numbers once they are written, so none are lost when 
+        the scraper stops with numbers in flight.
         """
         tailmax = int(self.db.admin.find_one({"_id": "tail"})["value"])
+        stored = tailmax
         while tailmax >= 99999 + self.batchsize:
             if self.q.qsize() < self.batchsize:
                 for i in range(tailmax, tailmax - self.batchsize, -1):
-                    self.q.put_nowait(i)
+                    if i not in self.numbers.checked:
+                        self.q.put_nowait(i)
                 if self.pmode >= 1:
                     print(f"Added tail tasks {tailmax}..{tailmax-self.batchsize}")
                 tailmax -= self.batchsize
-                self.db.admin.update_one({"_id": "tail"}, {"$set": {"value": tailmax}})
+            done = max(self.numbers.checked.next_absent(stored, -1), tailmax)
+            if done < stored:
+                stored = done
+                self.db.admin.update_one({"_id": "tail"}, {"$set": {"value": stored}})
             await asyncio.sleep(self.mgrsleeptime)
 
+    async def schedulemanager(self):
+        """
+        Populates the queue with the unchecked TDCJ numbers the density 
+        scheduler expects to be valid most often. 
+        """
+        while True:
+            if self.q.qsize() < self.batchsize:
+                batch = self.scheduler.next_batch(self.batchsize)
+                if not batch:
+                    break
+                for i in batch:
+                    self.q.put_nowait(i)
+                if self.pmode >= 1:
+                    print(f"Added {len(batch)} scheduled tasks {min(batch)}..{max(batch)}")
+            await asyncio.sleep(self.mgrsleeptime)
+
+    async def leasemanager(self):
+        """
+        Populates the queue from ranges leased in the claims collection, 
+        highest first, so any number of scraper processes can share the tail. 
+        Numbers another process already stored are skipped, and a range is 
+        marked done only once all of its numbers were written. Ends when no 
+        range is left to claim or waiting for its lease to expire.
+        """
+        if not self.db.claims.estimated_document_count():
+            tail = int(self.db.admin.find_one({"_id": "tail"})["value"])
+            await self.offload(self.leases.seed, 100000, tail + 1, self.leasesize)
+        while True:
+            if self.leases.due():
+                self.claims = await self.offload(self.leases.heartbeat, self.claims)
+            self.complete_claims()
+            if self.q.qsize() < self.batchsize:
+                claim = await self.offload(self.leases.claim)
+                if claim is None:
+                    progress = await self.offload(self.leases.progress)
+                    if not self.claims and not progress.get("leased"):
+                        if self.pmode >= 1:
+                            print("No ranges left to claim")
+                        break
+                else:
+                    lo, hi = claim["lo"], claim["hi"]
+                    stored = await self.offload(lambda: list(stored_numbers(self.db, lo, hi)))
+                    for n, hit in stored:
+                        if n not in self.numbers.checked:
+                            self.numbers.record(n, hit)
+                    new = [i for i in range(hi - 1, lo - 1, -1) if i not in self.numbers.checked]
+                    for i in new:
+                        self.q.put_nowait(i)
+                    self.claims.append(claim)
+                    if self.pmode >= 1:
+                        print(f"Claimed {lo}..{hi - 1}, added {len(new)} tasks")
+            await asyncio.sleep(self.mgrsleeptime)
+
+    def complete_claims(self):
+        """
+        Marks the claimed ranges whose numbers were all written done.
+        """
+        for claim in list(self.claims):
+            lo, hi = claim["lo"], claim["hi"]
+            if self.numbers.checked.count(lo, hi) < hi - lo:
+                continue
+            self.claims.remove(claim)
+            if self.leases.complete(claim) and self.pmode >= 2:
+                print(f"Completed range {lo}..{hi - 1}")
+
     async def deathrowMGR(self):
         """
         Populates the queue with active DR tdcj numbers.
@@ -66,45 +278,244 @@ class Scraper:
 
     async def headMGR(self):
         """
-        Populates the queue with potential recently-assigned tdcj numbers.
+        Populates the queue with potential recently-assigned tdcj numbers. 
+        Every cycle finds the current highest assigned number by probing 
+        exponentially further above the highest known inmate and bisecting 
+        between the last hit and the first miss, then queues the numbers up to 
+        it ahead of other work.
         """
-        pass
+        while True:
+            top = await self.offload(
+                self.db.inmates.find_one, {}, {"_id": 1}, sort=[("_id", -1)]
+            )
+            top = int(top["_id"]) if top else 99999
+            frontier = await self.find_frontier(top)
+            new = [
+                i for i in range(top + 1, frontier + 1) 
+                if i not in self.numbers.checked
+            ]
+            for i in new:
+                self.probes.put_nowait((i, None))
+            await self.offload(
+                self.db.admin.update_one,
+                {"_id": "head"}, {"$set": {"value": frontier}}, upsert=True,
+            )
+            if self.pmode >= 1:
+                print(f"Head at {frontier}, added {len(new)} head tasks {top + 1}..{frontier}")
+            await asyncio.sleep(self.headsleeptime)
+
+    async def find_frontier(self, top):
+        """
+        Finds the highest assigned TDCJ number at or above a known one.
+
+        Args:
+            top (int): an assigned tdcj number
+
+        Returns:
+            int: highest assigned number found
+        """
+        # exponential probe until a window comes back empty
+        step = 1
+        while True:
+            hit = await self.probe_window(top + step)
+            if hit is None:
+                break
+            top = hit
+            step *= 2
+        # bisect between the last hit and the empty window
+        lo, hi = top, top + step
+        while hi - lo > self.headwindow:
+            mid = (lo + hi) // 2
+            hit = await self.probe_window(mid)
+            if hit is None:
+                hi = mid
+            else:
+                lo = hit
+        return lo
+
+    async def probe_window(self, start):
+        """
+        Looks up headwindow consecutive numbers at once, so that the odd 
+        unassigned number doesn't end the search early.
+
+        Args:
+            start (int): first number of the window
+
+        Returns:
+            highest assigned number in the window, or None
+        """
+        results = await asyncio.gather(
+            *(self.lookup(i) for i in range(start, start + self.headwindow))
+        )
+        # a number with an unreadable detail page still had a search result
+        hits = [i for i, idata in zip(range(start, start + self.headwindow), results)
+            if type(idata) != int]
+        return max(hits, default=None)
+
+    async def lookup(self, tdcjnum):
+        """
+        Has the next free worker scrape and store a number ahead of the queue.
+
+        Args:
+            tdcjnum (int): possible tdcj number
+
+        Returns:
+            the scraped entry dict, the number if it is unassigned, or None if
+            its detail page couldn't be parsed
+        """
+        fut = asyncio.get_running_loop().create_future()
+        self.probes.put_nowait((tdcjnum, fut))
+        return await fut
 
     async def recidivismMGR(self):
         """
-        Populates the queue with confirmed unassigned tdcj numbers.
+        Populates the queue with confirmed unassigned tdcj numbers, longest 
+        unchecked first.
         """
-        pass
+        budget = self.rescrapebudget * self.recidivismshare
+        await self.rescrapemanager(RescrapeQueue.unassigned, budget, "recidivism")
 
     async def releaseMGR(self):
         """
-        Populates the queue with potentially released or paroled tdcj numbers.
+        Populates the queue with potentially released or paroled tdcj numbers: 
+        the stalest inmates and those near a release or parole date first.
         """
-        pass
+        budget = self.rescrapebudget * (1 - self.recidivismshare)
+        await self.rescrapemanager(RescrapeQueue.inmates, budget, "release")
+
+    async def rescrapemanager(self, build, budget, name):
+        """
+        Feeds the queue from a re-scrape priority queue at a steady rate 
+        within a daily lookup budget. The priority queue is rebuilt daily, or 
+        when it runs out.
+
+        Args:
+            build (callable): builds a RescrapeQueue from the database
+            budget (float): lookups per day
+            name (str): name of the manager for printing
+        """
+        if budget <= 0:
+            return
+        interval = 86400 / budget
+        queue = await self.offload(build, self.db)
+        while True:
+            # the workers are behind, don't pile up numbers they can't get to
+            if self.q.qsize() >= self.batchsize:
+                await asyncio.sleep(self.mgrsleeptime)
+                continue
+            if not len(queue) or (datetime.now() - queue.built).days >= 1:
+                queue = await self.offload(build, self.db)
+                if not len(queue):
+                    await asyncio.sleep(self.mgrsleeptime)
+                    continue
+            batch = queue.pop(max(1, min(self.batchsize, int(self.mgrsleeptime / interval))))
+            for i in batch:
+                self.q.put_nowait(i)
+            if self.pmode >= 1:
+                print(f"Added {len(batch)} {name} tasks")
+            await asyncio.sleep(interval * len(batch))
 
 
 class ScraperWorker:
-    def __init__(self, q, db, headless, sleeptime, pmode):
+    def __init__(
+        self,
+        q,
+        probes,
+        writer,
+        headless,
+        sleeptime,
+        pmode,
+        pacer,
+        fetcher=None,
+        scheduler=None,
+        archive=None,
+        maxpages=500,
+        maxmemory=1024,
+        starturl=START_URL,
+        parsefailures=None,
+    ):
         """
-        Constructs the worker with own webdriver. 
+        Constructs the worker with own browser session, unless it is given a 
+        shared HTTP fetcher to use instead. Every call into the webdriver 
+        blocks until the browser answers, so they all run on a thread of the 
+        worker's own and the workers' browsers really work side by side. 
+        Selenium is only imported for browser workers.
 
         Args:
             q (asyncio.Queue): queue to contain scraping tasks
-            db (pymongo.database.Database): relevant database to write to
+            probes (asyncio.Queue): queue of (tdcj number, future or None) 
+                tasks taken before those in q
+            writer (BufferedWriter): shared buffer for writes to the database
             headless (bool): controlling if the webdriver runs
-            sleeptime (float): worker sleep time in seconds
+            sleeptime (float): shortest wait for a page element in seconds
             pmode (int): print mode. Higher the number, the more is printed
+            pacer (AIMDController): shared concurrency and rate controller
+            fetcher (HttpFetcher): shared HTTP fetch engine, or None for Chrome
+            scheduler (DensityScheduler): scheduler to report results to, if any
+            archive (PageArchive): archive to keep the detail pages in, if any
+            maxpages (int): pages the browser loads before it is recycled
+            maxmemory (float): MB the browser may use before it is recycled
+            starturl (str): OffenderSearch start page the browser searches from
+            parsefailures (Counter): failed parses per number, shared by the
+                workers since a requeued number may go to any of them
         """
-        wd_path = f"{os.getcwd()}/src/chromedriver"
-        opt = Options()
-        opt.headless = headless
-
-        self.driver = Chrome(executable_path=wd_path, options=opt)
-        self.db = db
+        self.fetcher = fetcher
+        self.starturl = starturl
+        self.scheduler = scheduler
+        self.archive = archive
+        self.browser = None
+        self.executor = None
+        self.errors = FETCH_ERRORS
+        if fetcher is None:
+            from browser import BrowserSession, BROWSER_ERRORS
+
+            self.errors = BROWSER_ERRORS
+            wd_path = f"{os.getcwd()}/src/chromedriver"
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="browser")
+            self.browser = self.executor.submit(
+                BrowserSession, wd_path, headless, maxpages, maxmemory, pmode
+            ).result()
+        self.writer = writer
         self.pmode = pmode
         self.sleeptime = sleeptime
-        self.sleepmult = 1
+        self.pacer = pacer
         self.q = q
+        self.probes = probes
+        # tasks taken from a queue while waiting on both, not started yet
+        self.held = []
+        self.parsefailures = Counter() if parsefailures is None else parsefailures
+
+    async def call(self, fn, *args):
+        """
+        Runs a blocking webdriver call on the worker's browser thread.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(fn, *args))
+
+    @property
+    def driver(self):
+        return self.browser.driver
+
+    async def close(self):
+        """
+        Quits the worker's browser, if it has one.
+        """
+        if self.browser is not None:
+            await self.call(self.browser.quit)
+            self.browser = None
+            self.executor.shutdown(wait=False)
+
+    async def restart_browser(self):
+        """
+        Replaces a crashed browser. If the new one fails to start too, the 
+        next page load tries again.
+        """
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            await self.call(self.browser.restart)
+        except WebDriverException as e:
+            print(f"Could not restart the browser: {e!r}")
 
     async def scrape_inmate(self, tdcjnum):
         """
@@ -117,178 +528,310 @@ class ScraperWorker:
             a dictionary of inmate information if the number is valid
             else the value False
         """
-        await self.search_by_number(tdcjnum)
+        if self.fetcher is not None:
+            return await self.fetcher.scrape_inmate(tdcjnum)
+        from selenium.common.exceptions import NoSuchElementException
+        from selenium.webdriver.common.by import By
+
+        with STAGE_SECONDS.time("search"):
+            await self.search_by_number(tdcjnum)
         try:
-            self.driver.find_element_by_class_name(
-                "tdcj_table"
-            ).find_element_by_tag_name("a").click()
+            results = await self.call(self.open_result)
 
         # this happens for unassigned tdcj numbers...
         except NoSuchElementException:
             return tdcjnum
 
-        await asyncio.sleep(self.sleeptime)
-        await self.wait_until_present(By.ID, "content_right")
+        with STAGE_SECONDS.time("detail"):
+            # every page has content_right, so first make sure the results left
+            await self.wait_until_replaced(results)
+            await self.wait_until_present(By.ID, "content_right")
         # we found an inmate!
-        # get admin data into a dict
-        entry = dict()
-        admin_info = (
-            self.driver.find_element_by_id("content_right")
-            .find_elements_by_tag_name("p")[1]
-            .text.split("\n\n")
-        )
-        for row in map(lambda s: s.split(":"), admin_info):
-            entry[row[0].strip()] = row[1].strip()
-
-        # add offenses data to the return dict
-        offense_table_html = self.driver.find_element_by_class_name(
-            "tdcj_table"
-        ).get_attribute("outerHTML")
-        offenses = json.loads(pd.read_html(offense_table_html)[0].to_json())
-        entry["offensetable"] = offenses
-
-        # add the timestamp for when it was pulled
-        entry["accessed"] = datetime.now().strftime("%Y%m%d_%H%M")
-
-        # some data cleaning for Mongo
-        entry["offensetable"]["Case No"] = entry["offensetable"].pop("Case No.")
-        entry["_id"] = entry.pop("TDCJ Number")
-        return entry
-
-    async def search_by_number(self, tdcjnum, retry=False):
+        html = await self.call(lambda: self.driver.page_source)
+        fetched = datetime.now()
+        if self.archive is not None:
+            await self.archive.store(tdcjnum, html, fetched)
+        with STAGE_SECONDS.time("parse"):
+            return parse_entry(html, fetched)
+
+    async def search_by_number(self, tdcjnum):
         """
         Searches the tdcj website for a possible inmate number.
 
         Args:
             tdcjnum (int): possible tdcj number
-            retry (bool): for recursive usage; True if call has failed once
         """
-        self.driver.get("https://offender.tdcj.texas.gov/OffenderSearch/start")
+        from selenium.webdriver.common.by import By
+
+        await self.call(self.browser.get, self.starturl)
         # the form wants an 8-digit number padded on the left with 0s
         qstring = str(tdcjnum)
         qstring = "".join(["0"] * (8 - len(qstring))) + qstring
-        await asyncio.sleep(self.sleeptime)
         await self.wait_until_present(By.NAME, "tdcj")
 
         # type qstring and hit search
+        start = await self.call(self.submit_search, qstring)
+        # the start page has content_right too: wait for the results to replace it
+        await self.wait_until_replaced(start)
+        await self.wait_until_present(By.ID, "content_right")
+
+    def submit_search(self, qstring):
+        """
+        Types a padded number into the search form and submits it. Blocking, 
+        run through call.
+
+        Returns:
+            the start page's html element, stale once the results loaded
+        """
+        page = self.driver.find_element_by_tag_name("html")
         tdcj_num_field = self.driver.find_element_by_name("tdcj")
         tdcj_num_field.send_keys(qstring)
         self.driver.find_element_by_name("btnSearch").click()
-        await asyncio.sleep(self.sleeptime)
+        return page
 
-        #retries the call once if it fails
-        try:
-            await self.wait_until_present(By.ID, "content_right")
-        except TimeoutException as e:
-            if retry:
-                raise e
-            else:
-                self.search_by_number(tdcjnum, True)
+    def open_result(self):
+        """
+        Clicks the first search result. Blocking, run through call.
+
+        Returns:
+            the results page's html element, stale once the details loaded
+
+        Raises:
+            NoSuchElementException if the search found nobody
+        """
+        page = self.driver.find_element_by_tag_name("html")
+        self.driver.find_element_by_class_name(
+            "tdcj_table"
+        ).find_element_by_tag_name("a").click()
+        return page
+
+    async def wait_until(self, condition):
+        """
+        Convenience method for waiting until a condition holds. The wait 
+        stretches with the latency the pacer measures across all workers.
+
+        Args:
+            condition: selenium expected condition
+
+        Raises:
+            TimeoutException if the condition doesn't hold in time
+        """
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        with STAGE_SECONDS.time("wait"):
+            await self.call(
+                WebDriverWait(self.driver, self.pacer.timeout(self.sleeptime)).until,
+                condition,
+            )
 
     async def wait_until_present(self, by, label):
         """
-        Convenience method for waiting until an element is present. Also makes 
-        waittime for elements elastic for changing network latency.
+        Waits until an element is present, see wait_until.
 
         Args:
-            timeout (float): time to wait in seconds
             by (selenium.webdriver..by): selector type
             label (str): label of element
         """
-        try:
-            WebDriverWait(self.driver, self.sleeptime * self.sleepmult).until(
-                EC.presence_of_element_located((by, label))
-            )
-            #decrease wait time
-            if self.sleepmult > 1:
-                self.sleepmult -= 0.1
-        except TimeoutException as e:
-            #wait longer times
-            if self.sleepmult < 3:
-                self.sleepmult += 1
-                print(f'Sleeptime increased to {self.sleepmult * self.sleeptime} seconds.')
-                await self.wait_until_present(by, label)
-            else:
-                raise e
+        from selenium.webdriver.support import expected_conditions as EC
+
+        await self.wait_until(EC.presence_of_element_located((by, label)))
+
+    async def wait_until_replaced(self, page):
+        """
+        Waits until a click navigated away from a page, see wait_until.
+
+        Args:
+            page: the html element of the page clicked on
+        """
+        from selenium.webdriver.support import expected_conditions as EC
+
+        await self.wait_until(EC.staleness_of(page))
 
     async def store_idata(self, idata):
         """
-        Asyncronously inserts the scraped data of an inmate into the mongodb.
+        Asyncronously queues the scraped data of an inmate for insertion into 
+        the mongodb. Numbers already stored are reconciled by the writer when 
+        it flushes.
 
         Args: 
             idata (dict or int): int if no data for tdch number, dict if otherwise
         
-        Returns: None, but inserts into inmates or unassigned.
+        Returns: None, but inserts into inmates or marks the number unassigned
+            in the number sets.
         """
-        try:
-            # for invalid tdcj numbers
-            if type(idata) == int:
-                self.db.unassigned.insert_one({"_id": idata})
-                if self.pmode >= 3:
-                    print(f"{idata} added to unassigned.")
-            # for valid tdcj numbers
-            else:
-                self.db.inmates.insert_one(idata)
-                if self.pmode >= 3:
-                    print(f"{idata['_id']} added to inmates")
-
-        # TDCJ number already in mongo
-        except DuplicateKeyError:
-            if self.pmode >= 2:
-
-                # TODO need split behavior for cases:
-                # 1. tdcj number is valid but already in unassigned collection (reincarcerated)
-                # 2. tdcj number is valid but already in inmates collection (update)
-                # 3. tdcj number is invalid but in inmates collection (release)
-                if type(idata) == dict:
-                    idata = idata["_id"]
-                print(f"Duplicate tdcj number ignored: {idata}")
+        with STAGE_SECONDS.time("store"):
+            await self._store_idata(idata)
+
+    async def _store_idata(self, idata):
+        """
+        Body of store_idata, timed there.
+        """
+        # for invalid tdcj numbers, only kept in the number sets
+        if type(idata) == int:
+            await self.writer.insert("unassigned", {"_id": idata, "accessed": datetime.now()})
+            if self.pmode >= 3:
+                print(f"{idata} queued for unassigned.")
+        # for valid tdcj numbers
+        else:
+            idata["hash"] = content_hash(idata)
+            await self.writer.insert("inmates", idata)
+            if self.pmode >= 3:
+                print(f"{idata['_id']} queued for inmates")
+
+    async def next_task(self):
+        """
+        Takes the next task, probes first, waiting for the managers to queue
+        one if both queues are empty.
+
+        Returns:
+            tuple: (queue taken from, tdcj number or STOP, future or None)
+        """
+        if self.held:
+            return self.held.pop()
+        if self.probes.empty() and self.q.empty():
+            getters = {
+                asyncio.ensure_future(self.probes.get()): self.probes,
+                asyncio.ensure_future(self.q.get()): self.q,
+            }
+            try:
+                await asyncio.wait(getters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for getter in getters:
+                    getter.cancel()
+            # both queues may have handed over a task, the other one waits
+            for getter, queue in getters.items():
+                if getter.done() and not getter.cancelled():
+                    task = getter.result()
+                    self.held.append(
+                        (queue, *task) if queue is self.probes else (queue, task, None)
+                    )
+            self.held.sort(key=lambda task: task[0] is self.probes)
+            return self.held.pop()
+        if not self.probes.empty():
+            return (self.probes, *self.probes.get_nowait())
+        return self.q, self.q.get_nowait(), None
 
     async def work(self):
         """
-        Worker co-routine for scraping. Scrapes tdcj numbers from queue 
-        populated by manager.
+        Worker co-routine for scraping. Scrapes tdcj numbers from queues
+        populated by managers, probes first, and waits for more while both
+        are empty.
 
-        Returns: None. Ends when the queue is empty.
+        Returns: None. Ends when it takes STOP from the queue.
         """
-        while not self.q.empty():
-            tdcjnum = await self.q.get()
-            idata = await self.scrape_inmate(tdcjnum)
+        while True:
+            queue, tdcjnum, fut = await self.next_task()
+            if tdcjnum is STOP:
+                queue.task_done()
+                return
+            try:
+                async with self.pacer.slot():
+                    idata = await self.scrape_inmate(tdcjnum)
+            # the site is struggling: the pacer backs off, try again later
+            except self.errors as e:
+                LOOKUPS.inc("error")
+                if self.pmode >= 2:
+                    print(f"Lookup of {tdcjnum} failed, requeued: {e!r}")
+                if self.browser is not None:
+                    from browser import is_crash
+
+                    if is_crash(e):
+                        await self.restart_browser()
+                if fut is not None:
+                    self.probes.put_nowait((tdcjnum, fut))
+                else:
+                    self.q.put_nowait(tdcjnum)
+                queue.task_done()
+                continue
+            # the page came back, but isn't a detail page the parser can read
+            except ParseError as e:
+                LOOKUPS.inc("parse_error")
+                self.parsefailures[tdcjnum] += 1
+                if self.parsefailures[tdcjnum] < PARSE_ATTEMPTS:
+                    if fut is not None:
+                        self.probes.put_nowait((tdcjnum, fut))
+                    else:
+                        self.q.put_nowait(tdcjnum)
+                    queue.task_done()
+                    continue
+                # left unchecked, so a later run looks it up again
+                del self.parsefailures[tdcjnum]
+                if self.pmode >= 1:
+                    kept = "archived" if self.archive is not None else "not archived"
+                    print(f"Skipped {tdcjnum}, page {kept}: {e}")
+                if self.pmode >= 2 and self.archive is None:
+                    print(e.html)
+                if fut is not None:
+                    fut.set_result(None)
+                queue.task_done()
+                continue
+            except Exception as e:
+                if fut is not None:
+                    fut.set_exception(e)
+                raise
+            LOOKUPS.inc("unassigned" if type(idata) == int else "hit")
             await self.store_idata(idata)
-            self.q.task_done()
+            if self.scheduler is not None:
+                self.scheduler.record(tdcjnum, type(idata) != int)
+            if fut is not None:
+                fut.set_result(idata)
+            queue.task_done()
 
 
-def main(args):
+def main(args, head=False, rescrape=False, metricsport=0, summaryinterval=60):
     """
     Sets up async environment and runs the scraper. 
 
     Args:
         args (dict): parameters for Scraper()
+        head (bool): also run the head manager looking for new intake
+        rescrape (bool): also run the managers re-scraping known numbers
+        metricsport (int): port for the local metrics endpoint, 0 for none
+        summaryinterval (float): seconds between metrics summary lines, 0 for none
     """
     loop = asyncio.get_event_loop()
+    scr = Scraper(**args)
+
     signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
     for s in signals:
         loop.add_signal_handler(
-            s, lambda s=s: asyncio.create_task(shutdown(loop, signal=s))
+            s, lambda s=s: asyncio.create_task(shutdown(loop, signal=s, scraper=scr))
+        )
+        loop.set_exception_handler(
+            lambda loop, context: handle_exception(loop, context, scr)
         )
-        loop.set_exception_handler(handle_exception)
 
-    scr = Scraper(**args)
     try:
-        loop.create_task(scr.tailmanager())
+        if scr.scheduler is not None:
+            managers = [scr.schedulemanager()]
+        elif scr.leases is not None:
+            managers = [scr.leasemanager()]
+        else:
+            managers = [scr.tailmanager()]
+        if head:
+            managers.append(scr.headMGR())
+        if rescrape:
+            managers += [scr.releaseMGR(), scr.recidivismMGR()]
+        loop.create_task(scr.supervise(managers))
+        if metricsport:
+            loop.create_task(metrics.serve(metricsport))
+        if summaryinterval:
+            loop.create_task(metrics.summaryloop(summaryinterval))
+        loop.create_task(scr.writer.run())
         [loop.create_task(w.work()) for w in scr.workers]
         loop.run_forever()
     finally:
         loop.close()
 
 
-def handle_exception(loop, context):
+def handle_exception(loop, context, scraper=None):
     """
     Simple async exception handler that just prints the exception.
 
     Args:
         loop (asyncio event loop): event loop
         context (dict): asyncio error context 
+        scraper (Scraper): scraper whose resources to release on shutdown
     """
     # context doesn't always have an exception
     e = context.get("exception", context)
@@ -297,20 +840,21 @@ def handle_exception(loop, context):
 
         print(f"Caught exception without object:")
         pprint.pprint(e)
-        asyncio.create_task(shutdown(loop))
+        asyncio.create_task(shutdown(loop, scraper=scraper))
     else:
-        asyncio.create_task(shutdown(loop))
+        asyncio.create_task(shutdown(loop, scraper=scraper))
         print("Caught exception:")
         raise e
 
 
-async def shutdown(loop, signal=None):
+async def shutdown(loop, signal=None, scraper=None):
     """
     Defines shutdown behavior for the event loop.
 
     Args:
         loop (asyncio event loop): event loop
         signal: signal received.
+        scraper (Scraper): scraper whose resources to release
     """
     if signal:
         print(f"Received exit signal {signal.name}...")
@@ -318,6 +862,8 @@ async def shutdown(loop, signal=None):
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
     [task.cancel() for task in tasks]
     await asyncio.gather(*tasks, return_exceptions=True)
+    if scraper is not None:
+        await scraper.close()
     loop.stop()
 
 
@@ -326,12 +872,42 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-w", "--workersleeptime", type=float, default=1.0)
+    parser.add_argument("-r", "--rate", type=float, default=1.0)
+    parser.add_argument("--targetlatency", type=float, default=5.0)
     parser.add_argument("-m", "--mgrsleeptime", type=float, default=5)
     parser.add_argument("-p", "--pmode", type=int, default=1)
     parser.add_argument("-b", "--batchsize", type=int, default=50)
     parser.add_argument("-n", "--numworkers", type=int, default=3)
+    parser.add_argument("-e", "--engine", choices=("selenium", "http"), default="selenium")
+    parser.add_argument("-s", "--scheduler", choices=("tail", "density", "leases"),
+        default="tail")
+    parser.add_argument("--leasesize", type=int, default=1000)
+    parser.add_argument("--leasettl", type=float, default=300.0)
+    parser.add_argument("--head", action="store_true")
+    parser.add_argument("--headsleeptime", type=float, default=3600)
+    parser.add_argument("--headwindow", type=int, default=3)
+    parser.add_argument("--rescrape", action="store_true")
+    parser.add_argument("--rescrapebudget", type=int, default=2000)
+    parser.add_argument("--recidivismshare", type=float, default=0.2)
+    parser.add_argument("--metricsport", type=int, default=0)
+    parser.add_argument("--summaryinterval", type=float, default=60)
+    parser.add_argument("--flushsize", type=int, default=500)
+    parser.add_argument("--flushwait", type=float, default=5.0)
+    parser.add_argument("--archive", help="keep compressed raw detail pages here")
+    parser.add_argument("--maxpages", type=int, default=500,
+        help="pages a browser loads before it is replaced, 0 for no limit")
+    parser.add_argument("--maxmemory", type=float, default=1024,
+        help="MB a browser may use before it is replaced, 0 for no limit")
+    parser.add_argument("--starturl", default=START_URL,
+        help="OffenderSearch start page, e.g. of a local simulator")
+    parser.add_argument("--dbname", default="tdcj", help="mongo database to store into")
     parser.add_argument("-v", dest="headless", action="store_false")
     parser.set_defaults(headless=True)
     args = parser.parse_args()
 
-    main(args.__dict__)
+    args = args.__dict__
+    head = args.pop("head")
+    rescrape = args.pop("rescrape")
+    metricsport = args.pop("metricsport")
+    summaryinterval = args.pop("summaryinterval")
+    main(args, head, rescrape, metricsport, summaryinterval)
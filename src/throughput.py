@@ -0,0 +1,145 @@
+from functools import wraps
+import asyncio, time
+import simulator
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a list of numbers, or None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+def _timed(scrape, latencies):
+    """
+    Wraps a worker's scrape_inmate to record the seconds of every lookup
+    and whether it succeeded.
+    """
+
+    @wraps(scrape)
+    async def timed(tdcjnum):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = await scrape(tdcjnum)
+            ok = True
+            return result
+        finally:
+            latencies.append((time.perf_counter() - start, ok))
+
+    return timed
+
+
+async def run(sim, numbers, engine="http", numworkers=10, rate=50.0, targetlatency=5.0,
+        dbname="tdcj_sim", keep=False, pmode=0):
+    """
+    Scrapes a range of numbers from a local site simulator end to end: the
+    workers look the numbers up through the pacer and store them through
+    the buffered writer into a scratch database, which is dropped first.
+
+    Args:
+        sim (SiteSimulator): site to scrape
+        numbers (range): TDCJ numbers to look up
+        engine (str): 'http' or 'selenium', as for Scraper
+        numworkers (int): number of workers
+        rate (float): starting lookups per second of the pacer
+        targetlatency (float): pacer latency target in seconds
+        dbname (str): scratch mongo database
+        keep (bool): keep the scratch database afterwards
+        pmode (int): print mode of the scraper
+
+    Returns:
+        dict of the measurements
+    """
+    from pymongo import MongoClient
+    from tdcj_scraper import Scraper
+
+    server, url = await sim.start()
+    client = MongoClient("localhost", 27017)
+    client.drop_database(dbname)
+    scr = Scraper(
+        headless=True,
+        workersleeptime=1.0,
+        mgrsleeptime=1.0,
+        pmode=pmode,
+        numworkers=numworkers,
+        batchsize=len(numbers),
+        engine=engine,
+        rate=rate,
+        targetlatency=targetlatency,
+        starturl=url,
+        dbname=dbname,
+    )
+    latencies = []
+    for worker in scr.workers:
+        worker.scrape_inmate = _timed(worker.scrape_inmate, latencies)
+    for n in numbers:
+        scr.q.put_nowait(n)
+
+    writer = asyncio.create_task(scr.writer.run())
+    start = time.perf_counter()
+    workers = [asyncio.create_task(w.work()) for w in scr.workers]
+    # failed lookups are requeued, so the queue is done once every number is
+    await scr.q.join()
+    elapsed = time.perf_counter() - start
+    for task in workers + [writer]:
+        task.cancel()
+    await asyncio.gather(*workers, writer, return_exceptions=True)
+    await scr.close()
+    server.close()
+
+    db = client[dbname]
+    ok = [seconds for seconds, success in latencies if success]
+    result = {
+        "numbers": len(numbers),
+        "seconds": elapsed,
+        "numbers_per_second": len(numbers) / elapsed,
+        "hits": db.inmates.count_documents({}),
+        "expected_hits": sum(sim.inmate(n) is not None for n in numbers),
+        "unassigned": len(scr.numbers.unassigned),
+        "failed_lookups": len(latencies) - len(ok),
+        "p50": percentile(ok, 0.5),
+        "p99": percentile(ok, 0.99),
+        "served": dict(sim.served),
+    }
+    result["hits_per_hour"] = result["hits"] / elapsed * 3600
+    if not keep:
+        client.drop_database(dbname)
+    client.close()
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measures scraper throughput against a local site simulator."
+    )
+    parser.add_argument("--lo", type=int, default=1000000, help="first number to look up")
+    parser.add_argument("-n", type=int, default=2000, help="numbers to look up")
+    parser.add_argument("-e", "--engine", choices=("selenium", "http"), default="http")
+    parser.add_argument("-w", "--numworkers", type=int, default=10)
+    parser.add_argument("-r", "--rate", type=float, default=50.0)
+    parser.add_argument("--targetlatency", type=float, default=5.0)
+    parser.add_argument("--dbname", default="tdcj_sim")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    parser.add_argument("-p", "--pmode", type=int, default=0)
+    simulator.add_arguments(parser)
+    args = parser.parse_args()
+
+    r = asyncio.run(run(
+        simulator.from_arguments(args), range(args.lo, args.lo + args.n), args.engine,
+        args.numworkers, args.rate, args.targetlatency, args.dbname, args.keep, args.pmode,
+    ))
+    print(f"{r['numbers']} numbers in {r['seconds']:.1f}s: {r['numbers_per_second']:.1f} numbers/s, "
+        f"{r['hits_per_hour']:.0f} hits/hour")
+    p50, p99 = (
+        "n/a" if r[q] is None else f"{r[q]:.3f}s" for q in ("p50", "p99")
+    )
+    print(f"lookup latency p50={p50} p99={p99}, "
+        f"{r['failed_lookups']} failed lookups retried")
+    print(f"stored {r['hits']} of {r['expected_hits']} inmates and {r['unassigned']} "
+        f"unassigned numbers; served {r['served']}")
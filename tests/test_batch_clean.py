@@ -0,0 +1,61 @@
+import copy, random
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("psycopg2")
+import batch_clean, pgpipe, synthetic
+from detail_parser import parse_detail_page, to_entry, to_legacy_entry
+
+
+def scraped_entries(n, seed=0, build=to_legacy_entry):
+    rng = random.Random(seed)
+    return [
+        build(parse_detail_page(synthetic.detail_page(
+            *synthetic.random_inmate(rng, 1000000 + i))))
+        for i in range(n)
+    ]
+
+
+def copied(rows):
+    return [[pgpipe._copy_value(v) for v in row] for row in rows]
+
+
+def test_batch_matches_per_record_cleaning_with_a_missing_case_no():
+    entries = scraped_entries(20)
+    entries[3]["offensetable"]["Case No"]["0"] = None
+    keys = pgpipe.OFFENSE_KEYS
+
+    expected = [
+        [o[k] for k in keys] for e in entries for o in pgpipe.prep_offender_data(dict(e))[1]
+    ]
+    _, offenses = batch_clean.prep_offender_batch(entries)
+    rows = pgpipe._frame_rows(offenses, keys)
+
+    assert copied(rows) == copied(expected)
+    assert copied(rows)[0][keys.index("Case No")].isdigit()
+
+
+# dtype kinds of the offenders frame: b bool, i int, M datetime, O object or string
+OFFENDER_KINDS = {
+    'SID Number': 'O', '_id': 'O', 'Name': 'O', 'Race': 'O', 'Gender': 'b',
+    'Maximum Sentence Date': 'M', 'MSD_cat': 'i', 'Current Facility': 'O',
+    'Projected Release Date': 'O', 'Parole Eligibility Date': 'O',
+    'Offender Visitation Eligible': 'O', 'accessed': 'M',
+}
+
+
+@pytest.mark.parametrize('build, kinds', [
+    (to_legacy_entry, dict(OFFENDER_KINDS, DOB='O')),
+    (to_entry, dict(OFFENDER_KINDS, DOB='M', schema_version='i')),
+])
+def test_batch_matches_per_record_offenders(build, kinds):
+    entries = scraped_entries(30, build=build)
+    keys = pgpipe.OFFENDER_KEYS
+
+    records = [pgpipe.prep_offender_data(copy.deepcopy(e))[0] for e in entries]
+    offenders, _ = batch_clean.prep_offender_batch(entries)
+
+    assert {c: offenders[c].dtype.kind for c in offenders.columns} == kinds
+    assert set(offenders.columns) == set(records[0])
+    assert copied(pgpipe._frame_rows(offenders, keys)) == copied(
+        [[r[k] for k in keys] for r in records])
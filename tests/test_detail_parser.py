@@ -0,0 +1,68 @@
+import os
+import pytest
+import synthetic
+from detail_parser import (
+    find_result_link, offense_table, parse_detail_page, read_html_offense_table,
+)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def missing_case_no_page():
+    import random
+
+    admin, rows = synthetic.random_inmate(random.Random(0), 1000000)
+    rows = [rows[0][:4] + [""] + rows[0][5:]] + [row for _ in range(2) for row in rows]
+    return synthetic.detail_page(admin, rows)
+
+
+@pytest.mark.parametrize(
+    "html", [fixture("detail_page.html"), missing_case_no_page()] + synthetic.corpus(50)
+)
+def test_offense_table_matches_read_html(html):
+    pytest.importorskip("pandas")
+    page = parse_detail_page(html)
+    assert offense_table(page.headers, page.rows) == read_html_offense_table(html)
+
+
+def test_admin_fields():
+    page = parse_detail_page(fixture("detail_page.html"))
+    assert page.admin == {
+        "SID Number": "04213377",
+        "TDCJ Number": "01234567",
+        "Name": "DOE, JOHN & JR",
+        "Race": "W",
+        "Gender": "M",
+        "DOB": "1975-03-09",
+        "Maximum Sentence Date": "2031-07-22",
+        # only the first colon separates the field from its value
+        "Current Facility": "HUNTSVILLE: WALLS UNIT",
+        "Projected Release Date": "2027-01-15",
+        "Parole Eligibility Date": "NOT AVAILABLE",
+        "Offender Visitation Eligible": "YES",
+    }
+    assert page.tdcj_number == "01234567"
+
+
+def test_missing_cell():
+    page = parse_detail_page(fixture("detail_page.html"))
+    assert [o.case_no for o in page.offenses] == ["0996531", None, "D-1-DC-12-904411"]
+    assert page.offenses[1].sentence == "180 Days"
+    table = offense_table(page.headers, page.rows)
+    assert table["Case No."]["1"] is None
+
+
+def test_result_link():
+    assert find_result_link(fixture("results_page.html")) \
+        == "/OffenderSearch/offenderDetail.action?sid=04213377"
+    assert find_result_link(fixture("no_result_page.html")) is None
+
+
+def test_page_without_admin_section():
+    with pytest.raises(ValueError):
+        parse_detail_page(fixture("results_page.html"))
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from mongo_writer import BufferedWriter
+from rescrape import content_hash
+
+
+def test_writes_are_stamped_for_the_sync():
+    db = mongomock.MongoClient().tdcj
+    writer = BufferedWriter(db, pmode=0, aggregates=False)
+    entry = {"_id": "00000001", "Race": "W", "offenses": [], "accessed": datetime(2026, 1, 1)}
+    entry["hash"] = content_hash(entry)
+
+    async def write(doc):
+        await writer.insert("inmates", dict(doc))
+        await writer.flush()
+        return db.inmates.find_one({"_id": doc["_id"]})["written"]
+
+    first = asyncio.run(write(entry))
+    # rescraped without changes: only accessed and written move
+    second = asyncio.run(write(dict(entry, accessed=datetime(2026, 2, 1))))
+    assert first <= second
+    assert db.inmates.find_one()["accessed"] == datetime(2026, 2, 1)
+    assert db.inmates.find_one()["hash"] == entry["hash"]
+
+
+def test_failed_number_set_saves_are_retried_with_the_next_flush(monkeypatch):
+    from numberset import NumberSets
+
+    db = mongomock.MongoClient().tdcj
+    numbers = NumberSets()
+    writer = BufferedWriter(db, pmode=0, numbers=numbers, savewait=0.0, aggregates=False)
+    save = NumberSets.save
+    failures = [RuntimeError("numberset save conflict")]
+
+    def flaky(self, db, *args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return save(self, db, *args, **kwargs)
+
+    monkeypatch.setattr(NumberSets, "save", flaky)
+
+    async def run():
+        await writer.insert("unassigned", {"_id": 100000, "accessed": datetime.now()})
+        await writer.flush()
+        saved = numbers.saved
+        assert [(n, hit) for n, hit, _ in numbers.pending] == [(100000, False)]
+        await writer.insert("unassigned", {"_id": 100001, "accessed": datetime.now()})
+        await writer.flush()
+        assert numbers.saved > saved
+        # the final flush has nothing to retry with
+        failures.append(RuntimeError("numberset save conflict"))
+        with pytest.raises(RuntimeError):
+            await writer.flush(save=True)
+
+    asyncio.run(run())
+    stored = NumberSets.load(db)
+    assert 100000 in stored.unassigned and 100001 in stored.unassigned
@@ -0,0 +1,80 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from numberset import NumberSets, RangeSet
+
+
+def test_processes_saving_the_same_sets_keep_each_others_numbers():
+    db = mongomock.MongoClient().tdcj
+    NumberSets(RangeSet(range(100, 110)), RangeSet([105])).save(db)
+    first, second = NumberSets.load(db), NumberSets.load(db)
+    first.record(200, True)
+    first.record(105, True)
+    second.record(300, False)
+    first.save(db)
+    second.save(db)
+    second.record(301, False)
+    second.save(db)
+
+    sets = NumberSets.load(db)
+    assert len(sets.checked) == 13
+    assert 200 in sets.checked and 300 in sets.unassigned and 301 in sets.unassigned
+    # reassigned by the first process, which the second never saw
+    assert 105 in sets.checked and 105 not in sets.unassigned
+    assert db.numbersets.find_one({"_id": "sets"})["version"] == 4
+
+
+def test_save_gives_up_if_the_sets_keep_changing(monkeypatch):
+    db = mongomock.MongoClient().tdcj
+    NumberSets(RangeSet([1])).save(db)
+    sets = NumberSets.load(db)
+    sets.record(2, True)
+    replace_one = db.numbersets.replace_one
+
+    def racing(filter, doc):
+        # another process saves first every time
+        db.numbersets.update_one({"_id": "sets"}, {"$inc": {"version": 1}})
+        return replace_one(filter, doc)
+
+    monkeypatch.setattr(db.numbersets, "replace_one", racing)
+    with pytest.raises(RuntimeError):
+        sets.save(db, retries=2)
+    assert [(n, hit) for n, hit, _ in sets.pending] == [(2, True)]
+
+
+def test_sets_built_from_the_old_collection_keep_when_numbers_were_checked():
+    from datetime import datetime
+    from rescrape import RescrapeQueue
+
+    db = mongomock.MongoClient().tdcj
+    db.unassigned.insert_many([
+        {"_id": 100001, "accessed": "20200101_1200"},
+        {"_id": 100002, "accessed": datetime(2021, 1, 1)},
+        # assigned again since, the old collection wasn't cleaned up
+        {"_id": 100003, "accessed": datetime(2021, 1, 1)},
+        {"_id": 205000},
+    ])
+    db.inmates.insert_many([{"_id": "00100000"}, {"_id": "00100003"}])
+    NumberSets.load_or_build(db)
+
+    sets = NumberSets.load(db)
+    assert list(sets.checked) == [100000, 100001, 100002, 100003, 205000]
+    assert list(sets.unassigned) == [100001, 100002, 205000]
+    assert sets.last_checked(100001) == datetime(2021, 1, 1)
+    assert sets.last_checked(205000) is None
+    sets.record(205001, False, datetime(2022, 1, 1))
+    sets.save(db)
+    # the block checked longest ago first
+    assert RescrapeQueue.unassigned(db, datetime(2023, 1, 1)).pop(3) == [100001, 100002, 205000]
+
+
+def test_merge_keeps_saved_unassigned_numbers_but_not_over_inmates():
+    from datetime import datetime
+
+    built = NumberSets(RangeSet([1, 2, 3]), RangeSet([3]))
+    saved = NumberSets(RangeSet(range(1, 10)), RangeSet([2, 5, 6]), {0: datetime(2022, 1, 1)})
+    built.merge(saved)
+    assert list(built.checked) == list(range(1, 10))
+    # 2 has an inmate in the collections
+    assert list(built.unassigned) == [3, 5, 6]
+    assert built.last_checked(5) == datetime(2022, 1, 1)
@@ -0,0 +1,30 @@
+import asyncio
+from pacing import AIMDController
+
+
+def test_slot_is_given_back_when_cancelled_waiting_for_its_turn():
+    pacer = AIMDController(4, rate=0.5, pmode=0)
+
+    async def lookup():
+        async with pacer.slot():
+            pass
+
+    async def run():
+        # the first lookup starts at once, the second waits two seconds
+        await lookup()
+        waiting = asyncio.create_task(lookup())
+        await asyncio.sleep(0.05)
+        assert pacer.inflight == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    asyncio.run(run())
+    assert pacer.inflight == 0
+    assert len(pacer.latencies) == 1
+
+
+def test_p90_is_the_nearest_rank_of_small_windows():
+    pacer = AIMDController(4, window=3, targetlatency=100.0, pmode=0)
+    for latency in (1.0, 2.0, 10.0):
+        pacer.record(latency, True)
+    assert pacer.p90 == 10.0
@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("psycopg2")
+import pgpipe
+
+
+def test_sync_picks_up_late_writes_and_unstamped_documents():
+    watermark = datetime(2026, 5, 1, 12, 0)
+    before, after = watermark - timedelta(hours=1), watermark + timedelta(hours=1)
+    inmates = mongomock.MongoClient().tdcj.inmates
+    inmates.insert_many([
+        # re-parsed from an old page after the last sync
+        {"_id": "00000001", "accessed": before, "written": after},
+        {"_id": "00000002", "accessed": before, "written": before},
+        # written before documents were stamped
+        {"_id": "00000003", "accessed": after},
+        {"_id": "00000004", "accessed": after.strftime("%Y%m%d_%H%M")},
+        {"_id": "00000005", "accessed": before.strftime("%Y%m%d_%H%M")},
+    ])
+    synced = {d["_id"] for d in inmates.find(pgpipe._written_since(watermark))}
+    assert synced == {"00000001", "00000003", "00000004"}
+    assert inmates.count_documents(pgpipe._written_since(None)) == 5
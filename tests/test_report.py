@@ -0,0 +1,41 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from canonical import Canonicalizer
+from report import compare_races, rebuild_aggregates, summary, update_aggregates
+
+
+def inmate(tdcjnum, race, offense, days):
+    return {
+        "_id": f"{tdcjnum:08d}", "Race": race, "schema_version": 2,
+        "offenses": [{"offense": offense, "county": "HARRIS", "sentence_days": days}],
+    }
+
+
+def test_aggregates_group_spellings_of_an_offense():
+    db = mongomock.MongoClient().tdcj
+    inmates = [
+        inmate(1, "B", "BURG OF HAB", 3650), inmate(2, "B", "BURGLARY HABITATION", 1825),
+        inmate(3, "W", "BURG HAB", 730), inmate(4, "W", "BURGLARY OF HABITATION", 365),
+        inmate(5, "W", "BURG OF HAB", 365),
+    ]
+    update_aggregates(db, inmates)
+    assert list(summary(db, ("offense",))) == [("BURGLARY OF HABITATION",)]
+    # a removed inmate leaves the same canonical group
+    update_aggregates(db, removed=inmates[-1:])
+    assert summary(db, ("offense",))[("BURGLARY OF HABITATION",)]["n"] == 4
+
+    results = compare_races(db, ["BURG OF HAB", "BURG HAB"], races=("B", "W"))
+    assert [r["offense"] for r in results] == ["BURGLARY OF HABITATION"]
+    assert results[0]["n"] == (2, 2)
+
+
+def test_rebuild_applies_changed_rules():
+    db = mongomock.MongoClient().tdcj
+    db.inmates.insert_many([inmate(1, "B", "BURG OF HAB", 3650), inmate(2, "W", "HOME INVASION", 730)])
+    rebuild_aggregates(db)
+    assert len(summary(db, ("offense",))) == 2
+
+    rules = Canonicalizer({"BURGLARY OF HABITATION": ["HOME INVASION"]})
+    rebuild_aggregates(db, canonicalizer=rules)
+    assert list(summary(db, ("offense",))) == [("BURGLARY OF HABITATION",)]
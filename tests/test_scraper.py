@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("aiohttp")
+import tdcj_scraper
+from simulator import SiteSimulator
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(tdcj_scraper, "MongoClient", lambda *args, **kwargs: client)
+    return client.tdcj
+
+
+async def scrape(db, sim, managers, until, timeout=20.0, **kwargs):
+    """
+    Runs the scraper's workers and the managers named against a simulator
+    until until(scraper) holds, or the workers end.
+
+    Returns:
+        tuple: (scraper, number of workers that ended)
+    """
+    server, url = await sim.start()
+    scr = tdcj_scraper.Scraper(
+        True, 1.0, 0.05, 0, 4, 50, engine="http", flushwait=0.5, rate=1000.0, starturl=url,
+        **kwargs,
+    )
+    tasks = [
+        asyncio.create_task(scr.supervise([getattr(scr, m)() for m in managers])),
+        asyncio.create_task(scr.writer.run()),
+    ]
+    workers = [asyncio.create_task(w.work()) for w in scr.workers]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not until(scr) and not all(w.done() for w in workers) and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    ended = sum(w.done() for w in workers)
+    for task in tasks + workers:
+        task.cancel()
+    await asyncio.gather(*tasks, *workers, return_exceptions=True)
+    await scr.close()
+    server.close()
+    return scr, ended
+
+
+def test_lease_workers_wait_for_claimed_ranges(db):
+    db.admin.insert_one({"_id": "tail", "value": 100099})
+    sim = SiteSimulator(density=0.5)
+
+    async def run():
+        return await scrape(db, sim, ["leasemanager"], lambda scr: False,
+            scheduler="leases", leasesize=50)
+
+    scr, ended = asyncio.run(run())
+    # the workers only end on STOP, after every claimed number was looked up
+    assert ended == 4
+    assert sim.served["search"] == 100
+    assert db.inmates.count_documents({}) + len(scr.numbers.unassigned) == 100
+    assert db.inmates.count_documents({}) == sum(
+        sim.inmate(n) is not None for n in range(100000, 100100))
+
+
+def test_rescrape_managers_run_after_the_tail_sweep(db):
+    from datetime import datetime, timedelta
+    import synthetic
+    from detail_parser import parse_detail_page, to_entry
+
+    sim = SiteSimulator(density=0.5)
+    numbers = range(100000, 100020)
+    accessed = datetime.now() - timedelta(days=30)
+    for n in numbers:
+        inmate = sim.inmate(n)
+        # stored the old way, moved into the number sets when the scraper starts
+        if inmate is None:
+            db.unassigned.insert_one({"_id": n, "accessed": accessed})
+        else:
+            page = synthetic.detail_page(*inmate)
+            db.inmates.insert_one(to_entry(parse_detail_page(page), accessed))
+    # nothing left for the tail manager to sweep
+    db.admin.insert_one({"_id": "tail", "value": 100000})
+
+    async def run():
+        return await scrape(
+            db, sim, ["tailmanager", "headMGR", "releaseMGR", "recidivismMGR"],
+            lambda scr: sim.served.get("search", 0) >= len(numbers) + 10
+                and scr.db.admin.find_one({"_id": "head"}) is not None,
+            rescrapebudget=86400 * 100,
+        )
+
+    scr, ended = asyncio.run(run())
+    assert ended == 0
+    assert sim.served["search"] >= len(numbers) + 10
+    # each re-scrape manager tops the queue up to about a batch, no further
+    assert scr.q.qsize() <= 2 * scr.batchsize
+    assert db.admin.find_one({"_id": "head"})["value"] > max(numbers)
+    assert db.inmates.count_documents({"accessed": {"$lte": accessed}}) < sum(
+        sim.inmate(n) is not None for n in numbers)
+
+
+def test_unparseable_detail_pages_are_skipped_without_ending_the_workers(db):
+    import synthetic
+    from metrics import LOOKUPS
+
+    class ResultsForDetails(SiteSimulator):
+        # serves the search results again where the detail page belongs
+        async def respond(self, method, target, body):
+            status, html = await super().respond(method, target, body)
+            if "offenderDetail.action" in target and status == 200:
+                inmate = self.inmate(int(target.rsplit("=", 1)[-1]))
+                return status, synthetic.results_page(inmate[0], target)
+            return status, html
+
+    db.admin.insert_one({"_id": "tail", "value": 100049})
+    sim = ResultsForDetails(density=0.5)
+    before = LOOKUPS.values.get("parse_error", 0)
+
+    async def run():
+        return await scrape(db, sim, ["tailmanager"], lambda scr: False)
+
+    scr, ended = asyncio.run(run())
+    hits = sum(sim.inmate(n) is not None for n in range(100000, 100050))
+    assert ended == 4
+    assert sim.served["detail"] == tdcj_scraper.PARSE_ATTEMPTS * hits
+    assert LOOKUPS.values["parse_error"] - before == tdcj_scraper.PARSE_ATTEMPTS * hits
+    assert db.inmates.count_documents({}) == 0
+    assert len(scr.numbers.unassigned) == 50 - hits
+    assert not scr.parsefailures
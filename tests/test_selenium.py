@@ -0,0 +1,43 @@
+import asyncio
+import os
+import pytest
+
+pytest.importorskip("selenium")
+import tdcj_scraper
+from pacing import AIMDController
+from simulator import SiteSimulator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    # the browser workers start the chromedriver kept in src
+    if not os.path.exists(os.path.join(ROOT, "src", "chromedriver")):
+        pytest.skip("needs src/chromedriver and Chrome")
+    monkeypatch.chdir(ROOT)
+    return tdcj_scraper.ScraperWorker(
+        None, None, None, True, 2.0, 0, AIMDController(1), None, None, None, 0, 0, None
+    )
+
+
+def test_browser_worker_waits_for_each_page_to_load(worker):
+    # slow pages: the worker has no sleep left to hide a click that
+    # hasn't navigated yet, it has to wait for the next page
+    sim = SiteSimulator(density=0.5, searchlatency="fixed:0.3", detaillatency="fixed:0.3")
+
+    async def run():
+        server, url = await sim.start()
+        worker.starturl = url
+        try:
+            return {n: await worker.scrape_inmate(n) for n in range(100000, 100010)}
+        finally:
+            await worker.close()
+            server.close()
+
+    found = asyncio.run(run())
+    for n, result in found.items():
+        if sim.inmate(n) is None:
+            assert result == n
+        else:
+            assert result["TDCJ Number"] == str(n).zfill(8)